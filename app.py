@@ -2,114 +2,410 @@
 # Este archivo contendrá el backend de la aplicación para generar PRDs e Historias de Usuario.
 
 import os
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core import VectorStoreIndex
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core.schema import Document
-import chromadb
 from gitingest import ingest_async
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-load_dotenv()
+load_dotenv() # Antes de importar los módulos locales, que leen su configuración del entorno al importarse
+from index_state import (
+    ManifestDiff, collection_name_for, project_id_for, load_manifest_state, save_manifest, diff_manifests,
+    load_ingest_snapshot, save_ingest_snapshot, manifest_fingerprint, load_lexical_index, save_lexical_index,
+)
+from project_files import (
+    INGEST_BACKEND, INGEST_MAX_WORKERS, build_file_tree, iter_file_batches, read_files, scan_paths, scan_project,
+    summarize_files,
+)
+from git_changes import changed_paths_since, head_commit
+from lexical_index import LexicalIndex
+from chunking import CodeAwareNodeParser, detect_language
+from retrieval import PROJECT_CONTEXT_MODE, build_retrieval_query, register_index, retrieve_project_context
+from providers import embedding_model_id, get_registry
+from completion_cache import get_completion_cache, llm_namespace, prompt_key
+from llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_BULK, PRIORITY_INTERACTIVE, get_llm_scheduler
+from prompt_builder import ConversationSummarizer, build_conversation_context, fit_sections
+from utils import estimate_tokens
+from template_registry import get_template_registry
+from document_sections import (
+    DOCUMENT_NAMES, DEPENDENT_DOCUMENTS, dependent_sections, find_section, load_document_sections, normalize_section,
+    outline, parse_sections, render_sections, rendered_documents, replace_section, replace_sections, section_span,
+    serialize_document_sections,
+)
+from embedding_pipeline import EmbeddingPipeline, EmbeddingStats, chunk_id_func, delete_node_ids, existing_node_ids
+from metrics import record_cache_lookup, record_llm_tokens, record_stage, record_stage_error, span, usage_tokens
 
 # --- Configuración de API Keys ---
 # Asegúrate de configurar tu GOOGLE_API_KEY como variable de entorno
 # os.environ["GOOGLE_API_KEY"] = "TU_API_KEY_AQUI" 
-# La línea de abajo es para fines de demostración, en producción usa variables de entorno seguras.
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
+# Sin clave solo se pueden usar los proveedores locales (Ollama y EMBEDDING_BACKEND local).
 
 # --- Fase 1: Indexación y Contextualización del Proyecto Local ---
 
-async def index_project(project_path: str, force_index: bool = False):
+# Callback de progreso de index_project: (fase, procesados, total, mensaje, throughput)
+IndexProgressCallback = Callable[..., None]
+
+
+def detect_project_changes(project_path: str, previous_files: Optional[Dict[str, Dict]],
+                           indexed_commit: Optional[str] = None,
+                           full_scan: bool = False) -> Tuple[Dict[str, Dict], Optional[str]]:
+    """
+    Devuelve (manifiesto actual del proyecto, commit HEAD o None si no es un repositorio git).
+    Si hay un manifiesto anterior con su commit y el proyecto usa git, solo se revisan las rutas que
+    git da por cambiadas desde ese commit (más los cambios sin confirmar); si no, o con full_scan,
+    se recorre el proyecto entero.
+    """
+    head = head_commit(project_path)
+    if previous_files is not None and indexed_commit and head and not full_scan:
+        candidates = changed_paths_since(project_path, indexed_commit, previous_files)
+        if candidates is not None:
+            return scan_paths(project_path, previous_files, candidates), head
+        print("No se pueden obtener los cambios solo con git (p. ej. cambiaron las reglas de exclusión); escaneando el proyecto completo.")
+    return scan_project(project_path, previous_files), head
+
+
+# Sin git, comprobar si el índice está desactualizado exige recorrer el proyecto entero: como mucho
+# una vez cada INDEX_STALE_CHECK_TTL segundos por proyecto (0 = en cada comprobación)
+INDEX_STALE_CHECK_TTL = float(os.getenv("INDEX_STALE_CHECK_TTL", "300"))
+_last_full_check: Dict[str, float] = {}  # colección -> momento (monotonic) del último escaneo completo
+
+
+def is_index_stale(project_path: str, collection_name: Optional[str] = None) -> bool:
+    """
+    Indica si el índice del proyecto está desactualizado: no existe o se han añadido, modificado o
+    eliminado archivos desde la última indexación. En repositorios git solo se revisan las rutas
+    que git da por cambiadas, así que se comprueba siempre; en el resto de proyectos hace falta un
+    escaneo completo, que se omite si el proyecto se escaneó (o indexó) hace menos de INDEX_STALE_CHECK_TTL.
+    """
+    collection_name = collection_name or collection_name_for(project_id_for(project_path))
+    state = load_manifest_state(collection_name, project_path)
+    if state is None:
+        return True
+    if not (state["git_commit"] and head_commit(project_path)):
+        last_check = _last_full_check.get(collection_name)
+        if last_check is not None and time.monotonic() - last_check < INDEX_STALE_CHECK_TTL:
+            return False
+        _last_full_check[collection_name] = time.monotonic()
+    current_files, _ = detect_project_changes(project_path, state["files"], state["git_commit"])
+    return diff_manifests(state["files"], current_files).has_changes
+
+
+def _save_index_state(chroma_collection, collection_name: str, project_path: str,
+                      files: Dict[str, Dict], git_commit: Optional[str]) -> None:
+    """Guarda el manifiesto y registra el commit indexado también en los metadatos de la colección."""
+    save_manifest(collection_name, project_path, files, git_commit)
+    _last_full_check[collection_name] = time.monotonic()  # El manifiesto recién guardado está al día
+    if git_commit:
+        chroma_collection.modify(metadata={**(chroma_collection.metadata or {}), "indexed_commit": git_commit})
+
+
+class EmbeddingModelMismatchError(ValueError):
+    """La colección se indexó con otro modelo de embeddings: sus vectores no son comparables con los del actual."""
+
+
+def _check_embedding_model(chroma_collection, embed_model, recreate: bool = False):
+    """
+    Comprueba que la colección se indexó con el modelo de embeddings configurado y lo registra en sus
+    metadatos (colecciones nuevas o anteriores a este registro). Si no coincide, lanza
+    EmbeddingModelMismatchError o, con recreate, vacía la colección para re-indexarla con el actual.
+    Devuelve la colección que se debe usar.
+    """
+    metadata = chroma_collection.metadata or {}
+    indexed_model = metadata.get("embedding_model")
+    current_model = embedding_model_id(embed_model)
+    if indexed_model and indexed_model != current_model:
+        if not recreate:
+            raise EmbeddingModelMismatchError(
+                f"El índice del proyecto se creó con el modelo de embeddings '{indexed_model}' y el configurado es "
+                f"'{current_model}': sus vectores no son comparables. Re-indexa el proyecto con 'Forzar re-indexación' "
+                f"para regenerarlo con el modelo actual."
+            )
+        print(f"El índice se creó con el modelo de embeddings '{indexed_model}'; regenerándolo con '{current_model}'...")
+        db = get_registry().get_chroma_client()
+        db.delete_collection(chroma_collection.name)
+        chroma_collection = db.create_collection(chroma_collection.name)
+        metadata = {}
+    if metadata.get("embedding_model") != current_model:
+        chroma_collection.modify(metadata={**metadata, "embedding_model": current_model})
+    return chroma_collection
+
+
+def _load_lexical_index(chroma_collection, collection_name: str, project_path: str, index_version: str) -> LexicalIndex:
+    """
+    Índice léxico (BM25) guardado del proyecto. Si falta (índices creados antes de tenerlo) o no
+    corresponde a index_version, se reconstruye a partir de los chunks de la colección y se guarda.
+    """
+    data = load_lexical_index(collection_name, project_path)
+    if data is not None and data.get("version") == index_version:
+        return LexicalIndex.from_dict(data)
+    print("Índice léxico no encontrado o desactualizado; reconstruyéndolo desde ChromaDB...")
+    lexical_index = LexicalIndex.from_collection(chroma_collection)
+    save_lexical_index(collection_name, project_path, index_version, lexical_index.to_dict())
+    return lexical_index
+
+
+async def load_existing_index(project_path: str, collection_name: Optional[str] = None,
+                              indexed_files: Optional[Dict[str, Dict]] = None):
+    """
+    Carga el índice ya guardado del proyecto tal cual, sin escanear el proyecto ni generar embeddings
+    (las actualizaciones son cosa de index_project / los trabajos de indexing_jobs.py).
+    indexed_files: manifiesto de los archivos indexados, si el llamador ya lo tiene.
+    Devuelve (índice, árbol de archivos o None si no se guardó), o None si no hay un índice completo
+    (sin manifiesto, la colección es de una indexación que no terminó) o la colección está vacía.
+    Lanza EmbeddingModelMismatchError si la colección es de otro modelo de embeddings.
+    """
+    collection_name = collection_name or collection_name_for(project_id_for(project_path))
+    if indexed_files is None:
+        state = await asyncio.to_thread(load_manifest_state, collection_name, project_path)
+        if state is None:
+            return None
+        indexed_files = state["files"]
+    registry = get_registry()
+    db = registry.get_chroma_client()
+    try:
+        chroma_collection = db.get_collection(collection_name)
+    except Exception:
+        return None  # La colección no existe
+    if chroma_collection.count() == 0:
+        return None
+    embed_model = registry.get_embed_model()
+    chroma_collection = _check_embedding_model(chroma_collection, embed_model)
+    print("Cargando índice existente de ChromaDB...")
+    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+    index = VectorStoreIndex.from_vector_store(vector_store=vector_store, embed_model=embed_model)
+    index_version = manifest_fingerprint(indexed_files)
+    lexical_index = await asyncio.to_thread(
+        _load_lexical_index, chroma_collection, collection_name, project_path, index_version)
+    register_index(index, index_version, embed_model, lexical_index)
+    print("Índice existente de ChromaDB cargado con éxito.")
+    snapshot = load_ingest_snapshot(collection_name, project_path)
+    return index, snapshot[0] if snapshot is not None else None
+
+
+async def index_project(project_path: str, force_index: bool = False, collection_name: Optional[str] = None,
+                        progress_callback: Optional[IndexProgressCallback] = None):
     """
     Función para indexar el proyecto local.
     Pasos:
-    1. Ejecutar gitingest sobre project_path para obtener una representación del código.
-    2. Aplicar chunking con LlamaIndex.
-    3. Generar embeddings con GoogleGenAIEmbedding.
-    4. Almacenar en ChromaDB.
+    1. Ejecutar gitingest sobre project_path para obtener el árbol de archivos (se guarda junto al índice).
+    2. Aplicar chunking por archivo, consciente del código (funciones/clases).
+    3. Generar embeddings con el modelo configurado (EMBEDDING_BACKEND), en lotes concurrentes. El
+       modelo queda registrado en la colección y no se consulta con otro distinto.
+    4. Almacenar en ChromaDB cada lote completado (un indexado interrumpido se reanuda) y añadir sus
+       chunks al índice léxico (BM25) usado en la búsqueda híbrida.
+    Si existe un manifiesto de una indexación anterior, solo se re-embeben los archivos
+    añadidos o modificados y se borran los vectores de los archivos eliminados. Sin force_index, el
+    índice existente se carga tal cual si el proyecto no ha cambiado y se actualiza de forma
+    incremental si ha cambiado (en repositorios git, comparando el commit indexado con el árbol de
+    trabajo); con force_index se revisa el proyecto entero.
+    Cada proyecto usa su propia colección (por defecto derivada de su ruta, ver index_state.project_id_for).
+    Si se pasa progress_callback, se llama como progress_callback(fase, processed=, total=, message=)
+    al avanzar por las fases: loading, scanning, ingest, chunking, embedding y persisting.
     """
     print(f"Iniciando indexación del proyecto en: {project_path}")
+    report = progress_callback or (lambda *args, **kwargs: None)
+
+    registry = get_registry()
+    db = registry.get_chroma_client()
+    chroma_collection_name = collection_name or collection_name_for(project_id_for(project_path))
+
+    # El manifiesto se guarda al terminar la indexación: sin él, la colección es de una
+    # indexación interrumpida o cancelada y hay que completarla (se reanuda donde quedó).
+    indexed_state = load_manifest_state(chroma_collection_name, project_path)
+    previous_files = indexed_state["files"] if indexed_state is not None else None
+    previous_commit = indexed_state["git_commit"] if indexed_state is not None else None
+    current_files = None
+    changes = None
+
+    # Sin force_index, comprobar si el proyecto ha cambiado desde la última indexación (con git, solo
+    # las rutas que git da por cambiadas): si no ha cambiado se carga el índice tal cual.
+    if not force_index and previous_files is not None:
+        report("scanning", message="Comprobando cambios desde la última indexación...")
+        with span("scanning"):
+            current_files, git_commit = await asyncio.to_thread(
+                detect_project_changes, project_path, previous_files, previous_commit)
+        changes = diff_manifests(previous_files, current_files)
+        if changes.has_changes:
+            print("El índice está desactualizado; actualizando solo los archivos que han cambiado...")
 
-    db = chromadb.PersistentClient(path="./chroma_db")
-    chroma_collection_name = "project_index"
-    
     # Verificar si el índice ya existe y si no se ha solicitado una indexación forzada
-    if not force_index and db.count_collections() > 0: # Check if any collection exists to avoid error if 'project_index' isn't the only one
+    if changes is not None and not changes.has_changes:
         try:
-            chroma_collection = db.get_collection(chroma_collection_name)
-            if chroma_collection.count() > 0: # Check if the specific collection has data
-                print("Cargando índice existente de ChromaDB...")
-                vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-                embed_model = GoogleGenAIEmbedding(model_name="text-embedding-004")
-                index = VectorStoreIndex.from_vector_store(
-                    vector_store=vector_store,
-                    embed_model=embed_model
-                )
-                print("Índice existente de ChromaDB cargado con éxito.")
-                # We need to retrieve the original tree if we're loading from existing.
-                # For now, we'll return a placeholder or re-ingest if not found easily.
-                # A more robust solution would store the tree in ChromaDB as well.
-                # For this task, we'll assume a fresh ingest is fine for now if not found easily.
-                
-                # To simplify for now, if we loaded from existing, we don't have the tree readily available.
-                # In a real app, you might store it. For this feature, let's re-ingest to get the tree
-                # even if the index exists, or add a way to store/retrieve the tree.
-                # For simplicity, if we hit this, let's assume we re-ingest to get the tree.
-                # TODO: Improve this to actually load the tree from storage if index exists.
-                print("Re-ingesting project to retrieve file tree for existing index...")
-                summary, tree, gitingest_content = await ingest_async(project_path)
+            report("loading", message="Cargando índice existente de ChromaDB...")
+            loaded = await load_existing_index(project_path, chroma_collection_name, current_files)
+            if loaded is not None:
+                index, tree = loaded
+                if git_commit != previous_commit:
+                    # Commits nuevos sin cambios en los archivos indexados: solo se actualiza el commit
+                    _save_index_state(db.get_collection(chroma_collection_name), chroma_collection_name,
+                                      project_path, current_files, git_commit)
+                # El árbol de gitingest se guarda junto al índice; solo si falta (índices creados
+                # antes de guardarlo) se vuelve a ingerir el proyecto para reconstruirlo.
+                if tree is None:
+                    print("Árbol de archivos no encontrado para el índice existente; re-ingiriendo el proyecto...")
+                    summary, tree, gitingest_content = await ingest_async(project_path)
+                    save_ingest_snapshot(chroma_collection_name, project_path, tree, summary)
                 return index, tree
+        except EmbeddingModelMismatchError:
+            raise
         except Exception as e:
             print(f"No se pudo cargar el índice existente o la colección no existe (error: {e}). Procediendo con la indexación.")
             # If there's an error loading, we'll proceed to re-index.
 
     print("Creando o re-indexando el proyecto...")
-    # Paso 1: Ejecutar gitingest
-    try:
-        print(f"Procesando el proyecto con gitingest: {project_path}")
-        summary, tree, gitingest_content = await ingest_async(project_path)
-        print("gitingest completado. Contenido extraído.")
-    except Exception as e:
-        print(f"Error al ejecutar gitingest: {e}")
-        gitingest_content = "Este es un contenido de fallback porque gitingest falló o no se pudo ejecutar. Asegúrate de que el directorio del proyecto exista y sea válido."
-        tree = {"name": "Error: Could not retrieve file tree.", "type": "dir", "children": []} # Fallback tree
-    
-    # Ensure gitingest_content is a string, even if ingest_async somehow returns None
-    if gitingest_content is None:
-        gitingest_content = "No content extracted by gitingest."
-
-    # Convertir el contenido de gitingest a un objeto Document de LlamaIndex
-    documents = [Document(text=gitingest_content)]
-
-    # Paso 2: Aplicar chunking con LlamaIndex
-    node_parser = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
-    nodes = node_parser.get_nodes_from_documents(documents)
-    print(f"Documento dividido en {len(nodes)} chunks.")
-
-    # Paso 3: Generar embeddings con GoogleGenAIEmbedding
-    embed_model = GoogleGenAIEmbedding(model_name="text-embedding-004")
-
-    # Paso 4: Almacenar en ChromaDB
-    # Si llegamos aquí, significa que necesitamos crear o re-crear el índice.
-    # Asegurémonos de tener la colección correcta.
     chroma_collection = db.get_or_create_collection(chroma_collection_name)
-    
-    # Es importante borrar los datos existentes si estamos forzando la indexación
-    # o si no pudimos cargar un índice válido.
-    if chroma_collection.count() > 0 and (force_index or "No se pudo cargar" in e.__str__()): # Simple check for re-index reason
-        print(f"Limpiando {chroma_collection.count()} elementos existentes en ChromaDB para re-indexar...")
-        chroma_collection.delete(where={}) # Borrar todos los datos
+    # Los vectores guardados solo sirven si son del modelo de embeddings actual; con force_index se regeneran
+    embed_model = registry.get_embed_model()
+    chroma_collection = _check_embedding_model(chroma_collection, embed_model, recreate=force_index)
+
+    # Comparar el manifiesto (ruta, tamaño, mtime, hash) del último indexado con el estado actual
+    # del proyecto para re-embeber solo los archivos añadidos o modificados.
+    # Con force_index se recorre el proyecto entero en lugar de confiar en git.
+    if current_files is None:
+        report("scanning", message="Buscando archivos modificados...")
+        with span("scanning"):
+            current_files, git_commit = await asyncio.to_thread(
+                detect_project_changes, project_path, previous_files, previous_commit, force_index)
+
+    # Sin manifiesto válido no sabemos qué contiene la colección: re-indexación completa.
+    full_reindex = previous_files is None or chroma_collection.count() == 0
+    if full_reindex:
+        changes = ManifestDiff(added=sorted(current_files))
+    else:
+        changes = diff_manifests(previous_files, current_files)
+    print(f"Cambios detectados: {len(changes.added)} añadidos, {len(changes.modified)} modificados, {len(changes.removed)} eliminados.")
+
+    # Paso 1: Árbol de archivos del proyecto, solo si cambió su estructura. Con INGEST_BACKEND=native
+    # (por defecto) se construye a partir del escaneo; con "gitingest" se ejecuta gitingest.
+    snapshot = load_ingest_snapshot(chroma_collection_name, project_path)
+    if snapshot is not None and not changes.added and not changes.removed:
+        print("Estructura del proyecto sin cambios; reutilizando el árbol de archivos guardado.")
+        tree, summary = snapshot
+    elif INGEST_BACKEND == "gitingest":
+        try:
+            print(f"Procesando el proyecto con gitingest: {project_path}")
+            report("ingest", total=len(current_files), message="Generando el árbol de archivos con gitingest...")
+            with span("ingest"):
+                summary, tree, gitingest_content = await ingest_async(project_path)
+            save_ingest_snapshot(chroma_collection_name, project_path, tree, summary)
+            print("gitingest completado. Árbol de archivos guardado.")
+        except Exception as e:
+            print(f"Error al ejecutar gitingest: {e}")
+            tree = {"name": "Error: Could not retrieve file tree.", "type": "dir", "children": []} # Fallback tree
+    else:
+        report("ingest", total=len(current_files), message="Generando el árbol de archivos...")
+        with span("ingest"):
+            tree = build_file_tree(project_path, list(current_files))
+        summary = summarize_files(project_path, current_files)
+        save_ingest_snapshot(chroma_collection_name, project_path, tree, summary)
 
     vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    for file_path in changes.removed:
+        vector_store.delete(file_path)
 
-    index = VectorStoreIndex(
-        nodes, 
-        storage_context=storage_context, 
+    # Índice léxico (BM25) de los mismos chunks: en una re-indexación incremental se parte del guardado
+    # y se reemplazan los chunks de los archivos que cambian.
+    if full_reindex:
+        lexical_index = LexicalIndex()
+    else:
+        lexical_index = await asyncio.to_thread(_load_lexical_index, chroma_collection, chroma_collection_name,
+                                                project_path, manifest_fingerprint(previous_files))
+        lexical_index.remove_documents(changes.removed)
+
+    # Pasos 2-4 por lotes de archivos, para que la memoria dependa del tamaño del lote y no del
+    # proyecto: leer los archivos en paralelo (el siguiente lote se lee mientras se embebe el actual),
+    # dividirlos en chunks alineados con funciones/clases (ids deterministas para poder reanudar) y
+    # generar sus embeddings, guardando cada lote en ChromaDB.
+    node_parser = CodeAwareNodeParser(id_func=chunk_id_func)
+    embedding_stats = EmbeddingStats()
+    files_to_embed = changes.to_embed
+    files_done = 0
+    stream_started = time.perf_counter()
+
+    def report_progress(phase: str, message: str) -> None:
+        elapsed = time.perf_counter() - stream_started
+        report(phase, processed=files_done, total=len(files_to_embed), message=message,
+               throughput=files_done / elapsed if elapsed > 0 and files_done else None)
+
+    pipeline = EmbeddingPipeline(
+        embed_model, vector_store,
+        progress_callback=lambda stats: report_progress(
+            "embedding", f"{stats.embedded_chunks} chunks embebidos ({stats.chunks_per_second:.1f} chunks/s)"),
+    )
+    expected_ids: set = set()
+    batches = list(iter_file_batches(files_to_embed))
+    # El executor se cierra sin esperar: con `with` su shutdown(wait=True) bloquearía el event loop
+    # hasta que terminasen las lecturas pendientes si la indexación se cancela o falla.
+    read_executor = ThreadPoolExecutor(max_workers=max(1, INGEST_MAX_WORKERS), thread_name_prefix="ingest")
+    read_batch = lambda batch: asyncio.create_task(asyncio.to_thread(read_files, project_path, batch, read_executor))
+    next_read = None
+    try:
+        next_read = read_batch(batches[0]) if batches else None
+        for batch_number, batch in enumerate(batches):
+            report_progress("chunking", f"Leyendo y dividiendo el lote {batch_number + 1} de {len(batches)}...")
+            with span("read"): # Solo la espera: el lote se lee mientras se embebe el anterior
+                texts = await next_read
+            next_read = read_batch(batches[batch_number + 1]) if batch_number + 1 < len(batches) else None
+
+            # Un Document por archivo, con la ruta relativa como id para poder borrarlo/reemplazarlo después
+            documents = []
+            for file_path, text in texts:
+                if text is None:
+                    current_files.pop(file_path, None)
+                    continue
+                documents.append(Document(
+                    text=text,
+                    id_=file_path,
+                    metadata={"file_path": file_path, "language": detect_language(file_path)},
+                ))
+            with span("chunking"):
+                nodes = await asyncio.to_thread(node_parser.get_nodes_from_documents, documents)
+            batch_ids = {node.node_id for node in nodes}
+            expected_ids |= batch_ids
+
+            with span("embedding"):
+                await pipeline.run(nodes, embedding_stats)
+            lexical_index.remove_documents(batch)
+            lexical_index.add_nodes(nodes)
+            files_done += len(batch)
+
+            # Chunks de versiones anteriores de los archivos modificados que ya no existen
+            if not full_reindex:
+                stale_ids = set()
+                for file_path in set(batch) & set(changes.modified):
+                    stale_ids |= existing_node_ids(vector_store, where={"document_id": file_path}) - batch_ids
+                if stale_ids:
+                    delete_node_ids(vector_store, stale_ids)
+    finally:
+        if next_read is not None:
+            next_read.cancel()
+        read_executor.shutdown(wait=False, cancel_futures=True)
+    print(f"{files_done} archivos divididos en {embedding_stats.total_chunks} chunks.")
+    print(embedding_stats.summary())
+
+    # En una re-indexación completa, borrar lo que ya no corresponde a ningún chunk actual (los chunks
+    # guardados por un indexado interrumpido conservan su id y no se vuelven a embeber).
+    if full_reindex:
+        stale_ids = existing_node_ids(vector_store) - expected_ids
+        if stale_ids:
+            print(f"Eliminando {len(stale_ids)} chunks obsoletos de ChromaDB...")
+            delete_node_ids(vector_store, stale_ids)
+
+    report("persisting", processed=files_done, total=len(files_to_embed), message="Guardando el estado del índice...")
+
+    index = VectorStoreIndex.from_vector_store(
+        vector_store=vector_store,
         embed_model=embed_model
     )
+
+    index_version = manifest_fingerprint(current_files)
+    with span("persisting"):
+        await asyncio.to_thread(save_lexical_index, chroma_collection_name, project_path, index_version, lexical_index.to_dict())
+        _save_index_state(chroma_collection, chroma_collection_name, project_path, current_files, git_commit)
+    register_index(index, index_version, embed_model, lexical_index)
     print("Proyecto indexado y embeddings almacenados en ChromaDB.")
     return index, tree
 
@@ -121,101 +417,170 @@ def _is_initial_conversation_state(conversation_history: List[Dict[str, str]]) -
     return not conversation_history or \
            (len(conversation_history) == 1 and conversation_history[0].get("role") == "pm")
 
-from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.core.prompts import PromptTemplate
-from llama_index.llms.ollama import Ollama # Added for Ollama
+# Pool acotado para las consultas síncronas al índice: limita cuántas recuperaciones corren a la vez
+# sin bloquear el event loop de uvicorn.
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", "8"))
+_RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieval")
 
 def _get_llm(llm_provider: str):
-    if llm_provider == "google":
-        return GoogleGenAI(model="models/gemini-2.5-flash", max_output_tokens=8000)
-    elif llm_provider == "ollama":
-        return Ollama(model="gemma3n:e2b", request_timeout=360.0)
-    else:
-        raise ValueError("Invalid LLM provider specified.")
+    # Clientes de larga duración compartidos entre peticiones (ver providers.py)
+    return get_registry().get_llm(llm_provider)
+
+
+async def _complete(llm, prompt: str, on_token: Optional[Callable[[str], None]] = None,
+                    priority: int = PRIORITY_BULK) -> str:
+    """
+    Runs a completion. Without on_token it is a plain `acomplete`; with on_token the response is
+    streamed with `astream_complete` and every text delta is passed to on_token as it arrives.
+    Returns the full response text in both cases.
+    Responses are cached by (provider, model, prompt): a repeated prompt is answered from the
+    completion cache (as a single token when streaming) without calling the provider.
+    Provider calls go through the LLM scheduler (see llm_scheduler.py): they wait for a slot of the
+    provider by priority, and identical prompts already in flight share a single call.
+    The provider call is measured as the "llm" stage, with its prompt/completion token counts.
+    """
+    cache = get_completion_cache()
+    namespace = llm_namespace(llm)
+    if cache is not None:
+        cached = await cache.aget(namespace, prompt)
+        record_cache_lookup("completion", cached is not None)
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+    async def call(emit: Optional[Callable[[str], None]]) -> Tuple[str, int]:
+        with span("llm"):
+            if emit is None:
+                llm_response = await llm.acomplete(prompt)
+                text = llm_response.text
+                raw = llm_response.raw
+            else:
+                chunks: List[str] = []
+                raw = None
+                async for partial in await llm.astream_complete(prompt):
+                    raw = partial.raw
+                    if partial.delta:
+                        chunks.append(partial.delta)
+                        emit(partial.delta)
+                text = "".join(chunks)
+        # Tokens informados por el proveedor o, si no los informa, estimados
+        prompt_tokens, completion_tokens = usage_tokens(raw) or (estimate_tokens(prompt), estimate_tokens(text))
+        record_llm_tokens(getattr(llm, "model", None) or type(llm).__name__, prompt_tokens, completion_tokens)
+        if cache is not None and text:
+            await cache.aput(namespace, prompt, text)
+        return text, prompt_tokens + completion_tokens
+
+    provider = get_registry().llm_provider_of(llm)
+    return await get_llm_scheduler().run(provider, prompt_key(namespace, prompt), estimate_tokens(prompt),
+                                         call, on_token, priority)
+
+
+async def _summarize_conversation(previous_summary: str, new_turns: str, llm_provider: str) -> str:
+    summary_template = get_template_registry().prompt("conversation_summary")
+    prompt = summary_template.format(previous_summary=previous_summary or "(todavía no hay resumen)", new_turns=new_turns)
+    return await _complete(_get_llm(llm_provider), prompt, priority=PRIORITY_BACKGROUND)
+
+
+# Resúmenes incrementales de los turnos antiguos de cada conversación (ver prompt_builder.py)
+_conversation_summarizer = ConversationSummarizer(_summarize_conversation)
 
 
 # --- Fase 2: Descripción de Funcionalidad e Interacción Conversacional ---
 
-async def get_next_chat_question(conversation_history: List[Dict[str, str]], project_index, template_type: str, existing_prd_content: Optional[str] = None, llm_provider: str = "google"):
+async def get_next_chat_question(conversation_history: List[Dict[str, str]], project_index, template_type: str, existing_prd_content: Optional[str] = None, llm_provider: str = "google", on_token: Optional[Callable[[str], None]] = None, conversation_id: Optional[str] = None):
     """
     Genera la siguiente pregunta para el PM basada en el historial de conversación
     y el contexto del proyecto, utilizando un LLM.
+    Si se pasa on_token, la respuesta se genera en streaming y cada fragmento se entrega a on_token.
+    conversation_id identifica la conversación para reutilizar el resumen de sus turnos antiguos.
     """
     llm = _get_llm(llm_provider)
 
-    # Initialize as string, not PromptTemplate
-    full_prompt_content_string = _load_template_content("templates/prompts/base_chat_prompt.txt")
+    prompt_template = get_template_registry().prompt("base_chat")
 
+    # Instrucciones según el tipo de documento y la fase de la conversación; se añaden tras el prompt
+    # base ya formateado, así que pueden contener llaves (p. ej. en el PRD existente)
+    instructions = ""
     if _is_initial_conversation_state(conversation_history):
         # Si es el inicio de la conversación o solo el primer mensaje del PM
         if template_type == 'prd_feature_existing':
-            full_prompt_content_string += f"""
+            instructions += f"""
             El PM ha proporcionado el siguiente contenido de PRD existente:
             {existing_prd_content}
             Tu objetivo es ayudar a desglosar este PRD en Historias de Usuario detalladas.
             Para empezar, ¿en qué funcionalidades o secciones del PRD existente deberíamos enfocarnos para generar las Historias de Usuario?
             """
         elif template_type == 'prd.md' or template_type == 'feature.md':
-            full_prompt_content_string += """
+            instructions += """
             Para empezar, ¿cuál es el problema principal que esta funcionalidad busca resolver para el usuario, o cuál es el objetivo principal que queremos lograr con esta nueva característica?
             """
         else:
             # Default for other templates if needed
-            full_prompt_content_string += """
+            instructions += """
             Para empezar, ¿cuál es el problema o el objetivo principal de lo que estamos discutiendo?
             """
     else:
         if template_type == 'prd_feature_existing':
             # Adaptar el prompt para el caso de PRD Feature
-            full_prompt_content_string += f"""
+            instructions += f"""
             El PM ha proporcionado el siguiente contenido de PRD existente:
             {existing_prd_content}
             Tu objetivo es ayudar a desglosar este PRD en Historias de Usuario detalladas.
             """
         elif template_type == 'prd.md':
-            full_prompt_content_string += """
+            instructions += """
             Tu objetivo es recopilar suficiente información para generar un PRD completamente nuevo.
             """
         elif template_type == 'feature.md': # This is the default behavior.
-            full_prompt_content_string += """
+            instructions += """
             Tu objetivo es recopilar suficiente información para generar un PRD y Historias de Usuario para una nueva funcionalidad.
             """
         # Add other template type specific instructions here if needed
 
-    full_prompt_content_string += """
+    instructions += """
         Siguiente pregunta para el PM:
         """
 
-    # Create PromptTemplate from the final string
-    prompt_template = PromptTemplate(full_prompt_content_string)
-
-    relevant_project_info = _get_relevant_project_info(project_index, conversation_history, "formular la siguiente pregunta al PM")
+    relevant_project_info = await _get_relevant_project_info(project_index, conversation_history, "formular la siguiente pregunta al PM")
 
-    full_prompt_text = prompt_template.format(
-        conversation_context="\n".join([f"{msg['role'].upper()}: {msg['content']}" for msg in conversation_history]),
-        project_info=relevant_project_info
-    )
+    # Historial y contexto del proyecto ajustados al presupuesto de tokens del prompt
+    with span("prompt_assembly"):
+        sections = fit_sections(prompt_template.template + instructions, {
+            "conversation_context": build_conversation_context(conversation_history, _conversation_summarizer, llm_provider, conversation_id),
+            "project_info": relevant_project_info,
+        })
+        full_prompt_text = prompt_template.format(**sections) + instructions
 
     try:
-        llm_response = await llm.acomplete(full_prompt_text)
-        return llm_response.text.strip()
+        return (await _complete(llm, full_prompt_text, on_token, PRIORITY_INTERACTIVE)).strip()
     except Exception as e:
         return f"Error al generar la pregunta con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
 
 
-def _get_relevant_project_info(project_index, conversation_history: List[Dict[str, str]], purpose: str) -> str:
+async def _get_relevant_project_info(project_index, conversation_history: List[Dict[str, str]], purpose: str) -> str:
     """
     Retrieves relevant project information based on the project index and conversation history.
-    The 'purpose' string helps to formulate a more specific query to the project index.
+    The query combines the 'purpose' string with the most recent conversation turns (or the latest
+    developer message); repeated queries are answered from an LRU cache.
+    By default (PROJECT_CONTEXT_MODE=retrieve) it returns the top-k raw chunks with file paths and
+    scores, without an extra LLM call; "synthesize" keeps the query engine's LLM-written answer.
+    Index queries are synchronous, so they run in a bounded thread pool to keep the event loop free.
     """
     if project_index:
         try:
-            query_engine = project_index.as_query_engine()
-            # Usar una consulta más general para el contexto
-            simulated_query = f"Dadas las funcionalidades mencionadas en la conversación, ¿qué información técnica relevante del proyecto podría necesitar para {purpose}?"
-            response = query_engine.query(simulated_query)
-            if response and response.response:
-                return response.response
+            # La consulta se construye con los últimos turnos de la conversación
+            retrieval_query = build_retrieval_query(conversation_history, purpose)
+            loop = asyncio.get_running_loop()
+            with span("retrieval"):
+                if PROJECT_CONTEXT_MODE == "synthesize":
+                    query_engine = project_index.as_query_engine()
+                    response = await loop.run_in_executor(_RETRIEVAL_EXECUTOR, query_engine.query, retrieval_query)
+                    project_info = response.response if response else None
+                else:
+                    project_info = await loop.run_in_executor(_RETRIEVAL_EXECUTOR, retrieve_project_context, project_index, retrieval_query)
+            if project_info:
+                return project_info
             else:
                 return "No se encontró información relevante del proyecto para esta consulta específica."
         except Exception as e:
@@ -223,31 +588,23 @@ def _get_relevant_project_info(project_index, conversation_history: List[Dict[st
     return "No se recuperó información específica del proyecto para el contexto de la pregunta."
 
 
-def _load_template_content(template_file: str) -> str:
-    """
-    Loads the content of a template file from the templates directory.
-    """
-    full_path = template_file
-    try:
-        with open(full_path, 'r') as f:
-            return f.read()
-    except FileNotFoundError:
-        print(f"Error: The template file '{full_path}' was not found.")
-        return ""
-    except Exception as e:
-        print(f"Error reading the template file '{full_path}': {e}")
-        return ""
-
-
 # --- Fase 3: Generación de PRDs e Historias de Usuario ---
 
-async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str]], project_index, template_type: str, existing_prd_content: Optional[str] = None, llm_provider: str = "google"):
+async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str]], project_index, template_type: str, existing_prd_content: Optional[str] = None, llm_provider: str = "google", on_token: Optional[Callable[[str, str], None]] = None, raise_errors: bool = False):
     """
-    Genera el PRD y las historias de usuario.
-    En una aplicación real, aquí se usaría un LLM (ej. Gemini-Pro)
-    con todo el contexto y posiblemente plantillas.
+    Genera el PRD, las historias de usuario y el plan técnico.
+    Se ejecuta como un pequeño grafo de dependencias: una única recuperación de contexto del
+    proyecto compartida, luego el PRD y, como ambos solo dependen del PRD, las historias de usuario
+    y el plan técnico en paralelo.
+    Devuelve (prd, historias_de_usuario, plan_tecnico, tiempos_por_etapa_en_segundos).
+    Si se pasa on_token, los documentos se generan en streaming y cada fragmento se entrega como
+    on_token(documento, fragmento), con documento en "prd", "user_stories" o "technical_plan".
+    Por defecto, un fallo del LLM se devuelve como texto de error en el documento; con
+    raise_errors=True (modo por lotes) la excepción se propaga para que el elemento se reintente.
     """
     print("\n--- Generando PRD e Historias de Usuario ---")
+    timings: Dict[str, float] = {}
+    pipeline_start = time.perf_counter()
 
     # Cargar el contenido del template seleccionado
 
@@ -256,7 +613,7 @@ async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str
         template_content = existing_prd_content if existing_prd_content else ""
         print("Usando contenido de PRD existente para generación.")
     else:
-        template_content = _load_template_content(os.path.join("templates", template_type))
+        template_content = get_template_registry().document(template_type)
         print(f"Template '{template_type}' cargado con éxito.")
 
     # Combinar todo el contexto para el LLM
@@ -265,23 +622,20 @@ async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str
         if msg['role'] == 'pm': # Only include messages from the Product Manager
             full_context += f"{msg['role'].upper()}: {msg['content']}\n"
 
-    # Simulación de la generación del PRD y HU
     # Utilizaremos un LLM real para la generación
     llm = _get_llm(llm_provider)
 
     # Plantilla para el PRD
 
-    prd_prompt_content = _load_template_content("templates/prompts/prd_prompt.txt")
-    prd_template = PromptTemplate(prd_prompt_content)
+    prd_template = get_template_registry().prompt("prd")
 
-    user_stories_prompt_content = _load_template_content("templates/prompts/user_stories_prompt.txt")
-    user_stories_template = PromptTemplate(user_stories_prompt_content)
-
-
-    # Simular la recuperación de información relevante del proyecto
-    relevant_project_info = _get_relevant_project_info(project_index, conversation_history, "la implementación")
+    # Recuperación de información relevante del proyecto, compartida por las tres etapas
+    stage_start = time.perf_counter()
+    relevant_project_info = await _get_relevant_project_info(project_index, conversation_history, "la implementación y su planificación técnica (arquitectura, componentes, patrones)")
+    timings["retrieval"] = time.perf_counter() - stage_start
 
     # Generar el PRD usando el LLM
+    stage_start = time.perf_counter()
     prd_content = ""
     try:
         full_prompt_text_prd = prd_template.format(
@@ -289,13 +643,54 @@ async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str
             conversation_context=full_context,
             project_info=relevant_project_info
         )
-        llm_response_prd = await llm.acomplete(full_prompt_text_prd)
-        prd_content = llm_response_prd.text.strip()
+        prd_content = (await _complete(llm, full_prompt_text_prd, _document_token_callback(on_token, "prd"))).strip()
     except Exception as e:
         print(f"DEBUG: Error al generar PRD - Tipo: {type(e).__name__}, Mensaje: {e}")
+        if raise_errors:
+            raise
         prd_content = f"Error al generar el PRD con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
+    timings["prd"] = time.perf_counter() - stage_start
+    record_stage("prd", timings["prd"])
+
+    async def timed(stage: str, coroutine):
+        stage_start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            timings[stage] = time.perf_counter() - stage_start
+            record_stage(stage, timings[stage])
+
+    # Historias de Usuario y Plan Técnico solo dependen del PRD: se generan en paralelo
+    user_stories_content, technical_plan_content = await asyncio.gather(
+        timed("user_stories", _generate_user_stories(llm, prd_content, full_context, relevant_project_info, _document_token_callback(on_token, "user_stories"), raise_errors)),
+        timed("technical_plan", generate_technical_plan(
+            conversation_history,
+            project_index,
+            prd_content, # Pass the generated PRD to the technical plan function
+            llm_provider,
+            relevant_project_info=relevant_project_info,
+            on_token=_document_token_callback(on_token, "technical_plan"),
+            raise_errors=raise_errors
+        )),
+    )
+
+    timings["total"] = time.perf_counter() - pipeline_start
+    print(f"PRD, Historias de Usuario y Plan Técnico generados (usando LLM) en {timings['total']:.1f}s...")
+    return prd_content, user_stories_content, technical_plan_content, timings
+
+
+def _document_token_callback(on_token: Optional[Callable[[str, str], None]], document: str) -> Optional[Callable[[str], None]]:
+    if on_token is None:
+        return None
+    return lambda delta: on_token(document, delta)
+
+
+async def _generate_user_stories(llm, prd_content: str, full_context: str, relevant_project_info: str, on_token: Optional[Callable[[str], None]] = None, raise_errors: bool = False) -> str:
+    """
+    Genera las Historias de Usuario a partir del PRD generado.
+    """
+    user_stories_template = get_template_registry().prompt("user_stories")
 
-    # Generar las Historias de Usuario usando el LLM
     user_stories_content = ""
     try:
         full_prompt_text_us = user_stories_template.format(
@@ -303,8 +698,7 @@ async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str
             conversation_context=full_context,
             project_info=relevant_project_info
         )
-        llm_response_us = await llm.acomplete(full_prompt_text_us)
-        user_stories_content = llm_response_us.text.strip()
+        user_stories_content = (await _complete(llm, full_prompt_text_us, on_token)).strip()
 
         # Add a heading for User Stories if not present
         if not user_stories_content.startswith("# Historias de Usuario"):
@@ -312,25 +706,19 @@ async def generate_prd_and_user_stories(conversation_history: List[Dict[str, str
 
     except Exception as e:
         print(f"DEBUG: Error al generar Historias de Usuario - Tipo: {type(e).__name__}, Mensaje: {e}")
+        if raise_errors:
+            raise
         user_stories_content = f"Error al generar las Historias de Usuario con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
+    return user_stories_content
 
-    # Generar el Plan Técnico
-    technical_plan_content = await generate_technical_plan(
-        conversation_history,
-        project_index,
-        prd_content, # Pass the generated PRD to the technical plan function
-        llm_provider
-    )
-
-    print("PRD, Historias de Usuario y Plan Técnico generados (usando LLM)...")
-    return prd_content, user_stories_content, technical_plan_content
 
-
-async def generate_technical_plan(conversation_history: List[Dict[str, str]], project_index, prd_content_for_tp: str, llm_provider: str = "google"):
+async def generate_technical_plan(conversation_history: List[Dict[str, str]], project_index, prd_content_for_tp: str, llm_provider: str = "google", relevant_project_info: Optional[str] = None, on_token: Optional[Callable[[str], None]] = None, raise_errors: bool = False):
     """
     Genera un plan de acción técnico basado en el historial de conversación, el contexto del proyecto y el PRD generado.
     Este plan incluirá detalles sobre arquitectura, componentes/ficheros afectados,
     convenciones de nombres, puntos de integración y enfoques de implementación.
+    Si se pasa relevant_project_info (ya recuperado), no se vuelve a consultar el índice.
+    Con raise_errors=True, un fallo del LLM se propaga en lugar de devolverse como texto.
     """
     print("\n--- Generando Plan Técnico ---")
 
@@ -344,10 +732,10 @@ async def generate_technical_plan(conversation_history: List[Dict[str, str]], pr
 
     # Plantilla para el plan técnico
 
-    technical_plan_prompt_content = _load_template_content("templates/prompts/technical_plan_prompt.txt")
-    technical_plan_template = PromptTemplate(technical_plan_prompt_content)
+    technical_plan_template = get_template_registry().prompt("technical_plan")
 
-    relevant_project_info = _get_relevant_project_info(project_index, conversation_history, "la planificación de la implementación (arquitectura, componentes, patrones)")
+    if relevant_project_info is None:
+        relevant_project_info = await _get_relevant_project_info(project_index, conversation_history, "la planificación de la implementación (arquitectura, componentes, patrones)")
 
     # Generar el plan técnico usando el LLM
     technical_plan_content = ""
@@ -357,19 +745,144 @@ async def generate_technical_plan(conversation_history: List[Dict[str, str]], pr
             project_info=relevant_project_info,
             prd_content_for_tp=prd_content_for_tp
         )
-        llm_response_tp = await llm.acomplete(full_prompt_text_tp)
-        technical_plan_content = llm_response_tp.text.strip()
+        technical_plan_content = (await _complete(llm, full_prompt_text_tp, on_token)).strip()
 
         if not technical_plan_content.startswith("# Plan Técnico"):
             technical_plan_content = "# Plan Técnico\n" + technical_plan_content
 
     except Exception as e:
         print(f"DEBUG: Error al generar Plan Técnico - Tipo: {type(e).__name__}, Mensaje: {e}")
+        if raise_errors:
+            raise
         technical_plan_content = f"Error al generar el Plan Técnico con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
 
     print("Plan Técnico generado (usando LLM)...")
     return technical_plan_content
 
+async def regenerate_document_section(
+    document_sections: Dict,
+    conversation_history: List[Dict[str, str]],
+    project_index,
+    document: str,
+    section_id: str,
+    instructions: Optional[str] = None,
+    llm_provider: str = "google",
+    update_dependents: bool = True,
+):
+    """
+    Regenera una sola sección (con sus subsecciones) de un documento ya generado, con solo el
+    contexto que necesita: la conversación con el PM si es del PRD, o las secciones del PRD en las
+    que se basa si es de las historias de usuario o del plan técnico. Si la sección es del PRD y
+    update_dependents, después se reescriben solo las secciones de los documentos dependientes que
+    se basan en lo que ha cambiado, en paralelo; el resto de los documentos no se toca.
+    document_sections es el árbol guardado en la sesión (ver document_sections.py).
+    Devuelve (árbol actualizado, documentos, {documento: ids de secciones actualizadas},
+    {documento: [{"section_id", "error"}] de las secciones dependientes que no se pudieron actualizar}, tiempos).
+    Lanza KeyError si el documento o la sección no existen.
+    """
+    print(f"\n--- Regenerando la sección '{section_id}' de {document} ---")
+    timings: Dict[str, float] = {}
+    pipeline_start = time.perf_counter()
+    llm = _get_llm(llm_provider)
+    parsed = load_document_sections(document_sections)
+    sections = parsed[document]
+    original_span = section_span(sections, section_id)
+    target = original_span[0]
+
+    if document == "prd":
+        source_context = "\n".join(f"{msg['role'].upper()}: {msg['content']}" for msg in conversation_history if msg['role'] == 'pm')
+    else:
+        # Solo las secciones del PRD en las que se basa (el PRD completo si no se basa en ninguna)
+        dependencies = document_sections["dependencies"].get(document, {})
+        source_ids = {source_id for section in original_span for source_id in dependencies.get(section.id, [])}
+        source_sections = [section for section in parsed["prd"] if section.id in source_ids] or parsed["prd"]
+        source_context = render_sections(source_sections)
+
+    # El contexto del proyecto no aporta a las historias de usuario, que solo derivan del PRD
+    project_info = "No aplica."
+    if document != "user_stories":
+        stage_start = time.perf_counter()
+        project_info = await _get_relevant_project_info(
+            project_index, conversation_history, f"la sección '{target.title}' del {DOCUMENT_NAMES[document]}")
+        timings["retrieval"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    new_content = await _rewrite_section(
+        llm, document, sections, target, render_sections(original_span),
+        instructions or "Revisa y mejora esta sección para que sea clara, concisa y coherente con el contexto.",
+        source_context, project_info, PRIORITY_INTERACTIVE,
+    )
+    parsed[document] = replace_section(sections, section_id, new_content)
+    timings["section"] = time.perf_counter() - stage_start
+    record_stage("section", timings["section"])
+
+    previous = {(section.id, section.content_hash) for section in sections}
+    changed_ids = {section.id for section in parsed[document] if (section.id, section.content_hash) not in previous}
+    updated: Dict[str, List[str]] = {document: sorted(changed_ids)}
+    failed: Dict[str, List[Dict[str, str]]] = {}
+
+    if update_dependents and document in DEPENDENT_DOCUMENTS and changed_ids:
+        # Las dependencias son las del árbol anterior: se buscan por los ids antiguos y los nuevos
+        current = {(section.id, section.content_hash) for section in parsed[document]}
+        changed_ids |= {section.id for section in original_span if (section.id, section.content_hash) not in current}
+        changed_context = render_sections([section for section in parsed[document] if section.id in changed_ids])
+        stage_start = time.perf_counter()
+        targets = [
+            (dependent, find_section(parsed[dependent], dependent_id))
+            for dependent, dependent_ids in dependent_sections(document_sections, changed_ids).items()
+            if dependent in DEPENDENT_DOCUMENTS[document]
+            for dependent_id in dependent_ids
+        ]
+        results = await asyncio.gather(*[
+            _rewrite_section(
+                llm, dependent, parsed[dependent], section, section.content,
+                f"El {DOCUMENT_NAMES[document]} ha cambiado (ver el contexto, que contiene las secciones modificadas). "
+                "Actualiza esta sección para que sea coherente con la nueva versión, cambiando solo lo necesario; "
+                "si no le afecta, devuélvela sin cambios. No añadas subsecciones.",
+                changed_context, "No aplica.", PRIORITY_BULK, keep_title=True, allow_subsections=False,
+            )
+            for dependent, section in targets
+        ], return_exceptions=True)
+        # Todas las sustituciones de un documento se aplican a la vez, por posición
+        replacements: Dict[str, Dict[str, str]] = {}
+        for (dependent, section), result in zip(targets, results):
+            if not isinstance(result, Exception) and len(parse_sections(result)) != 1:
+                result = ValueError("la reescritura no es una única sección")
+            if isinstance(result, Exception):
+                record_stage_error("section_dependents")
+                failed.setdefault(dependent, []).append({"section_id": section.id, "error": f"{type(result).__name__}: {result}"})
+                continue
+            if result != section.content:
+                replacements.setdefault(dependent, {})[section.id] = result
+        for dependent, document_replacements in replacements.items():
+            parsed[dependent] = replace_sections(parsed[dependent], document_replacements)
+            updated.setdefault(dependent, []).extend(document_replacements)
+        timings["dependents"] = time.perf_counter() - stage_start
+        record_stage("section_dependents", timings["dependents"])
+
+    timings["total"] = time.perf_counter() - pipeline_start
+    print(f"Sección regenerada; secciones actualizadas: {updated} en {timings['total']:.1f}s...")
+    return serialize_document_sections(parsed), rendered_documents(parsed), updated, failed, timings
+
+
+async def _rewrite_section(llm, document: str, sections, section, section_content: str, instructions: str,
+                           source_context: str, project_info: str, priority: int, keep_title: bool = False,
+                           allow_subsections: bool = True) -> str:
+    """Reescribe una sección con el prompt "section" y normaliza su encabezado."""
+    section_template = get_template_registry().prompt("section")
+    with span("prompt_assembly"):
+        fitted = fit_sections(section_template.template, {
+            "document_name": DOCUMENT_NAMES[document],
+            "instructions": instructions,
+            "outline": outline(sections),
+            "section_content": section_content,
+            "source_context": source_context,
+            "project_info": project_info,
+        })
+        full_prompt_text = section_template.format(**fitted)
+    return normalize_section(await _complete(llm, full_prompt_text, priority=priority), section, keep_title, allow_subsections)
+
+
 # --- Fase 4: Chat de Desarrolladores y Resumen para Jira ---
 
 async def get_developer_chat_response(
@@ -378,34 +891,39 @@ async def get_developer_chat_response(
     prd_content: str,
     user_stories_content: str,
     technical_plan_content: str,
-    llm_provider: str = "google"
+    llm_provider: str = "google",
+    on_token: Optional[Callable[[str], None]] = None,
+    conversation_id: Optional[str] = None
 ) -> str:
     """
     Genera una respuesta para el chat del desarrollador, usando el PRD, las Historias de Usuario,
     el Plan Técnico y el índice del proyecto como contexto.
+    Si se pasa on_token, la respuesta se genera en streaming y cada fragmento se entrega a on_token.
     """
     print("\n--- Generando respuesta para el chat del desarrollador ---")
 
     llm = _get_llm(llm_provider)
     
     # Cargar el prompt específico para el chat del desarrollador
-    developer_chat_prompt_content = _load_template_content("templates/prompts/developer_chat_prompt.txt")
-    developer_chat_template = PromptTemplate(developer_chat_prompt_content)
+    developer_chat_template = get_template_registry().prompt("developer_chat")
 
     # Contexto relevante del proyecto (usando una consulta más específica para desarrolladores)
-    relevant_project_info = _get_relevant_project_info(project_index, developer_chat_history, "responder preguntas técnicas sobre la implementación de la propuesta")
-
-    full_prompt_text = developer_chat_template.format(
-        developer_chat_context="\n".join([f"{msg['role'].upper()}: {msg['content']}" for msg in developer_chat_history]),
-        prd_content=prd_content,
-        user_stories_content=user_stories_content,
-        technical_plan_content=technical_plan_content,
-        project_info=relevant_project_info
-    )
+    relevant_project_info = await _get_relevant_project_info(project_index, developer_chat_history, "responder preguntas técnicas sobre la implementación de la propuesta")
+
+    # Las secciones se ajustan al presupuesto de tokens; del historial se conservan los últimos
+    # turnos literales y un resumen de los anteriores
+    with span("prompt_assembly"):
+        sections = fit_sections(developer_chat_template.template, {
+            "developer_chat_context": build_conversation_context(developer_chat_history, _conversation_summarizer, llm_provider, conversation_id),
+            "prd_content": prd_content,
+            "user_stories_content": user_stories_content,
+            "technical_plan_content": technical_plan_content,
+            "project_info": relevant_project_info,
+        })
+        full_prompt_text = developer_chat_template.format(**sections)
 
     try:
-        llm_response = await llm.acomplete(full_prompt_text)
-        return llm_response.text.strip()
+        return (await _complete(llm, full_prompt_text, on_token, PRIORITY_INTERACTIVE)).strip()
     except Exception as e:
         print(f"DEBUG: Error al generar respuesta para el chat del desarrollador - Tipo: {type(e).__name__}, Mensaje: {e}")
         return f"Error al generar la respuesta para el chat del desarrollador con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
@@ -423,8 +941,7 @@ async def summarize_developer_chat(
     llm = _get_llm(llm_provider)
 
     # Cargar el prompt específico para el resumen de Jira
-    jira_summary_prompt_content = _load_template_content("templates/prompts/jira_summary_prompt.txt")
-    jira_summary_template = PromptTemplate(jira_summary_prompt_content)
+    jira_summary_template = get_template_registry().prompt("jira_summary")
 
     # Preparar el contexto del chat para el resumen
     chat_context_for_summary = "\n".join([f"{msg['role'].upper()}: {msg['content']}" for msg in developer_chat_history])
@@ -434,8 +951,7 @@ async def summarize_developer_chat(
     )
 
     try:
-        llm_response = await llm.acomplete(full_prompt_text)
-        return llm_response.text.strip()
+        return (await _complete(llm, full_prompt_text)).strip()
     except Exception as e:
         print(f"DEBUG: Error al generar resumen para Jira - Tipo: {type(e).__name__}, Mensaje: {e}")
         return f"Error al generar el resumen para Jira con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
@@ -446,34 +962,39 @@ async def generate_code_agent_brief(
     prd_content: str,
     user_stories_content: str,
     technical_plan_content: str,
-    llm_provider: str = "google"
+    llm_provider: str = "google",
+    on_token: Optional[Callable[[str], None]] = None,
+    conversation_id: Optional[str] = None
 ) -> str:
     """
     Genera un brief detallado y optimizado para un agente de IA generador de código,
     incluyendo todo el contexto relevante para la implementación.
+    Si se pasa on_token, el brief se genera en streaming y cada fragmento se entrega a on_token.
     """
     print("\n--- Generando brief para el agente de código ---")
 
     llm = _get_llm(llm_provider)
 
     # Cargar el prompt específico para el brief del agente de código
-    code_agent_brief_prompt_content = _load_template_content("templates/prompts/code_agent_brief_prompt.txt")
-    code_agent_brief_template = PromptTemplate(code_agent_brief_prompt_content)
+    code_agent_brief_template = get_template_registry().prompt("code_agent_brief")
 
     # Contexto relevante del proyecto (usando una consulta más específica para la implementación de código)
-    relevant_project_info = _get_relevant_project_info(project_index, developer_chat_history, "generar código para la implementación")
-
-    full_prompt_text = code_agent_brief_template.format(
-        developer_chat_context="\n".join([f"{msg['role'].upper()}: {msg['content']}" for msg in developer_chat_history]),
-        prd_content=prd_content,
-        user_stories_content=user_stories_content,
-        technical_plan_content=technical_plan_content,
-        project_info=relevant_project_info
-    )
+    relevant_project_info = await _get_relevant_project_info(project_index, developer_chat_history, "generar código para la implementación")
+
+    # Las secciones se ajustan al presupuesto de tokens; del historial se conservan los últimos
+    # turnos literales y un resumen de los anteriores
+    with span("prompt_assembly"):
+        sections = fit_sections(code_agent_brief_template.template, {
+            "developer_chat_context": build_conversation_context(developer_chat_history, _conversation_summarizer, llm_provider, conversation_id),
+            "prd_content": prd_content,
+            "user_stories_content": user_stories_content,
+            "technical_plan_content": technical_plan_content,
+            "project_info": relevant_project_info,
+        })
+        full_prompt_text = code_agent_brief_template.format(**sections)
 
     try:
-        llm_response = await llm.acomplete(full_prompt_text)
-        return llm_response.text.strip()
+        return (await _complete(llm, full_prompt_text, on_token)).strip()
     except Exception as e:
         print(f"DEBUG: Error al generar brief para agente de código - Tipo: {type(e).__name__}, Mensaje: {e}")
         return f"Error al generar el brief para el agente de código con el LLM: {str(e)}. Por favor, verifica tu clave de API y la disponibilidad del modelo."
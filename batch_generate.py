@@ -0,0 +1,190 @@
+# batch_generate.py
+# Generación de documentos por lotes, sin la interfaz web: lee descripciones de funcionalidades de
+# un archivo JSONL, carga (o indexa) una sola vez el índice del proyecto y ejecuta
+# generate_prd_and_user_stories para cada elemento con concurrencia acotada. Cada resultado se
+# añade al archivo de salida (JSONL) en cuanto termina, así que si el proceso se interrumpe, al
+# volver a ejecutarlo con la misma salida solo se generan los elementos pendientes o fallidos.
+#
+# Formato de entrada, un objeto JSON por línea:
+#   {"id": "feat-1", "title": "Exportar a CSV", "body": "Los PM quieren...", "template_type": "feature.md"}
+# (también se aceptan "request_id" como id y "description" como cuerpo; template_type es opcional).
+#
+# Uso:
+#   python batch_generate.py backlog.jsonl resultados.jsonl --project-path /ruta/al/proyecto --concurrency 4
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from app import generate_prd_and_user_stories
+from completion_cache import close_completion_cache
+from project_registry import ProjectRegistry
+from providers import init_registry, shutdown_registry
+from template_registry import get_template_registry
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+def load_items(input_path: str) -> List[Dict[str, Any]]:
+    """Elementos del archivo de entrada, con id único (por defecto, el número de línea)."""
+    items: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{input_path}:{line_number}: JSON no válido ({e})") from e
+            item_id = str(item.get("id") or item.get("request_id") or f"line-{line_number}")
+            if item_id in seen:
+                raise ValueError(f"{input_path}:{line_number}: id duplicado '{item_id}'")
+            seen.add(item_id)
+            items.append({**item, "id": item_id})
+    return items
+
+
+def load_completed(output_path: str) -> Set[str]:
+    """Ids ya generados con éxito en una ejecución anterior (se ignora una última línea a medias)."""
+    completed: Set[str] = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Línea truncada por una interrupción
+            if result.get("status") == "success":
+                completed.add(result["id"])
+    return completed
+
+
+class ResultWriter:
+    """Añade un resultado por línea y lo fuerza a disco, para no perder nada si el proceso muere."""
+
+    def __init__(self, output_path: str):
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        else:
+            needs_newline = False
+        self._file = open(output_path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")  # Cierra la línea que quedó a medias
+
+    def write(self, result: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _description(item: Dict[str, Any]) -> str:
+    title = item.get("title") or ""
+    body = item.get("body") or item.get("description") or ""
+    return f"{title}\n\n{body}".strip()
+
+
+async def generate_item(item: Dict[str, Any], project_index, llm_provider: str, default_template: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    template_type = item.get("template_type") or default_template
+    conversation = [{"role": "pm", "content": _description(item), "template_type": template_type}]
+    prd, user_stories, technical_plan, timings = await generate_prd_and_user_stories(
+        conversation, project_index, template_type, item.get("existing_prd_content"), llm_provider,
+        raise_errors=True,  # Un fallo del LLM debe quedar como "error" para reintentarlo
+    )
+    return {
+        "id": item["id"],
+        "status": "success",
+        "title": item.get("title"),
+        "template_type": template_type,
+        "prd": prd,
+        "user_stories": user_stories,
+        "technical_plan": technical_plan,
+        "timings": timings,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def _write_markdown(markdown_dir: str, result: Dict[str, Any]) -> None:
+    safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in result["id"])
+    with open(os.path.join(markdown_dir, f"{safe_id}.md"), "w", encoding="utf-8") as f:
+        f.write(f"{result['prd']}\n\n{result['user_stories']}\n\n{result['technical_plan']}\n")
+
+
+async def run_batch(input_path: str, output_path: str, project_path: Optional[str] = None,
+                    concurrency: int = BATCH_CONCURRENCY, llm_provider: str = "google",
+                    template_type: str = "feature.md", markdown_dir: Optional[str] = None) -> Dict[str, int]:
+    items = load_items(input_path)
+    completed = load_completed(output_path)
+    pending = [item for item in items if item["id"] not in completed]
+    print(f"{len(items)} elementos; {len(completed & {item['id'] for item in items})} ya generados, {len(pending)} pendientes.")
+    if not pending:
+        return {"total": len(items), "generated": 0, "failed": 0}
+
+    init_registry()
+    get_template_registry().load_all()
+    project_index = None
+    if project_path:
+        print(f"Cargando el índice del proyecto {project_path}...")
+        project_index = (await ProjectRegistry(max_loaded=1).index(project_path)).index
+    if markdown_dir:
+        os.makedirs(markdown_dir, exist_ok=True)
+
+    writer = ResultWriter(output_path)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    counts = {"total": len(items), "generated": 0, "failed": 0}
+
+    async def process(item: Dict[str, Any]) -> None:
+        async with semaphore:
+            try:
+                result = await generate_item(item, project_index, llm_provider, template_type)
+            except Exception as e:
+                result = {"id": item["id"], "status": "error", "title": item.get("title"), "error": f"{type(e).__name__}: {e}"}
+            writer.write(result)
+            if result["status"] == "success":
+                counts["generated"] += 1
+                if markdown_dir:
+                    _write_markdown(markdown_dir, result)
+                print(f"[{counts['generated'] + counts['failed']}/{len(pending)}] {item['id']}: generado en {result['seconds']}s")
+            else:
+                counts["failed"] += 1
+                print(f"[{counts['generated'] + counts['failed']}/{len(pending)}] {item['id']}: error ({result['error']})")
+
+    try:
+        await asyncio.gather(*[process(item) for item in pending])
+    finally:
+        writer.close()
+        close_completion_cache()
+        await shutdown_registry()
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera PRD, historias de usuario y plan técnico para cada elemento de un JSONL.")
+    parser.add_argument("input", help="Archivo JSONL con las descripciones de las funcionalidades.")
+    parser.add_argument("output", help="Archivo JSONL de resultados; si existe, se reanuda a partir de él.")
+    parser.add_argument("--project-path", help="Proyecto cuyo índice se usa como contexto (se indexa si hace falta).")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Elementos generados a la vez.")
+    parser.add_argument("--llm-provider", default="google", choices=["google", "ollama"])
+    parser.add_argument("--template-type", default="feature.md", help="Plantilla de los elementos que no indican template_type.")
+    parser.add_argument("--markdown-dir", help="Si se indica, guarda también los documentos de cada elemento como <id>.md.")
+    args = parser.parse_args()
+
+    counts = asyncio.run(run_batch(args.input, args.output, args.project_path, args.concurrency,
+                                   args.llm_provider, args.template_type, args.markdown_dir))
+    print(f"Terminado: {counts['generated']} generados, {counts['failed']} con error, de {counts['total']} elementos.")
+    if counts["failed"]:
+        print("Vuelve a ejecutar el mismo comando para reintentar los elementos con error.")
+
+
+if __name__ == "__main__":
+    main()
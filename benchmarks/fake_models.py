@@ -0,0 +1,139 @@
+# benchmarks/fake_models.py
+# Modelos falsos y deterministas para medir el servicio sin Gemini ni Ollama:
+#   - FakeLLM: responde con un texto derivado del hash del prompt tras una latencia configurable
+#     (tiempo hasta el primer token + tokens por segundo), también en streaming.
+#   - FakeEmbedding: vectores derivados del hash de cada texto, con una latencia por lote.
+# Se registran en el ProviderRegistry (set_llm / set_embed_model), así que _get_llm e index_project
+# los usan sin cambios; las esperas asíncronas no bloquean el event loop, como un proveedor real.
+
+import asyncio
+import hashlib
+import time
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import CompletionResponse, CompletionResponseAsyncGen, CompletionResponseGen, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+from pydantic import Field
+
+from utils import estimate_tokens
+
+_WORDS = (
+    "usuario", "sistema", "reporte", "exportar", "validar", "servicio", "endpoint", "criterio",
+    "aceptación", "historia", "plan", "componente", "datos", "archivo", "error", "permiso",
+)
+
+
+def _fake_words(seed: str, count: int) -> List[str]:
+    words: List[str] = []
+    digest = hashlib.sha256(seed.encode("utf-8")).digest()
+    while len(words) < count:
+        words.extend(_WORDS[byte % len(_WORDS)] for byte in digest)
+        digest = hashlib.sha256(digest).digest()
+    return words[:count]
+
+
+class FakeLLM(CustomLLM):
+    """LLM determinista: el mismo prompt produce siempre la misma respuesta de output_tokens palabras."""
+
+    model: str = Field(default="fake-llm")
+    first_token_latency: float = Field(default=0.2, description="Segundos hasta el primer token.")
+    tokens_per_second: float = Field(default=200.0, description="Velocidad de generación; 0 = instantánea.")
+    output_tokens: int = Field(default=300)
+    stream_chunk_tokens: int = Field(default=10, description="Tokens por fragmento en streaming.")
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model, num_output=self.output_tokens, context_window=1_000_000)
+
+    def _tokens(self, prompt: str) -> List[str]:
+        return _fake_words(prompt, self.output_tokens)
+
+    def _generation_seconds(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _raw(self, prompt: str, tokens: int) -> dict:
+        # Mismos campos que informa Ollama, para que metrics.usage_tokens cuente los tokens
+        return {"prompt_eval_count": estimate_tokens(prompt), "eval_count": tokens}
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token_latency + self._generation_seconds(len(tokens)))
+        return CompletionResponse(text=" ".join(tokens), raw=self._raw(prompt, len(tokens)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token_latency)
+        text = ""
+        for start in range(0, len(tokens), self.stream_chunk_tokens):
+            chunk = tokens[start:start + self.stream_chunk_tokens]
+            time.sleep(self._generation_seconds(len(chunk)))
+            delta = (" " if text else "") + " ".join(chunk)
+            text += delta
+            yield CompletionResponse(text=text, delta=delta, raw=self._raw(prompt, start + len(chunk)))
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.first_token_latency + self._generation_seconds(len(tokens)))
+        return CompletionResponse(text=" ".join(tokens), raw=self._raw(prompt, len(tokens)))
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            tokens = self._tokens(prompt)
+            await asyncio.sleep(self.first_token_latency)
+            text = ""
+            for start in range(0, len(tokens), self.stream_chunk_tokens):
+                chunk = tokens[start:start + self.stream_chunk_tokens]
+                await asyncio.sleep(self._generation_seconds(len(chunk)))
+                delta = (" " if text else "") + " ".join(chunk)
+                text += delta
+                yield CompletionResponse(text=text, delta=delta, raw=self._raw(prompt, start + len(chunk)))
+
+        return gen()
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Embeddings deterministas (normalizados) de dimensión embed_dim; cada lote tarda batch_latency segundos."""
+
+    embed_dim: int = Field(default=256)
+    batch_latency: float = Field(default=0.05)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        values: List[float] = []
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        while len(values) < self.embed_dim:
+            values.extend(byte / 127.5 - 1.0 for byte in digest)
+            digest = hashlib.sha256(digest).digest()
+        values = values[:self.embed_dim]
+        norm = sum(value * value for value in values) ** 0.5 or 1.0
+        return [value / norm for value in values]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.batch_latency)
+        return [self._vector(text) for text in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.batch_latency)
+        return [self._vector(text) for text in texts]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._aget_text_embedding(query)
+
@@ -0,0 +1,87 @@
+# benchmarks/load_send_message.py
+# Prueba de carga de /send_message: abre N sesiones concurrentes contra un servidor en marcha
+# y reporta la latencia (p50/p95/p99) de cada mensaje.
+#
+# Uso:
+#   uvicorn main:app
+#   python benchmarks/load_send_message.py --sessions 8 --messages 5 --project-path /ruta/al/proyecto
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_session(client: httpx.AsyncClient, session_number: int, messages: int,
+                      llm_provider: str, latencies: List[float], errors: List[str]) -> None:
+    response = await client.post("/start_conversation", json={
+        "initial_description": f"Sesión de carga {session_number}: queremos exportar reportes a CSV.",
+        "template_type": "feature.md",
+        "llm_provider": llm_provider,
+    })
+    data = response.json()
+    if data.get("status") != "success":
+        errors.append(f"start_conversation: {data.get('message')}")
+        return
+    session_id = data["session_id"]
+
+    for message_number in range(messages):
+        started = time.perf_counter()
+        response = await client.post("/send_message", json={
+            "session_id": session_id,
+            "user_message": f"Respuesta {message_number} de la sesión {session_number}.",
+            "llm_provider": llm_provider,
+        })
+        latencies.append(time.perf_counter() - started)
+        data = response.json()
+        if data.get("status") != "success":
+            errors.append(f"send_message: {data.get('message')}")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga de /send_message con sesiones concurrentes.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=8, help="Sesiones concurrentes.")
+    parser.add_argument("--messages", type=int, default=5, help="Mensajes por sesión.")
+    parser.add_argument("--llm-provider", default="google")
+    parser.add_argument("--project-path", help="Si se indica, indexa (o carga) este proyecto antes de la prueba.")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        if args.project_path:
+            response = await client.post("/index_project", json={"project_path": args.project_path, "wait": True})
+            print(f"/index_project -> {response.status_code}: {response.json()}")
+
+        latencies: List[float] = []
+        errors: List[str] = []
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            run_session(client, number, args.messages, args.llm_provider, latencies, errors)
+            for number in range(args.sessions)
+        ])
+        elapsed = time.perf_counter() - started
+
+    print(f"Sesiones: {args.sessions}, mensajes por sesión: {args.messages}, tiempo total: {elapsed:.2f}s")
+    if latencies:
+        print(f"/send_message latencia (s): media={statistics.mean(latencies):.3f} "
+              f"p50={percentile(latencies, 50):.3f} p95={percentile(latencies, 95):.3f} "
+              f"p99={percentile(latencies, 99):.3f} max={max(latencies):.3f}")
+        print(f"Throughput: {len(latencies) / elapsed:.2f} mensajes/s")
+    if errors:
+        print(f"{len(errors)} errores; primero: {errors[0]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
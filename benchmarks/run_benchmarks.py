@@ -0,0 +1,228 @@
+# benchmarks/run_benchmarks.py
+# Benchmark sin red: ejecuta la app en el propio proceso (sin uvicorn) con un LLM y un modelo de
+# embeddings falsos de latencia configurable (ver fake_models.py) sobre un repositorio sintético
+# (ver synthetic_repo.py), y reporta:
+#   - indexación completa e incremental: tiempo, archivos/s y chunks/s,
+#   - latencia (media, p50/p95/p99, máx.) de /start_conversation, /send_message y
+#     /generate_documents con N sesiones concurrentes,
+#   - pico de memoria (RSS) del proceso.
+# Todo se ejecuta en un directorio temporal (ChromaDB, estado del índice, sesiones), así que no
+# toca ./chroma_db. Con --json se guardan los resultados para compararlos entre versiones.
+#
+# Uso:
+#   python benchmarks/run_benchmarks.py --files 1000 --sessions 8 --messages 5 --json resultados.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))  # Módulos de la app (los modelos falsos usan utils)
+
+from fake_models import FakeEmbedding, FakeLLM
+from load_send_message import percentile
+from synthetic_repo import generate_repository, touch_files
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo informa en KiB y macOS en bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def _prepare_workdir(workdir: Path) -> None:
+    """La app usa rutas relativas (./chroma_db, templates/, static/): se ejecuta dentro de workdir."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    (workdir / "static").mkdir(exist_ok=True)
+    templates = workdir / "templates"
+    if not templates.exists():
+        templates.symlink_to(REPO_ROOT / "templates", target_is_directory=True)
+    os.chdir(workdir)
+
+
+async def _timed_post(client: httpx.AsyncClient, url: str, payload: Dict[str, Any],
+                      latencies: Dict[str, List[float]], errors: List[str]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    response = await client.post(url, json=payload)
+    latencies.setdefault(url, []).append(time.perf_counter() - started)
+    data = response.json()
+    if response.status_code >= 400 or data.get("status") not in (None, "success"):
+        errors.append(f"{url}: {data.get('message') or data.get('detail')}")
+    return data
+
+
+async def bench_indexing(client: httpx.AsyncClient, project_path: str, touched: List[str],
+                         collection_count) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for label, prepare in (("full", None), ("incremental", lambda: touch_files(project_path, touched))):
+        if prepare is not None:
+            prepare()
+        started = time.perf_counter()
+        response = await client.post("/index_project", json={"project_path": project_path, "wait": True})
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"La indexación {label} falló: {response.json()}")
+        files = response.json().get("total") or 0  # Archivos embebidos: todos o solo los modificados
+        results[label] = {"seconds": round(elapsed, 3), "files": files,
+                          "files_per_second": round(files / elapsed, 1) if elapsed > 0 else None}
+    chunks = collection_count()
+    results["chunks"] = chunks
+    results["full"]["chunks_per_second"] = round(chunks / results["full"]["seconds"], 1) if results["full"]["seconds"] else None
+    return results
+
+
+async def run_session(client: httpx.AsyncClient, number: int, messages: int, project_path: str,
+                      latencies: Dict[str, List[float]], errors: List[str]) -> None:
+    data = await _timed_post(client, "/start_conversation", {
+        "initial_description": f"Sesión de benchmark {number}: exportar los reportes de pedidos a CSV.",
+        "template_type": "feature.md",
+        "project_path": project_path,
+    }, latencies, errors)
+    session_id = data.get("session_id")
+    if not session_id:
+        return
+    for message_number in range(messages):
+        await _timed_post(client, "/send_message", {
+            "session_id": session_id,
+            "user_message": f"Respuesta {message_number}: validar el pedido {number} antes de exportarlo.",
+        }, latencies, errors)
+    await _timed_post(client, "/generate_documents", {"session_id": session_id, "template_type": "feature.md"},
+                      latencies, errors)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import main
+    from index_state import collection_name_for, project_id_for
+    from providers import init_registry
+
+    registry = init_registry()
+    registry.set_embed_model(FakeEmbedding(model_name="fake-embedding", embed_dim=args.embedding_dim,
+                                           batch_latency=args.embedding_latency))
+    registry.set_llm("google", FakeLLM(first_token_latency=args.llm_latency, tokens_per_second=args.llm_tokens_per_second,
+                                       output_tokens=args.llm_output_tokens))
+
+    project_path = os.path.abspath("repo")
+    print(f"Generando repositorio sintético: {args.files} archivos de {args.lines} líneas...")
+    created = generate_repository(project_path, args.files, args.lines, args.seed)
+    python_files = [rel for rel in created if rel.endswith(".py")]
+    touched = random.Random(args.seed).sample(python_files, max(1, int(len(python_files) * args.touch_ratio))) if python_files else []
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            print("Indexando...")
+            indexing = await bench_indexing(
+                client, project_path, touched,
+                lambda: registry.get_chroma_client().get_collection(collection_name_for(project_id_for(project_path))).count(),
+            )
+            rss_after_indexing = peak_rss_mb()
+
+            print(f"Sesiones concurrentes: {args.sessions} x {args.messages} mensajes + generación de documentos...")
+            latencies: Dict[str, List[float]] = {}
+            errors: List[str] = []
+            started = time.perf_counter()
+            await asyncio.gather(*[
+                run_session(client, number, args.messages, project_path, latencies, errors)
+                for number in range(args.sessions)
+            ])
+            sessions_elapsed = time.perf_counter() - started
+
+    return {
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("json", "workdir", "keep")},
+        "indexing": indexing,
+        "sessions": {
+            "seconds": round(sessions_elapsed, 3),
+            "latency": {endpoint: latency_summary(values) for endpoint, values in latencies.items()},
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+        },
+        "peak_rss_mb": {"after_indexing": round(rss_after_indexing, 1), "total": round(peak_rss_mb(), 1)},
+    }
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    indexing = results["indexing"]
+    print("\n=== Indexación ===")
+    print(f"Completa: {indexing['full']['seconds']}s, {indexing['full']['files']} archivos "
+          f"({indexing['full']['files_per_second']} archivos/s), {indexing['chunks']} chunks "
+          f"({indexing['full']['chunks_per_second']} chunks/s)")
+    print(f"Incremental: {indexing['incremental']['seconds']}s para {indexing['incremental']['files']} archivos modificados")
+    print("\n=== Latencia por endpoint (s) ===")
+    for endpoint, summary in results["sessions"]["latency"].items():
+        if summary["count"]:
+            print(f"{endpoint}: n={summary['count']} media={summary['mean']:.3f} p50={summary['p50']:.3f} "
+                  f"p95={summary['p95']:.3f} p99={summary['p99']:.3f} max={summary['max']:.3f}")
+    print(f"Tiempo total de las sesiones: {results['sessions']['seconds']}s")
+    if results["sessions"]["errors"]:
+        print(f"{results['sessions']['errors']} errores; primero: {results['sessions']['first_error']}")
+    print(f"\nPico de RSS: {results['peak_rss_mb']['after_indexing']} MB tras indexar, {results['peak_rss_mb']['total']} MB al final")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark sin red con LLM y embeddings falsos.")
+    parser.add_argument("--files", type=int, default=500, help="Archivos del repositorio sintético.")
+    parser.add_argument("--lines", type=int, default=80, help="Líneas por archivo.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--touch-ratio", type=float, default=0.01, help="Fracción de archivos .py modificados para la re-indexación incremental.")
+    parser.add_argument("--sessions", type=int, default=8, help="Sesiones concurrentes.")
+    parser.add_argument("--messages", type=int, default=5, help="Mensajes por sesión antes de generar los documentos.")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Segundos hasta el primer token del LLM falso.")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--llm-output-tokens", type=int, default=300)
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Segundos por lote de embeddings.")
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--completion-cache", action="store_true", help="Mantener la caché de respuestas del LLM activada.")
+    parser.add_argument("--workdir", help="Directorio de trabajo (por defecto, uno temporal que se borra al terminar).")
+    parser.add_argument("--keep", action="store_true", help="No borrar el directorio de trabajo temporal.")
+    parser.add_argument("--json", help="Archivo donde guardar los resultados en JSON.")
+    args = parser.parse_args()
+
+    # Antes de importar la app, que lee su configuración del entorno al importarse
+    os.environ["COMPLETION_CACHE_ENABLED"] = "true" if args.completion_cache else "false"
+    os.environ["SESSION_STORE_BACKEND"] = "memory"
+    os.environ.setdefault("METRICS_ENABLED", "true")
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="prd-benchmark-")).resolve()
+    _prepare_workdir(workdir)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(REPO_ROOT)
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {json_path}")
+
+
+if __name__ == "__main__":
+    main_cli()
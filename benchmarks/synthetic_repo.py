@@ -0,0 +1,109 @@
+# benchmarks/synthetic_repo.py
+# Generador de repositorios sintéticos para los benchmarks: módulos Python con funciones y clases
+# (lo que trocea CodeAwareNodeParser), algo de JavaScript y documentación Markdown, repartidos en
+# paquetes anidados. El contenido depende solo de la semilla, así que dos ejecuciones con los mismos
+# parámetros indexan exactamente lo mismo.
+#
+# Uso independiente:
+#   python benchmarks/synthetic_repo.py /tmp/repo_sintetico --files 2000 --lines 120
+
+import argparse
+import random
+from pathlib import Path
+from typing import List
+
+_NOUNS = ("user", "order", "invoice", "report", "session", "project", "payment", "ticket", "export", "account")
+_VERBS = ("load", "save", "validate", "compute", "render", "sync", "parse", "build", "notify", "archive")
+# Subpaquetes; ninguno coincide con los patrones que gitingest ignora por defecto (build/, dist/...)
+_AREAS = ("api", "core", "services", "domain", "handlers", "jobs", "views", "forms", "adapters", "schemas")
+
+
+def _identifier(rng: random.Random) -> str:
+    return f"{rng.choice(_VERBS)}_{rng.choice(_NOUNS)}_{rng.randrange(10_000)}"
+
+
+def _python_module(rng: random.Random, lines: int) -> str:
+    out: List[str] = ['"""Módulo generado para benchmarks."""', "", "import os", ""]
+    while len(out) < lines:
+        if rng.random() < 0.3:
+            class_name = "".join(part.capitalize() for part in _identifier(rng).split("_"))
+            out += [f"class {class_name}:", f'    """Gestiona {rng.choice(_NOUNS)}s."""', ""]
+            for _ in range(rng.randint(1, 3)):
+                out += [f"    def {_identifier(rng)}(self, value):",
+                        f"        result = value * {rng.randint(2, 9)}",
+                        f"        return os.getenv('{rng.choice(_NOUNS).upper()}_MODE', result)", ""]
+        else:
+            name = _identifier(rng)
+            out += [f"def {name}(items, limit={rng.randint(1, 100)}):",
+                    f'    """Procesa {rng.choice(_NOUNS)}s hasta limit."""',
+                    "    total = 0",
+                    "    for item in items[:limit]:",
+                    f"        total += len(str(item)) + {rng.randint(0, 50)}",
+                    "    return total", ""]
+    return "\n".join(out[:lines]) + "\n"
+
+
+def _javascript_module(rng: random.Random, lines: int) -> str:
+    out: List[str] = []
+    while len(out) < lines:
+        name = "".join(part.capitalize() if i else part for i, part in enumerate(_identifier(rng).split("_")))
+        out += [f"export function {name}(items) {{",
+                f"  return items.filter((item) => item.{rng.choice(_NOUNS)}Id > {rng.randint(0, 99)});",
+                "}", ""]
+    return "\n".join(out[:lines]) + "\n"
+
+
+def _markdown_doc(rng: random.Random, lines: int) -> str:
+    out: List[str] = [f"# Guía de {rng.choice(_NOUNS)}s", ""]
+    while len(out) < lines:
+        out += [f"## {rng.choice(_VERBS).capitalize()} {rng.choice(_NOUNS)}s", "",
+                f"El endpoint `/{rng.choice(_NOUNS)}s/{rng.choice(_VERBS)}` llama a `{_identifier(rng)}` "
+                f"y guarda el resultado en la tabla {rng.choice(_NOUNS)}s.", ""]
+    return "\n".join(out[:lines]) + "\n"
+
+
+def generate_repository(path: str, files: int = 500, lines_per_file: int = 80, seed: int = 0) -> List[str]:
+    """
+    Crea en path un repositorio sintético de `files` archivos de unas `lines_per_file` líneas
+    (≈80% Python, 10% JavaScript, 10% Markdown). Devuelve las rutas relativas creadas.
+    """
+    rng = random.Random(seed)
+    root = Path(path)
+    created: List[str] = []
+    for number in range(files):
+        package = f"src/{_NOUNS[number % len(_NOUNS)]}/{_AREAS[(number // len(_NOUNS)) % len(_AREAS)]}"
+        kind = rng.random()
+        if kind < 0.8:
+            rel, content = f"{package}/module_{number}.py", _python_module(rng, lines_per_file)
+        elif kind < 0.9:
+            rel, content = f"web/{package}/component_{number}.js", _javascript_module(rng, lines_per_file)
+        else:
+            rel, content = f"docs/{_NOUNS[number % len(_NOUNS)]}_{number}.md", _markdown_doc(rng, lines_per_file)
+        file_path = root / rel
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content, encoding="utf-8")
+        created.append(rel)
+    return created
+
+
+def touch_files(path: str, rel_paths: List[str], seed: int = 1) -> None:
+    """Modifica los archivos indicados (añade una función) para medir re-indexaciones incrementales."""
+    rng = random.Random(seed)
+    for rel in rel_paths:
+        with open(Path(path) / rel, "a", encoding="utf-8") as f:
+            f.write(f"\n\ndef {_identifier(rng)}_changed():\n    return {rng.randint(0, 1000)}\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera un repositorio sintético para los benchmarks.")
+    parser.add_argument("path")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=80, help="Líneas por archivo.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    created = generate_repository(args.path, args.files, args.lines, args.seed)
+    print(f"{len(created)} archivos generados en {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# chunking.py
+# Chunking por archivo y consciente del código: el código Python se divide por funciones y clases
+# (con `ast`), el resto de lenguajes por bloques de nivel superior, y la documentación/texto con
+# SentenceSplitter. Cada chunk conserva la ruta, el lenguaje, las líneas y el símbolo que contiene.
+
+import ast
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.node_parser import NodeParser, SentenceSplitter
+from llama_index.core.node_parser.node_utils import build_nodes_from_splits
+from llama_index.core.schema import BaseNode
+
+from utils import estimate_tokens
+
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))  # en tokens (aprox. 4 caracteres por token)
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+
+_EXTENSION_LANGUAGES = {
+    ".py": "python", ".pyi": "python",
+    ".js": "javascript", ".jsx": "javascript", ".mjs": "javascript", ".cjs": "javascript",
+    ".ts": "typescript", ".tsx": "typescript",
+    ".java": "java", ".kt": "kotlin", ".kts": "kotlin", ".scala": "scala", ".groovy": "groovy",
+    ".go": "go", ".rs": "rust", ".c": "c", ".h": "c", ".cc": "cpp", ".cpp": "cpp", ".hpp": "cpp",
+    ".cs": "csharp", ".swift": "swift", ".m": "objective-c", ".rb": "ruby", ".php": "php",
+    ".dart": "dart", ".lua": "lua", ".r": "r", ".sh": "shell", ".bash": "shell", ".zsh": "shell",
+    ".sql": "sql", ".html": "html", ".css": "css", ".scss": "css", ".vue": "vue", ".svelte": "svelte",
+    ".md": "markdown", ".rst": "rst", ".txt": "text",
+    ".json": "json", ".yaml": "yaml", ".yml": "yaml", ".toml": "toml", ".ini": "ini", ".xml": "xml",
+}
+# Lenguajes que se tratan como prosa/configuración en lugar de código
+_TEXT_LANGUAGES = {"markdown", "rst", "text", "json", "yaml", "toml", "ini", "xml", "unknown"}
+
+_CLOSING_LINE = re.compile(r"^[\)\]\}]")
+_NEWLINE = re.compile(r"\r\n|\r|\n")
+
+
+def detect_language(file_path: str) -> str:
+    name = os.path.basename(file_path)
+    if name in ("Dockerfile", "Makefile"):
+        return name.lower()
+    return _EXTENSION_LANGUAGES.get(os.path.splitext(name)[1].lower(), "unknown")
+
+
+def _split_lines(text: str) -> List[str]:
+    # Mismos saltos de línea que cuenta `ast` (str.splitlines también corta en \x0c, \x1c, ...)
+    return _NEWLINE.split(text)
+
+
+# Un segmento es (línea_inicial, línea_final, símbolo) con líneas 1-indexadas e inclusivas
+Segment = Tuple[int, int, Optional[str]]
+
+
+def _python_segments(text: str, max_tokens: int) -> Optional[List[Segment]]:
+    """Segmentos de nivel superior de un módulo Python; las clases grandes se dividen por métodos."""
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+    lines = _split_lines(text)
+    segments: List[Segment] = []
+
+    def start_of(node: ast.AST) -> int:
+        decorators = getattr(node, "decorator_list", [])
+        return min([node.lineno] + [d.lineno for d in decorators])
+
+    def add_definitions(body: List[ast.stmt], prefix: str, first_line: int, last_line: int) -> None:
+        cursor = first_line
+        for node in body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            start, end = start_of(node), node.end_lineno
+            if start > cursor:
+                segments.append((cursor, start - 1, prefix or None))
+            symbol = f"{prefix}{node.name}"
+            segment_text = "\n".join(lines[start - 1:end])
+            if isinstance(node, ast.ClassDef) and estimate_tokens(segment_text) > max_tokens:
+                add_definitions(node.body, f"{symbol}.", start, end)
+            else:
+                kind = "class" if isinstance(node, ast.ClassDef) else "def"
+                segments.append((start, end, f"{kind} {symbol}"))
+            cursor = end + 1
+        if cursor <= last_line:
+            segments.append((cursor, last_line, prefix or None))
+
+    add_definitions(tree.body, "", 1, len(lines))
+    return segments
+
+
+def _generic_code_segments(text: str) -> List[Segment]:
+    """
+    Fallback para otros lenguajes: corta antes de cada línea sin indentación precedida por una línea
+    en blanco (inicio típico de una función, clase o bloque de nivel superior).
+    """
+    lines = _split_lines(text)
+    segments: List[Segment] = []
+    start = 1
+    for number, line in enumerate(lines, start=1):
+        if number == 1 or not line.strip() or line[0].isspace() or _CLOSING_LINE.match(line):
+            continue
+        if not lines[number - 2].strip() and number > start:
+            segments.append((start, number - 1, None))
+            start = number
+    if start <= len(lines):
+        segments.append((start, len(lines), None))
+    return [(s, e, lines[s - 1].strip()[:80] or None) for s, e, _ in segments]
+
+
+class CodeAwareNodeParser(NodeParser):
+    """
+    Divide cada Document (un archivo) en chunks alineados con límites sintácticos. Los segmentos
+    pequeños contiguos se agrupan hasta `chunk_size` tokens y los demasiado grandes se cortan por líneas.
+    Los archivos que no son código se dividen con SentenceSplitter.
+    """
+
+    chunk_size: int = Field(default=CHUNK_SIZE, description="Tamaño máximo de un chunk en tokens.")
+    chunk_overlap: int = Field(default=CHUNK_OVERLAP, description="Solapamiento para archivos de texto.")
+
+    _text_splitter: SentenceSplitter = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._text_splitter = SentenceSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CodeAwareNodeParser"
+
+    def _parse_nodes(self, nodes: Sequence[BaseNode], show_progress: bool = False, **kwargs: Any) -> List[BaseNode]:
+        all_nodes: List[BaseNode] = []
+        for document in nodes:
+            file_path = document.metadata.get("file_path", document.node_id)
+            language = document.metadata.get("language") or detect_language(file_path)
+            text = document.get_content()
+
+            chunks = self._code_chunks(text, language) if language not in _TEXT_LANGUAGES else None
+            if chunks is None:
+                splits = self._text_splitter.split_text(text)
+                all_nodes.extend(self._build_nodes(document, [(split, {}) for split in splits], language))
+            else:
+                all_nodes.extend(self._build_nodes(document, chunks, language))
+        return all_nodes
+
+    def _build_nodes(self, document: BaseNode, chunks: List[Tuple[str, Dict]], language: str) -> List[BaseNode]:
+        chunks = [(chunk_text, extra) for chunk_text, extra in chunks if chunk_text.strip()]
+        built = build_nodes_from_splits([chunk_text for chunk_text, _ in chunks], document, id_func=self.id_func)
+        for node, (_, extra) in zip(built, chunks):
+            node.metadata.update({"language": language, **extra})
+            for key in ("start_line", "end_line"):
+                if key not in node.excluded_embed_metadata_keys:
+                    node.excluded_embed_metadata_keys.append(key)
+        return built
+
+    def _code_chunks(self, text: str, language: str) -> Optional[List[Tuple[str, Dict]]]:
+        segments = _python_segments(text, self.chunk_size) if language == "python" else None
+        if segments is None:
+            segments = _generic_code_segments(text)
+        lines = _split_lines(text)
+
+        chunks: List[Tuple[str, Dict]] = []
+        pending: List[Segment] = []
+
+        def flush() -> None:
+            if not pending:
+                return
+            start, end = pending[0][0], pending[-1][1]
+            symbols = list(dict.fromkeys(symbol for _, _, symbol in pending if symbol))
+            extra: Dict[str, Any] = {"start_line": start, "end_line": end}
+            if symbols:
+                extra["symbol"] = ", ".join(symbols)[:200]
+            chunks.append(("\n".join(lines[start - 1:end]), extra))
+            pending.clear()
+
+        for segment in segments:
+            start, end, symbol = segment
+            segment_tokens = estimate_tokens("\n".join(lines[start - 1:end]))
+            if segment_tokens > self.chunk_size:
+                flush()
+                for window_start, window_end in self._line_windows(lines, start, end):
+                    pending.append((window_start, window_end, symbol))
+                    flush()
+                continue
+            pending_tokens = estimate_tokens("\n".join(lines[pending[0][0] - 1:pending[-1][1]])) if pending else 0
+            if pending and pending_tokens + segment_tokens > self.chunk_size:
+                flush()
+            pending.append(segment)
+        flush()
+        return chunks
+
+    def _line_windows(self, lines: List[str], start: int, end: int) -> List[Tuple[int, int]]:
+        """Corta un segmento demasiado grande en ventanas consecutivas de líneas completas."""
+        windows: List[Tuple[int, int]] = []
+        window_start, tokens = start, 0
+        for number in range(start, end + 1):
+            line_tokens = estimate_tokens(lines[number - 1]) + 1
+            if tokens + line_tokens > self.chunk_size and number > window_start:
+                windows.append((window_start, number - 1))
+                window_start, tokens = number, 0
+            tokens += line_tokens
+        windows.append((window_start, end))
+        return windows
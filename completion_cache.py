@@ -0,0 +1,293 @@
+# completion_cache.py
+# Caché de respuestas del LLM. La clave es (proveedor, modelo, hash del prompt ya renderizado), de
+# modo que volver a generar los documentos o el resumen de un chat sin cambios se sirve en
+# milisegundos sin llamar al proveedor. En memoria es LRU con TTL, acotada por número de entradas y
+# por bytes; opcionalmente persiste en SQLite y admite un nivel por similitud de embeddings.
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from providers import get_registry
+from utils import LRUCache
+
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "512"))
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))  # segundos; 0 = sin caducidad
+# Ruta del archivo SQLite para conservar la caché entre reinicios (vacío = solo memoria)
+COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH", "")
+# Similitud coseno mínima para reutilizar la respuesta de un prompt casi idéntico (0 = desactivado)
+COMPLETION_CACHE_SIMILARITY = float(os.getenv("COMPLETION_CACHE_SIMILARITY", "0"))
+
+
+def llm_namespace(llm) -> str:
+    """Identifica proveedor y modelo (y temperatura, que cambia la respuesta esperada) de un cliente."""
+    model = getattr(llm, "model", None) or getattr(llm, "model_name", None) or ""
+    temperature = getattr(llm, "temperature", None)
+    return f"{type(llm).__name__}:{model}:{temperature}"
+
+
+def prompt_key(namespace: str, prompt: str) -> str:
+    return hashlib.sha256(f"{namespace}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+def _normalized(embedding: List[float]) -> np.ndarray:
+    """Embedding como vector unitario float32: la similitud coseno es entonces un producto escalar."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@dataclass
+class _Entry:
+    namespace: str
+    text: str
+    created_at: float
+    size: int
+    embedding: Optional[np.ndarray] = None  # Normalizado (ver _normalized)
+
+
+class _DiskStore:
+    """Almacén SQLite de respuestas (un solo archivo, acceso serializado entre hilos)."""
+
+    def __init__(self, path: str, max_entries: int):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_entries = max_entries
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, text TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str, ttl: float) -> Optional[Tuple[str, str, float]]:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT namespace, text, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if ttl and time.time() - row[2] > ttl:
+                self._connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return row
+
+    def put(self, key: str, namespace: str, text: str, created_at: float, ttl: float) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, namespace, text, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, namespace, text, created_at, created_at),
+            )
+            if ttl:
+                self._connection.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - ttl,))
+            self._connection.execute(
+                "DELETE FROM completions WHERE key NOT IN "
+                "(SELECT key FROM completions ORDER BY accessed_at DESC LIMIT ?)", (self.max_entries,)
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM completions")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class CompletionCache:
+    """
+    Caché de respuestas completas del LLM. `aget` busca primero por clave exacta (memoria y, si hay,
+    disco) y después, si está activado, la entrada más parecida del mismo proveedor/modelo por
+    similitud coseno de los embeddings de los prompts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = COMPLETION_CACHE_MAX_ENTRIES,
+        max_bytes: int = COMPLETION_CACHE_MAX_BYTES,
+        ttl: float = COMPLETION_CACHE_TTL,
+        disk_path: Optional[str] = COMPLETION_CACHE_PATH or None,
+        similarity_threshold: float = COMPLETION_CACHE_SIMILARITY,
+        embed_model_factory: Optional[Callable[[], Any]] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._embed_model_factory = embed_model_factory
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk = _DiskStore(disk_path, max_entries) if disk_path else None
+        # Embeddings de los prompts consultados, para no recalcularlos al guardar la respuesta
+        self._prompt_embeddings = LRUCache(64)
+        self.hits = 0
+        self.disk_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.similarity_threshold > 0 and self._embed_model_factory is not None
+
+    def get(self, namespace: str, prompt: str) -> Optional[str]:
+        """Búsqueda exacta en memoria y en disco (sin el nivel semántico)."""
+        key = prompt_key(namespace, prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.text
+        if self._disk is not None:
+            row = self._disk.get(key, self.ttl)
+            if row is not None:
+                row_namespace, text, created_at = row
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._insert(key, _Entry(row_namespace, text, created_at, len(text.encode("utf-8"))))
+                return text
+        return None
+
+    async def aget(self, namespace: str, prompt: str) -> Optional[str]:
+        text = await asyncio.to_thread(self.get, namespace, prompt) if self._disk else self.get(namespace, prompt)
+        if text is not None:
+            return text
+        if self.semantic_enabled:
+            text = await self._semantic_lookup(namespace, prompt)
+            if text is not None:
+                return text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def aput(self, namespace: str, prompt: str, text: str) -> None:
+        key = prompt_key(namespace, prompt)
+        embedding = None
+        if self.semantic_enabled:
+            embedding = self._prompt_embeddings.get(key)
+            if embedding is None:
+                embedding = await self._embed(prompt)
+        entry = _Entry(namespace, text, time.time(), len(text.encode("utf-8")), embedding)
+        with self._lock:
+            self._insert(key, entry)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put, key, namespace, text, entry.created_at, self.ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self._prompt_embeddings.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+
+    async def _semantic_lookup(self, namespace: str, prompt: str) -> Optional[str]:
+        key = prompt_key(namespace, prompt)
+        embedding = await self._embed(prompt)
+        if embedding is None:
+            return None
+        self._prompt_embeddings.put(key, embedding)
+        # La comparación con todas las entradas es vectorizada y se hace fuera del event loop
+        return await asyncio.to_thread(self._nearest, namespace, embedding)
+
+    def _nearest(self, namespace: str, embedding: np.ndarray) -> Optional[str]:
+        with self._lock:
+            candidates = [(key, entry.embedding) for key, entry in self._entries.items()
+                          if entry.namespace == namespace and entry.embedding is not None
+                          and entry.embedding.shape == embedding.shape and not self._expired(entry)]
+            if not candidates:
+                return None
+            scores = np.stack([candidate for _, candidate in candidates]) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            best_key = candidates[best][0]
+            self._entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            return self._entries[best_key].text
+
+    async def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        try:
+            return _normalized(await self._embed_model_factory().aget_text_embedding(prompt))
+        except Exception as e:
+            # El nivel semántico es opcional: si falla, se sigue como un fallo de caché normal
+            print(f"No se pudo calcular el embedding del prompt para la caché: {e}")
+            return None
+
+    def _expired(self, entry: _Entry) -> bool:
+        return bool(self.ttl) and time.time() - entry.created_at > self.ttl
+
+    def _insert(self, key: str, entry: _Entry) -> None:
+        if self.max_entries <= 0 or entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+_completion_cache: Optional[CompletionCache] = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """Caché global de respuestas; None si está desactivada con COMPLETION_CACHE_ENABLED=false."""
+    global _completion_cache
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    with _completion_cache_lock:
+        if _completion_cache is None:
+            _completion_cache = CompletionCache(embed_model_factory=lambda: get_registry().get_embed_model())
+        return _completion_cache
+
+
+def close_completion_cache() -> None:
+    global _completion_cache
+    with _completion_cache_lock:
+        cache, _completion_cache = _completion_cache, None
+    if cache is not None:
+        cache.close()
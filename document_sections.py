@@ -0,0 +1,260 @@
+# document_sections.py
+# Estructura por secciones de los documentos generados (PRD, historias de usuario y plan técnico).
+# Al generarlos, cada documento se divide una sola vez por sus encabezados Markdown y el árbol se
+# guarda en la sesión ("document_sections"), junto con las dependencias entre documentos: qué
+# secciones del PRD usa cada sección de las historias de usuario y del plan técnico. Así se puede
+# regenerar una sola sección con el contexto que necesita y, si es del PRD, actualizar solo las
+# secciones que dependen de ella (ver app.regenerate_document_section).
+#
+# Las dependencias se estiman sin LLM, por los términos que comparten las secciones (ponderados
+# por lo poco frecuentes que son en el PRD, como en BM25), y se recalculan tras cada cambio.
+
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Set
+
+from lexical_index import tokenize
+
+DOCUMENTS = ("prd", "user_stories", "technical_plan")
+DOCUMENT_NAMES = {"prd": "PRD", "user_stories": "Historias de Usuario", "technical_plan": "Plan Técnico"}
+# Documentos generados a partir de otro: al cambiar una sección del PRD se revisan sus dependientes
+DEPENDENT_DOCUMENTS = {"prd": ("user_stories", "technical_plan")}
+# Fracción mínima del peso de los términos de una sección que debe compartir con una sección del
+# PRD para considerarla dependiente (además, siempre depende de la que más comparte)
+SECTION_DEPENDENCY_MIN_OVERLAP = float(os.getenv("SECTION_DEPENDENCY_MIN_OVERLAP", "0.2"))
+
+PREAMBLE_ID = "_preamble"
+_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+_FENCE = re.compile(r"^[ \t]*(```|~~~)")
+_SLUG_STRIP = re.compile(r"[^\w]+")
+_MIN_TERM_LENGTH = 4  # Descarta artículos y preposiciones ("de", "la", "los", "para"...)
+
+
+@dataclass
+class Section:
+    """Una sección: su encabezado y el texto hasta el siguiente encabezado (sin sus subsecciones)."""
+    id: str
+    level: int  # 0 = texto antes del primer encabezado
+    title: str
+    parent: Optional[str]
+    content: str  # Incluye la línea del encabezado
+    content_hash: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _slug(title: str) -> str:
+    return _SLUG_STRIP.sub("-", title.lower()).strip("-") or "seccion"
+
+
+def parse_sections(markdown: str) -> List[Section]:
+    """
+    Divide un documento Markdown por sus encabezados (ignorando los que están dentro de bloques de
+    código). Los ids son la ruta de títulos del encabezado ("requisitos/seguridad"), así que se
+    mantienen al editar otras secciones. render_sections(parse_sections(md)) == md.
+    """
+    blocks: List[List[str]] = [[]]
+    headings: List[Optional[re.Match]] = [None]
+    in_fence = False
+    for line in markdown.split("\n"):
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        heading = None if in_fence else _HEADING.match(line)
+        if heading:
+            blocks.append([])
+            headings.append(heading)
+        blocks[-1].append(line)
+
+    sections: List[Section] = []
+    stack: List[Section] = []  # Ancestros del encabezado actual
+    used_ids: Set[str] = set()
+    for lines, heading in zip(blocks, headings):
+        if heading is None:
+            if lines:  # Texto antes del primer encabezado (vacío si el documento empieza con uno)
+                sections.append(_section(PREAMBLE_ID, 0, "", None, lines))
+            continue
+        level, title = len(heading.group(1)), heading.group(2).strip()
+        while stack and stack[-1].level >= level:
+            stack.pop()
+        parent = stack[-1] if stack else None
+        base_id = f"{parent.id}/{_slug(title)}" if parent else _slug(title)
+        section_id, counter = base_id, 2
+        while section_id in used_ids:  # Títulos repetidos bajo el mismo padre
+            section_id, counter = f"{base_id}-{counter}", counter + 1
+        used_ids.add(section_id)
+        section = _section(section_id, level, title, parent.id if parent else None, lines)
+        sections.append(section)
+        stack.append(section)
+    return sections
+
+
+def _section(section_id: str, level: int, title: str, parent: Optional[str], lines: List[str]) -> Section:
+    content = "\n".join(lines)
+    return Section(section_id, level, title, parent, content, hashlib.sha1(content.encode("utf-8")).hexdigest()[:16])
+
+
+def render_sections(sections: List[Section]) -> str:
+    return "\n".join(section.content for section in sections)
+
+
+def section_span(sections: List[Section], section_id: str) -> List[Section]:
+    """La sección y todas sus subsecciones, en orden."""
+    for start, section in enumerate(sections):
+        if section.id == section_id:
+            end = start + 1
+            while end < len(sections) and sections[end].level > section.level > 0:
+                end += 1
+            return sections[start:end]
+    raise KeyError(section_id)
+
+
+def replace_section(sections: List[Section], section_id: str, markdown: str, with_children: bool = True) -> List[Section]:
+    """Sustituye la sección (y sus subsecciones si with_children) por markdown y vuelve a parsear el documento."""
+    span = section_span(sections, section_id) if with_children else [find_section(sections, section_id)]
+    start = sections.index(span[0])
+    replacement = Section(section_id, 0, "", None, markdown, "")  # Solo se usa su contenido al renderizar
+    return parse_sections(render_sections(sections[:start] + [replacement] + sections[start + len(span):]))
+
+
+def replace_sections(sections: List[Section], replacements: Dict[str, str]) -> List[Section]:
+    """
+    Sustituye varias secciones (sin sus subsecciones) por su nuevo markdown en una sola pasada, por
+    posición, y vuelve a parsear el documento una vez: los ids que cambie una sustitución no afectan a
+    las demás. Lanza KeyError si alguna sección no existe.
+    """
+    missing = replacements.keys() - {section.id for section in sections}
+    if missing:
+        raise KeyError(sorted(missing)[0])
+    return parse_sections(render_sections([
+        Section(section.id, 0, "", None, replacements[section.id], "") if section.id in replacements else section
+        for section in sections
+    ]))
+
+
+def find_section(sections: List[Section], section_id: str) -> Section:
+    for section in sections:
+        if section.id == section_id:
+            return section
+    raise KeyError(section_id)
+
+
+def normalize_section(markdown: str, original: Section, keep_title: bool = False, allow_subsections: bool = True) -> str:
+    """
+    Ajusta la respuesta del LLM para una sección: quita el bloque de código que la envuelve si lo hay
+    y garantiza que empieza por un encabezado del nivel original (el mismo encabezado si keep_title,
+    o si el LLM lo ha devuelto con otro nivel). Los demás encabezados que no serían subsecciones (de
+    nivel igual o superior al original), o todos si no allow_subsections, se convierten en texto en
+    negrita: así la sección no cambia la estructura (ni los ids) del resto del documento.
+    """
+    text = markdown.strip()
+    fenced = re.match(r"^(```|~~~)[\w-]*\n(.*)\n\1$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(2).strip()
+    if original.level > 0:
+        heading_line = original.content.split("\n", 1)[0]
+        first_line, _, rest = text.partition("\n")
+        heading = _HEADING.match(first_line)
+        if not heading:
+            text = f"{heading_line}\n{text}"
+        elif keep_title or len(heading.group(1)) != original.level:
+            text = f"{heading_line}\n{rest}" if rest else heading_line
+    # El preámbulo no puede contener encabezados: cualquiera abriría una sección nueva
+    max_level = original.level if allow_subsections and original.level > 0 else 6
+    text = _flatten_headings(text, max_level, keep_first=original.level > 0)
+    # Conserva la línea en blanco que separaba la sección de la siguiente
+    return text + "\n" if original.content.endswith("\n") else text
+
+
+def _flatten_headings(text: str, max_level: int = 6, keep_first: bool = True) -> str:
+    """
+    Convierte en negrita los encabezados de nivel max_level o superior (fuera de bloques de código),
+    salvo la primera línea si keep_first.
+    """
+    lines: List[str] = []
+    in_fence = False
+    for index, line in enumerate(text.split("\n")):
+        if index == 0 and keep_first:
+            lines.append(line)
+            continue
+        if _FENCE.match(line):
+            in_fence = not in_fence
+        heading = None if in_fence else _HEADING.match(line)
+        flatten = heading is not None and len(heading.group(1)) <= max_level
+        lines.append(f"**{heading.group(2).strip()}**" if flatten else line)
+    return "\n".join(lines)
+
+
+def outline(sections: List[Section]) -> str:
+    """Índice de encabezados del documento, para que el LLM sepa qué cubren las demás secciones."""
+    return "\n".join(f"{'  ' * (section.level - 1)}- {section.title}" for section in sections if section.level > 0)
+
+
+# --- Dependencias entre documentos ---
+
+def _terms(text: str) -> Set[str]:
+    return {term for term in tokenize(text) if len(term) >= _MIN_TERM_LENGTH}
+
+
+def section_dependencies(sources: List[Section], dependents: List[Section],
+                         min_overlap: float = SECTION_DEPENDENCY_MIN_OVERLAP) -> Dict[str, List[str]]:
+    """
+    Para cada sección de dependents, las secciones de sources en las que se basa: aquellas con las
+    que comparte al menos min_overlap del peso (idf en sources) de sus términos, y siempre la que más.
+    """
+    source_terms = {section.id: _terms(section.content) for section in sources if section.level > 0}
+    document_frequency = Counter(term for terms in source_terms.values() for term in terms)
+    idf = {term: math.log(1 + len(source_terms) / df) for term, df in document_frequency.items()}
+
+    dependencies: Dict[str, List[str]] = {}
+    for section in dependents:
+        terms = _terms(section.content) & idf.keys()
+        total = sum(idf[term] for term in terms)
+        if not total:
+            dependencies[section.id] = []
+            continue
+        scores = {source_id: sum(idf[term] for term in terms & source) / total
+                  for source_id, source in source_terms.items()}
+        best = max(scores, key=scores.get)
+        dependencies[section.id] = [source_id for source_id, score in scores.items()
+                                    if score >= min_overlap or (source_id == best and score > 0)]
+    return dependencies
+
+
+# --- Árbol guardado en la sesión (solo tipos JSON, porque las sesiones se serializan) ---
+
+def build_document_sections(documents: Dict[str, str]) -> Dict[str, Any]:
+    """Árbol de secciones de los documentos generados y sus dependencias, listo para guardar en la sesión."""
+    return serialize_document_sections({name: parse_sections(documents.get(name) or "") for name in DOCUMENTS})
+
+
+def serialize_document_sections(parsed: Dict[str, List[Section]]) -> Dict[str, Any]:
+    """Árbol para la sesión a partir de las secciones parseadas, recalculando las dependencias."""
+    dependencies = {
+        dependent: section_dependencies(parsed[source], parsed[dependent])
+        for source, dependents in DEPENDENT_DOCUMENTS.items() for dependent in dependents
+    }
+    return {
+        "documents": {name: [section.to_dict() for section in sections] for name, sections in parsed.items()},
+        "dependencies": dependencies,
+    }
+
+
+def load_document_sections(tree: Dict[str, Any]) -> Dict[str, List[Section]]:
+    return {name: [Section(**section) for section in sections] for name, sections in tree["documents"].items()}
+
+
+def dependent_sections(tree: Dict[str, Any], source_ids: Set[str]) -> Dict[str, List[str]]:
+    """Secciones de los documentos dependientes que se basan en alguna de source_ids (del PRD)."""
+    return {
+        dependent: [section_id for section_id, sources in dependencies.items() if source_ids & set(sources)]
+        for dependent, dependencies in tree["dependencies"].items()
+    }
+
+
+def rendered_documents(parsed: Dict[str, List[Section]]) -> Dict[str, str]:
+    return {name: render_sections(sections) for name, sections in parsed.items()}
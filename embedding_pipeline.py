@@ -0,0 +1,238 @@
+# embedding_pipeline.py
+# Etapa de embeddings del indexado: envía los chunks en lotes configurables con concurrencia
+# acotada, se adapta a los límites de tasa del proveedor (429) y guarda cada lote completado
+# en Chroma, de modo que una indexación interrumpida se reanuda donde quedó.
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Sequence, Set
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.vector_stores.chroma import ChromaVectorStore
+
+from utils import estimate_tokens
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "50"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+
+_CHROMA_GET_BATCH = 1000
+_RATE_LIMIT_MARKERS = ("429", "resource_exhausted", "resource exhausted", "rate limit", "ratelimit", "quota")
+
+
+def chunk_id_func(i: int, doc: BaseNode) -> str:
+    """
+    id_func para los node parsers: ids deterministas (documento + hash de su contenido + posición),
+    necesarios para saber qué chunks ya están guardados en Chroma al reanudar.
+    """
+    return f"{doc.doc_id}:{doc.hash[:16]}:{i}"
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in _RATE_LIMIT_MARKERS)
+
+
+def existing_node_ids(vector_store: ChromaVectorStore, node_ids: Optional[Sequence[str]] = None,
+                      where: Optional[dict] = None) -> Set[str]:
+    """Ids ya presentes en la colección (todos, los de node_ids, o los que cumplen `where`)."""
+    collection = vector_store.client
+    if node_ids is None:
+        return set(collection.get(where=where, include=[])["ids"])
+    found: Set[str] = set()
+    for start in range(0, len(node_ids), _CHROMA_GET_BATCH):
+        batch = list(node_ids[start:start + _CHROMA_GET_BATCH])
+        found.update(collection.get(ids=batch, include=[])["ids"])
+    return found
+
+
+def delete_node_ids(vector_store: ChromaVectorStore, node_ids: Iterable[str]) -> None:
+    node_ids = list(node_ids)
+    for start in range(0, len(node_ids), _CHROMA_GET_BATCH):
+        vector_store.client.delete(ids=node_ids[start:start + _CHROMA_GET_BATCH])
+
+
+@dataclass
+class EmbeddingStats:
+    total_chunks: int = 0
+    skipped_chunks: int = 0
+    embedded_chunks: int = 0
+    embedded_tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.embedded_chunks / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.embedded_tokens / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.embedded_chunks} chunks embebidos ({self.skipped_chunks} ya estaban en el índice) "
+                f"en {self.batches} lotes y {self.elapsed_seconds:.1f}s: "
+                f"{self.chunks_per_second:.1f} chunks/s, {self.tokens_per_second:.0f} tokens/s, "
+                f"{self.retries} reintentos ({self.rate_limited} por límite de tasa).")
+
+
+class _AdaptiveLimiter:
+    """
+    Limita las peticiones en vuelo. Ante un 429 reduce a la mitad la concurrencia permitida y
+    pausa a todos los workers durante el backoff; cada racha de éxitos la vuelve a subir en uno.
+    """
+
+    def __init__(self, max_concurrency: int, initial_backoff: float, max_backoff: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.allowed = self.max_concurrency
+        self.in_flight = 0
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = initial_backoff
+        self._resume_at = 0.0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.allowed)
+            self.in_flight += 1
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def on_success(self) -> None:
+        async with self._condition:
+            self._successes += 1
+            if self._successes >= self.allowed and self.allowed < self.max_concurrency:
+                self.allowed += 1
+                self._successes = 0
+                self._condition.notify_all()
+            self.backoff = max(self.initial_backoff, self.backoff / 2)
+
+    async def on_rate_limit(self) -> float:
+        async with self._condition:
+            self.allowed = max(1, self.allowed // 2)
+            self._successes = 0
+            delay = self.backoff
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            return delay
+
+
+class EmbeddingPipeline:
+    """
+    Embebe nodos en lotes y los guarda en el vector store a medida que se completan.
+    Acepta cualquier BaseEmbedding de LlamaIndex (p. ej. MockEmbedding para pruebas locales).
+    """
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        vector_store: ChromaVectorStore,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        progress_callback: Optional[Callable[[EmbeddingStats], None]] = None,
+    ):
+        self.embed_model = embed_model
+        self.vector_store = vector_store
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.progress_callback = progress_callback
+
+    async def run(self, nodes: Iterable[BaseNode], stats: Optional[EmbeddingStats] = None) -> EmbeddingStats:
+        """
+        Embebe y guarda los nodos. Si se pasa stats (de llamadas anteriores, p. ej. al procesar el
+        proyecto por lotes de archivos), las métricas se acumulan en él.
+        """
+        nodes = list(nodes)
+        stats = stats or EmbeddingStats()
+        stats.total_chunks += len(nodes)
+        started = time.perf_counter() - stats.elapsed_seconds
+
+        # Reanudación: los lotes de una ejecución anterior ya están en Chroma con el mismo id
+        already_stored = await asyncio.to_thread(existing_node_ids, self.vector_store, [n.node_id for n in nodes])
+        pending = [n for n in nodes if n.node_id not in already_stored]
+        stats.skipped_chunks += len(nodes) - len(pending)
+
+        limiter = _AdaptiveLimiter(self.max_concurrency, self.initial_backoff, self.max_backoff)
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        tasks = [asyncio.create_task(self._process_batch(batch, limiter, stats, started)) for batch in batches]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            stats.elapsed_seconds = time.perf_counter() - started
+        return stats
+
+    async def _process_batch(self, batch: List[BaseNode], limiter: _AdaptiveLimiter,
+                             stats: EmbeddingStats, started: float) -> None:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+        embeddings = await self._embed_with_retry(texts, limiter, stats)
+        for node, embedding in zip(batch, embeddings):
+            node.embedding = embedding
+        # Checkpoint: el lote queda persistido antes de continuar. Si se cancela (otro lote ha fallado
+        # o se cancela la indexación) se espera a que termine la escritura, que sigue en su hilo
+        write = asyncio.ensure_future(asyncio.to_thread(self.vector_store.add, batch))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            await asyncio.gather(write, return_exceptions=True)
+            raise
+
+        stats.batches += 1
+        stats.embedded_chunks += len(batch)
+        stats.embedded_tokens += sum(estimate_tokens(text) for text in texts)
+        stats.elapsed_seconds = time.perf_counter() - started
+        if self.progress_callback:
+            self.progress_callback(stats)
+
+    async def _embed_with_retry(self, texts: List[str], limiter: _AdaptiveLimiter,
+                                stats: EmbeddingStats) -> List[List[float]]:
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            try:
+                embeddings = await self.embed_model.aget_text_embedding_batch(texts)
+            except Exception as e:
+                await limiter.release()
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                stats.retries += 1
+                if is_rate_limit_error(e):
+                    stats.rate_limited += 1
+                    delay = await limiter.on_rate_limit()
+                    print(f"Límite de tasa del modelo de embeddings alcanzado; reintentando en {delay:.1f}s "
+                          f"(concurrencia {limiter.allowed}).")
+                else:
+                    delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+                    print(f"Error al generar embeddings ({type(e).__name__}: {e}); reintento {attempt} en {delay:.1f}s.")
+                    await asyncio.sleep(delay)
+                continue
+            await limiter.release()
+            await limiter.on_success()
+            return embeddings
@@ -0,0 +1,70 @@
+# git_changes.py
+# Detección de cambios con git. Si el proyecto es un repositorio git, el manifiesto guarda el commit
+# indexado y los archivos a revisar se obtienen comparando ese commit con el árbol de trabajo actual
+# (commits nuevos + cambios sin confirmar + archivos sin seguimiento), en lugar de hacer stat() de
+# todo el proyecto. Si git no está disponible o falla, quien llama recurre al escaneo completo.
+
+import os
+import subprocess
+from typing import Iterable, List, Optional, Set
+
+GIT_CHANGE_DETECTION = os.getenv("GIT_CHANGE_DETECTION", "true").lower() in ("1", "true", "yes")
+GIT_TIMEOUT = float(os.getenv("GIT_TIMEOUT", "30"))
+
+# Si cambian las reglas de exclusión, el conjunto de archivos indexables puede cambiar en cualquier
+# parte del proyecto: git no basta y hay que escanearlo entero.
+_IGNORE_FILES = (".gitignore", ".gitingestignore")
+
+
+def _git(project_path: str, *args: str) -> Optional[str]:
+    """Ejecuta git en project_path; devuelve la salida o None si git no está disponible o falla."""
+    try:
+        result = subprocess.run(
+            ["git", "-C", project_path, *args],
+            capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=GIT_TIMEOUT,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def _paths(output: str) -> List[str]:
+    return [path for path in output.split("\0") if path]
+
+
+def head_commit(project_path: str) -> Optional[str]:
+    """SHA del commit actual (HEAD) del repositorio que contiene project_path, o None si no hay."""
+    if not GIT_CHANGE_DETECTION:
+        return None
+    output = _git(project_path, "rev-parse", "--verify", "-q", "HEAD")
+    if output is None:
+        return None
+    return output.strip() or None
+
+
+def changed_paths_since(project_path: str, commit: str, indexed_paths: Iterable[str]) -> Optional[Set[str]]:
+    """
+    Rutas (relativas a project_path) que pueden haber cambiado desde que se indexó `commit`:
+    - las que difieren entre ese commit y el árbol de trabajo (commits posteriores, cambios
+      preparados y sin preparar, incluidos borrados y renombrados);
+    - los archivos sin seguimiento que no ignora git;
+    - los archivos indexados que git no sigue (p. ej. ignorados por .git/info/exclude), que
+      se revisan siempre porque git no informa de sus cambios.
+    Devuelve None si no se puede usar git (el commit ya no existe, git falla...) o si han cambiado
+    las reglas de exclusión; en ese caso hay que escanear el proyecto completo.
+    """
+    if not GIT_CHANGE_DETECTION:
+        return None
+    diff = _git(project_path, "diff", "--name-only", "--no-renames", "--relative", "-z", commit, "--")
+    untracked = _git(project_path, "ls-files", "--others", "--exclude-standard", "-z")
+    tracked = _git(project_path, "ls-files", "-z")
+    if diff is None or untracked is None or tracked is None:
+        return None
+    changed = set(_paths(diff)) | set(_paths(untracked))
+    if any(os.path.basename(path) in _IGNORE_FILES for path in changed):
+        return None
+    tracked_paths = set(_paths(tracked))
+    changed.update(path for path in indexed_paths if path not in tracked_paths)
+    return changed
@@ -0,0 +1,194 @@
+# index_state.py
+# Estado persistente del índice que vive junto a ./chroma_db (fuera de las colecciones de Chroma):
+# el manifiesto de archivos indexados (y el commit de git indexado), usado para re-indexar de forma
+# incremental, el árbol/resumen de gitingest, para cargar un índice existente sin volver a ingerir
+# el proyecto, y el índice léxico (BM25) de los chunks.
+
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+CHROMA_DB_PATH = "./chroma_db"
+INDEX_STATE_DIR = os.path.join(CHROMA_DB_PATH, "index_state")
+PROJECTS_FILE = os.path.join(INDEX_STATE_DIR, "projects.json")
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str] = field(default_factory=list)
+    modified: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    @property
+    def to_embed(self) -> List[str]:
+        return self.added + self.modified
+
+
+def project_id_for(project_path: str) -> str:
+    """Id estable de un proyecto, derivado de su ruta absoluta (sin enlaces simbólicos)."""
+    return hashlib.sha1(os.path.realpath(project_path).encode("utf-8")).hexdigest()[:16]
+
+
+def collection_name_for(project_id: str) -> str:
+    """Colección de ChromaDB de un proyecto: una por proyecto, para poder tener varios indexados a la vez."""
+    return f"project_{project_id}"
+
+
+def _state_key(collection_name: str, project_path: str) -> str:
+    project_hash = hashlib.sha1(os.path.realpath(project_path).encode("utf-8")).hexdigest()[:12]
+    return f"{collection_name}_{project_hash}"
+
+
+def _manifest_path(collection_name: str, project_path: str) -> str:
+    return os.path.join(INDEX_STATE_DIR, f"{_state_key(collection_name, project_path)}.manifest.json")
+
+
+def _ingest_snapshot_path(collection_name: str, project_path: str) -> str:
+    return os.path.join(INDEX_STATE_DIR, f"{_state_key(collection_name, project_path)}.tree.json.gz")
+
+
+def _write_json_atomic(path: str, data: Dict, compress: bool = False) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    opener = gzip.open if compress else open
+    with opener(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_manifest_state(collection_name: str, project_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve el último manifiesto guardado para (colección, proyecto): {"files", "git_commit"},
+    o None si no existe o está corrupto (en cuyo caso se debe re-indexar por completo).
+    """
+    path = _manifest_path(collection_name, project_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("project_path") != os.path.realpath(project_path):
+            return None
+        return {"files": data.get("files", {}), "git_commit": data.get("git_commit")}
+    except (OSError, ValueError) as e:
+        print(f"No se pudo leer el manifiesto del índice '{path}': {e}")
+        return None
+
+
+def save_manifest(collection_name: str, project_path: str, files: Dict[str, Dict],
+                  git_commit: Optional[str] = None) -> None:
+    """git_commit: commit (HEAD) del repositorio en el momento de indexar, si el proyecto usa git."""
+    _write_json_atomic(_manifest_path(collection_name, project_path), {
+        "project_path": os.path.realpath(project_path),
+        "collection": collection_name,
+        "git_commit": git_commit,
+        "files": files,
+    })
+
+
+def manifest_fingerprint(files: Dict[str, Dict]) -> str:
+    """Huella del contenido indexado: cambia si se añade, modifica o elimina cualquier archivo."""
+    digest = hashlib.sha1()
+    for path in sorted(files):
+        digest.update(f"{path}\0{files[path].get('sha256', '')}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def diff_manifests(previous: Dict[str, Dict], current: Dict[str, Dict]) -> ManifestDiff:
+    """Compara dos manifiestos por hash de contenido."""
+    diff = ManifestDiff()
+    for path, entry in current.items():
+        old = previous.get(path)
+        if old is None:
+            diff.added.append(path)
+        elif old.get("sha256") != entry.get("sha256"):
+            diff.modified.append(path)
+    diff.removed = [path for path in previous if path not in current]
+    return diff
+
+
+def load_ingest_snapshot(collection_name: str, project_path: str) -> Optional[Tuple[Any, str]]:
+    """
+    Devuelve (tree, summary) guardados en la última indexación de (colección, proyecto),
+    o None si no hay snapshot.
+    """
+    path = _ingest_snapshot_path(collection_name, project_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("project_path") != os.path.realpath(project_path):
+            return None
+        return data.get("tree"), data.get("summary", "")
+    except (OSError, ValueError) as e:
+        print(f"No se pudo leer el árbol guardado del índice '{path}': {e}")
+        return None
+
+
+def save_ingest_snapshot(collection_name: str, project_path: str, tree: Any, summary: str) -> None:
+    _write_json_atomic(_ingest_snapshot_path(collection_name, project_path), {
+        "project_path": os.path.realpath(project_path),
+        "collection": collection_name,
+        "summary": summary,
+        "tree": tree,
+    }, compress=True)
+
+
+def _lexical_index_path(collection_name: str, project_path: str) -> str:
+    return os.path.join(INDEX_STATE_DIR, f"{_state_key(collection_name, project_path)}.bm25.json.gz")
+
+
+def load_lexical_index(collection_name: str, project_path: str) -> Optional[Dict[str, Any]]:
+    """Datos del índice léxico (BM25) guardado para (colección, proyecto), o None si no hay."""
+    path = _lexical_index_path(collection_name, project_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("project_path") != os.path.realpath(project_path):
+            return None
+        return data
+    except (OSError, ValueError) as e:
+        print(f"No se pudo leer el índice léxico '{path}': {e}")
+        return None
+
+
+def save_lexical_index(collection_name: str, project_path: str, version: str, data: Dict[str, Any]) -> None:
+    """version: huella del manifiesto (manifest_fingerprint) con la que se corresponde el índice léxico."""
+    _write_json_atomic(_lexical_index_path(collection_name, project_path), {
+        "project_path": os.path.realpath(project_path),
+        "collection": collection_name,
+        "version": version,
+        **data,
+    }, compress=True)
+
+
+def load_projects() -> Dict[str, Dict[str, Any]]:
+    """Proyectos indexados alguna vez: {project_id: {"project_path", "collection", "indexed_at"}}."""
+    if not os.path.exists(PROJECTS_FILE):
+        return {}
+    try:
+        with open(PROJECTS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"No se pudo leer el registro de proyectos '{PROJECTS_FILE}': {e}")
+        return {}
+
+
+def record_project(project_id: str, project_path: str, collection_name: str, indexed_at: float) -> None:
+    projects = load_projects()
+    projects[project_id] = {
+        "project_path": os.path.realpath(project_path),
+        "collection": collection_name,
+        "indexed_at": indexed_at,
+    }
+    _write_json_atomic(PROJECTS_FILE, projects)
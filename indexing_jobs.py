@@ -0,0 +1,165 @@
+# indexing_jobs.py
+# Indexación en segundo plano. /index_project crea un trabajo y responde de inmediato con su id;
+# el trabajo informa de la fase (scanning, ingest, chunking, embedding, persisting), del progreso,
+# del throughput y de una estimación del tiempo restante, y puede cancelarse. Las peticiones
+# concurrentes para un mismo proyecto se unifican en un único trabajo.
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from index_state import project_id_for
+from project_registry import LoadedProject, ProjectRegistry
+
+INDEXING_JOBS_HISTORY = int(os.getenv("INDEXING_JOBS_HISTORY", "100"))
+
+_ACTIVE_STATUSES = ("pending", "running")
+
+
+@dataclass
+class IndexingJob:
+    job_id: str
+    project_id: str
+    project_path: str
+    force_index: bool
+    status: str = "pending"  # pending, running, completed, failed, cancelled
+    phase: str = "queued"
+    processed: int = 0
+    total: int = 0
+    throughput: float = 0.0  # unidades (archivos o chunks) por segundo en la fase actual
+    eta_seconds: Optional[float] = None
+    message: str = ""
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    phase_started_at: float = field(default_factory=time.monotonic)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    result: Optional[LoadedProject] = field(default=None, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self.status in _ACTIVE_STATUSES
+
+    def report(self, phase: str, processed: int = 0, total: int = 0, message: str = "",
+               throughput: Optional[float] = None) -> None:
+        """Callback de progreso de index_project."""
+        now = time.monotonic()
+        if phase != self.phase:
+            self.phase, self.phase_started_at = phase, now
+        self.processed, self.total, self.message = processed, total, message
+        elapsed = now - self.phase_started_at
+        if throughput is None:
+            throughput = processed / elapsed if elapsed > 0 else 0.0
+        self.throughput = throughput
+        self.eta_seconds = (total - processed) / throughput if throughput > 0 and total >= processed else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "project_id": self.project_id,
+            "project_path": self.project_path,
+            "force_index": self.force_index,
+            "status": self.status,
+            "phase": self.phase,
+            "processed": self.processed,
+            "total": self.total,
+            "throughput": round(self.throughput, 2),
+            "eta_seconds": round(self.eta_seconds, 1) if self.eta_seconds is not None else None,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IndexingJobManager:
+    """Crea, sigue y cancela trabajos de indexación; conserva los últimos terminados para consultarlos."""
+
+    def __init__(self, project_registry: ProjectRegistry, history_size: int = INDEXING_JOBS_HISTORY):
+        self.project_registry = project_registry
+        self.history_size = history_size
+        self._jobs: "OrderedDict[str, IndexingJob]" = OrderedDict()
+        self._active_by_project: Dict[str, IndexingJob] = {}
+
+    def start(self, project_path: str, force_index: bool = False) -> IndexingJob:
+        """
+        Lanza la indexación del proyecto, o devuelve el trabajo que ya la está haciendo. Si se pide
+        force_index y el trabajo en curso no es forzado, se cancela y lo sustituye uno forzado.
+        """
+        project_id = project_id_for(project_path)
+        previous = self.active_job(project_path)
+        if previous is not None and (previous.force_index or not force_index):
+            return previous
+        if previous is not None:
+            self.cancel(previous.job_id)
+        job = IndexingJob(uuid.uuid4().hex, project_id, os.path.realpath(project_path), force_index)
+        job.task = asyncio.create_task(self._run(job, previous.task if previous is not None else None))
+        job.task.add_done_callback(lambda _: self._finish_unstarted(job))
+        self._jobs[job.job_id] = job
+        self._active_by_project[project_id] = job
+        self._trim_history()
+        return job
+
+    def active_job(self, project_path: str) -> Optional[IndexingJob]:
+        """Trabajo pendiente o en curso para el proyecto, si lo hay."""
+        job = self._active_by_project.get(project_id_for(project_path))
+        return job if job is not None and job.active else None
+
+    def get(self, job_id: str) -> Optional[IndexingJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[IndexingJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.active and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def wait(self, job: IndexingJob) -> IndexingJob:
+        if job.task is not None:
+            await asyncio.gather(job.task, return_exceptions=True)
+        return job
+
+    async def shutdown(self) -> None:
+        for job in list(self._active_by_project.values()):
+            self.cancel(job.job_id)
+        tasks = [job.task for job in self._active_by_project.values() if job.task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: IndexingJob, previous_task: Optional[asyncio.Task] = None) -> None:
+        try:
+            if previous_task is not None:
+                # Espera a que el trabajo cancelado suelte el índice antes de reindexar
+                await asyncio.gather(previous_task, return_exceptions=True)
+            job.status = "running"
+            job.result = await self.project_registry.index(job.project_path, job.force_index, progress_callback=job.report)
+            job.status, job.phase, job.message = "completed", "done", "Proyecto indexado con éxito."
+            job.eta_seconds = 0.0
+        except asyncio.CancelledError:
+            # Los lotes de embeddings ya guardados se conservan: reindexar reanuda donde se quedó
+            job.status, job.message = "cancelled", "Indexación cancelada."
+            job.eta_seconds = None
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+            job.message = f"Error durante la indexación: {e}"
+            job.eta_seconds = None
+            print(f"Error en el trabajo de indexación {job.job_id} ({job.project_path}): {e}")
+        finally:
+            job.finished_at = time.time()
+            if self._active_by_project.get(job.project_id) is job:
+                del self._active_by_project[job.project_id]
+
+    def _finish_unstarted(self, job: IndexingJob) -> None:
+        """Cierra un trabajo cancelado antes de que su tarea llegara a ejecutarse."""
+        if job.active:
+            job.status, job.message, job.finished_at = "cancelled", "Indexación cancelada.", time.time()
+            if self._active_by_project.get(job.project_id) is job:
+                del self._active_by_project[job.project_id]
+
+    def _trim_history(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[job_id]
@@ -0,0 +1,141 @@
+# lexical_index.py
+# Índice léxico (BM25) sobre los mismos chunks que la colección de ChromaDB. La búsqueda por
+# embeddings falla con identificadores exactos (nombres de funciones, rutas de endpoints, claves de
+# configuración); este índice los encuentra y retrieval.py fusiona ambos rankings. Se construye en
+# index_project, se actualiza por archivo en las re-indexaciones incrementales y se guarda junto al
+# manifiesto (ver index_state.save_lexical_index).
+
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+_CAMEL_PARTS = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|\b)|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Términos de un texto: cada identificador completo en minúsculas (get_next_chat_question,
+    retrieval_top_k) y, si es compuesto, también sus partes (snake_case, camelCase), para que
+    coincidan tanto la búsqueda exacta como la de una parte del nombre.
+    """
+    terms: List[str] = []
+    for word in _WORD.findall(text):
+        lowered = word.lower()
+        terms.append(lowered)
+        parts = [part.lower() for chunk in word.split("_") for part in _CAMEL_PARTS.findall(chunk)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class LexicalIndex:
+    """Índice invertido BM25 de chunks, con altas y bajas por archivo (document_id)."""
+
+    def __init__(self):
+        self._chunks: Dict[str, Tuple[str, int, Dict[str, int]]] = {}  # node_id -> (document_id, longitud, frecuencias)
+        self._by_document: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}  # término -> {node_id: frecuencia}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def add(self, node_id: str, document_id: str, text: str) -> None:
+        if node_id in self._chunks:
+            self.remove_ids([node_id])
+        terms = tokenize(text)
+        frequencies = dict(Counter(terms))
+        self._chunks[node_id] = (document_id, len(terms), frequencies)
+        self._by_document.setdefault(document_id, set()).add(node_id)
+        self._total_length += len(terms)
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[node_id] = frequency
+
+    def add_nodes(self, nodes: Iterable[Any]) -> None:
+        for node in nodes:
+            self.add(node.node_id, node.ref_doc_id or node.metadata.get("file_path", ""), node.get_content())
+
+    def remove_documents(self, document_ids: Iterable[str]) -> None:
+        for document_id in document_ids:
+            self.remove_ids(list(self._by_document.get(document_id, ())))
+
+    def remove_ids(self, node_ids: Iterable[str]) -> None:
+        for node_id in node_ids:
+            chunk = self._chunks.pop(node_id, None)
+            if chunk is None:
+                continue
+            document_id, length, frequencies = chunk
+            self._total_length -= length
+            document_nodes = self._by_document.get(document_id)
+            if document_nodes is not None:
+                document_nodes.discard(node_id)
+                if not document_nodes:
+                    del self._by_document[document_id]
+            for term in frequencies:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(node_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Devuelve [(node_id, puntuación BM25)] de los top_k chunks para la consulta."""
+        if not self._chunks or top_k <= 0:
+            return []
+        total = len(self._chunks)
+        average_length = self._total_length / total or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for node_id, frequency in postings.items():
+                length = self._chunks[node_id][1]
+                norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                scores[node_id] = scores.get(node_id, 0.0) + idf * frequency * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"chunks": {node_id: list(chunk) for node_id, chunk in self._chunks.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LexicalIndex":
+        index = cls()
+        for node_id, (document_id, length, frequencies) in data.get("chunks", {}).items():
+            index._chunks[node_id] = (document_id, length, frequencies)
+            index._by_document.setdefault(document_id, set()).add(node_id)
+            index._total_length += length
+            for term, frequency in frequencies.items():
+                index._postings.setdefault(term, {})[node_id] = frequency
+        return index
+
+    @classmethod
+    def from_collection(cls, chroma_collection, page_size: int = 1000) -> "LexicalIndex":
+        """Reconstruye el índice a partir de los chunks ya guardados en una colección de ChromaDB."""
+        index = cls()
+        offset = 0
+        while True:
+            page = chroma_collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            for node_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                metadata = metadata or {}
+                index.add(node_id, metadata.get("document_id") or metadata.get("file_path", ""), text or "")
+            offset += len(page["ids"])
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fusiona varios rankings de ids: puntuación = suma de 1 / (k + posición) en cada ranking."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for position, node_id in enumerate(ranking, start=1):
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + position)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
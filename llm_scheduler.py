@@ -0,0 +1,281 @@
+# llm_scheduler.py
+# Planificador de peticiones al LLM, delante de los clientes de providers.py. Por proveedor:
+#   - limita las peticiones simultáneas (Ollama atiende una a la vez; Gemini responde con errores
+#     de cuota si se le envía una ráfaga) y, opcionalmente, los tokens por minuto (ventana de 60 s),
+#   - encola lo que no cabe por prioridad: el chat interactivo antes que la generación de documentos,
+#     y esta antes que los resúmenes en segundo plano,
+#   - unifica los prompts idénticos en vuelo: si llega el mismo prompt mientras otro igual se está
+#     generando, espera esa misma llamada (y recibe sus fragmentos si es en streaming).
+# La profundidad de la cola y los tiempos de espera se exponen en /metrics y /llm_scheduler_stats.
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import record_cache_lookup, record_llm_queue_wait, record_stage, set_llm_queue_depth
+
+LLM_MAX_CONCURRENCY_GOOGLE = int(os.getenv("LLM_MAX_CONCURRENCY_GOOGLE", "8"))
+LLM_MAX_CONCURRENCY_OLLAMA = int(os.getenv("LLM_MAX_CONCURRENCY_OLLAMA", "1"))
+# Tokens (prompt + respuesta, estimados) por minuto; 0 = sin límite
+LLM_TOKENS_PER_MINUTE_GOOGLE = int(os.getenv("LLM_TOKENS_PER_MINUTE_GOOGLE", "0"))
+LLM_TOKENS_PER_MINUTE_OLLAMA = int(os.getenv("LLM_TOKENS_PER_MINUTE_OLLAMA", "0"))
+_DEFAULT_MAX_CONCURRENCY = 4  # Proveedores sin configuración propia
+
+PRIORITY_INTERACTIVE = 0  # Chat con el PM y con los desarrolladores
+PRIORITY_BULK = 1         # Generación de documentos, brief y resumen para Jira
+PRIORITY_BACKGROUND = 2   # Resúmenes incrementales de la conversación
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk", PRIORITY_BACKGROUND: "background"}
+
+_WINDOW_SECONDS = 60.0
+
+# Llamada al proveedor: recibe el callback de fragmentos (None = sin streaming) y devuelve
+# (texto, tokens consumidos entre prompt y respuesta)
+UpstreamCall = Callable[[Optional[Callable[[str], None]]], Awaitable[Tuple[str, int]]]
+
+
+class _ProviderQueue:
+    """Turnos de un proveedor: concurrencia máxima, presupuesto de tokens por minuto y cola por prioridad."""
+
+    def __init__(self, provider: str, max_concurrency: int, tokens_per_minute: int):
+        self.provider = provider
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.active = 0
+        self._heap: List[Tuple[int, int, int, asyncio.Future]] = []  # (prioridad, orden, tokens, turno)
+        self._sequence = itertools.count()
+        self._window: Deque[Tuple[float, int]] = deque()  # (instante, tokens) del último minuto
+        self._window_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, _, turn in self._heap if not turn.done())
+
+    async def acquire(self, priority: int, tokens: int,
+                      on_queued: Optional[Callable[[asyncio.Future], None]] = None) -> float:
+        """
+        Espera turno; devuelve los segundos de espera. Quien obtiene turno debe llamar a release.
+        Si tiene que esperar, on_queued recibe su turno en la cola (para poder subirle la prioridad).
+        """
+        started = time.monotonic()
+        if not self.queued and self._can_start(tokens):
+            self._start(tokens)
+        else:
+            turn = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (priority, next(self._sequence), tokens, turn))
+            if on_queued is not None:
+                on_queued(turn)
+            self._dispatch()  # Programa el reintento si lo que falta es presupuesto de tokens
+            try:
+                await turn
+            except asyncio.CancelledError:
+                if turn.done() and not turn.cancelled():
+                    self.release(0)  # Se le había dado turno justo al cancelarse: se devuelve
+                else:
+                    self._dispatch()
+                raise
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        record_llm_queue_wait(self.provider, _PRIORITY_NAMES.get(priority, str(priority)), waited)
+        return waited
+
+    def promote(self, turn: asyncio.Future, priority: int) -> None:
+        """Sube la prioridad de un turno que aún espera en la cola (conserva su orden de llegada)."""
+        for index, (queued_priority, sequence, tokens, queued_turn) in enumerate(self._heap):
+            if queued_turn is turn:
+                if priority < queued_priority and not turn.done():
+                    self._heap[index] = (priority, sequence, tokens, turn)
+                    heapq.heapify(self._heap)
+                return
+
+    def release(self, extra_tokens: int) -> None:
+        """Libera el turno y suma a la ventana los tokens de la respuesta (conocidos al terminar)."""
+        self.active -= 1
+        self.completed += 1
+        if extra_tokens > 0 and self.tokens_per_minute > 0:
+            self._window.append((time.monotonic(), extra_tokens))
+            self._window_tokens += extra_tokens
+        self._dispatch()
+
+    def window_tokens(self) -> int:
+        self._prune_window()
+        return self._window_tokens
+
+    def _prune_window(self) -> None:
+        limit = time.monotonic() - _WINDOW_SECONDS
+        while self._window and self._window[0][0] <= limit:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _within_budget(self, tokens: int) -> bool:
+        if self.tokens_per_minute <= 0:
+            return True
+        self._prune_window()
+        # Con la ventana vacía se admite aunque supere el presupuesto: si no, nunca se ejecutaría
+        return not self._window or self._window_tokens + tokens <= self.tokens_per_minute
+
+    def _can_start(self, tokens: int) -> bool:
+        return self.active < self.max_concurrency and self._within_budget(tokens)
+
+    def _start(self, tokens: int) -> None:
+        self.active += 1
+        if self.tokens_per_minute > 0:
+            self._window.append((time.monotonic(), tokens))
+            self._window_tokens += tokens
+
+    def _dispatch(self) -> None:
+        while self._heap:
+            _, _, tokens, turn = self._heap[0]
+            if turn.done():  # Cancelado mientras esperaba
+                heapq.heappop(self._heap)
+                continue
+            if self.active >= self.max_concurrency:
+                break
+            if not self._within_budget(tokens):
+                # Sin presupuesto: reintentar cuando caduque la entrada más antigua de la ventana
+                if self._timer is None:
+                    delay = max(0.0, self._window[0][0] + _WINDOW_SECONDS - time.monotonic())
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                break
+            heapq.heappop(self._heap)
+            self._start(tokens)
+            turn.set_result(None)
+        self._publish_depth()
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _publish_depth(self) -> None:
+        set_llm_queue_depth(self.provider, self.queued)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute,
+            "active": self.active,
+            "queued": self.queued,
+            "tokens_last_minute": self.window_tokens() if self.tokens_per_minute > 0 else None,
+            "completed": self.completed,
+            "avg_wait_seconds": round(self.total_wait / self.completed, 3) if self.completed else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3),
+        }
+
+
+class _InFlight:
+    """Una llamada al proveedor en curso y quienes esperan su resultado."""
+
+    def __init__(self, streaming: bool, priority: int):
+        self.streaming = streaming
+        self.priority = priority  # La mejor de quienes esperan la llamada
+        self.queue: Optional[_ProviderQueue] = None
+        self.turn: Optional[asyncio.Future] = None  # Turno en la cola del proveedor mientras espera
+        self.deltas: List[str] = []
+        self.listeners: List[Callable[[str], None]] = []
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def broadcast(self, delta: str) -> None:
+        self.deltas.append(delta)
+        for listener in list(self.listeners):
+            listener(delta)
+
+
+class LLMScheduler:
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        # Proveedor -> (concurrencia máxima, tokens por minuto)
+        self.limits = limits if limits is not None else {
+            "google": (LLM_MAX_CONCURRENCY_GOOGLE, LLM_TOKENS_PER_MINUTE_GOOGLE),
+            "ollama": (LLM_MAX_CONCURRENCY_OLLAMA, LLM_TOKENS_PER_MINUTE_OLLAMA),
+        }
+        self._queues: Dict[str, _ProviderQueue] = {}
+        self._in_flight: Dict[str, _InFlight] = {}
+        self.coalesced = 0
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            max_concurrency, tokens_per_minute = self.limits.get(provider, (_DEFAULT_MAX_CONCURRENCY, 0))
+            queue = self._queues[provider] = _ProviderQueue(provider, max_concurrency, tokens_per_minute)
+        return queue
+
+    async def run(self, provider: str, key: str, prompt_tokens: int, call: UpstreamCall,
+                  on_token: Optional[Callable[[str], None]] = None, priority: int = PRIORITY_BULK) -> str:
+        """
+        Ejecuta call cuando el proveedor tiene turno y devuelve su texto. Las peticiones con la misma
+        key (proveedor + modelo + prompt) que coinciden en el tiempo comparten una única llamada.
+        """
+        entry = self._in_flight.get(key)
+        record_cache_lookup("llm_in_flight", entry is not None)
+        if entry is None:
+            entry = self._in_flight[key] = _InFlight(streaming=on_token is not None, priority=priority)
+            entry.task = asyncio.ensure_future(self._execute(provider, prompt_tokens, call, entry))
+            entry.task.add_done_callback(lambda _: self._forget(key, entry))
+        else:
+            self.coalesced += 1
+            if priority < entry.priority:
+                # Una petición más urgente no debe esperar con la prioridad de la primera que llegó
+                entry.priority = priority
+                if entry.queue is not None and entry.turn is not None:
+                    entry.queue.promote(entry.turn, priority)
+        if on_token is not None and entry.streaming:
+            for delta in entry.deltas:  # Lo que ya se había generado antes de unirse
+                on_token(delta)
+            entry.listeners.append(on_token)
+
+        entry.waiters += 1
+        try:
+            text = await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            if on_token in entry.listeners:
+                entry.listeners.remove(on_token)
+            if entry.waiters == 0 and not entry.task.done():
+                entry.task.cancel()  # Nadie espera ya el resultado (p. ej. el cliente cerró la conexión)
+        if on_token is not None and not entry.streaming:
+            on_token(text)  # Se unió a una llamada sin streaming: recibe la respuesta de una vez
+        return text
+
+    async def _execute(self, provider: str, prompt_tokens: int, call: UpstreamCall, entry: _InFlight) -> str:
+        queue = entry.queue = self._queue(provider)
+
+        def on_queued(turn: asyncio.Future) -> None:
+            entry.turn = turn
+
+        record_stage("llm_queue", await queue.acquire(entry.priority, prompt_tokens, on_queued))
+        entry.turn = None
+        used_tokens = prompt_tokens
+        try:
+            text, used_tokens = await call(entry.broadcast if entry.streaming else None)
+            return text
+        finally:
+            queue.release(used_tokens - prompt_tokens)
+
+    def _forget(self, key: str, entry: _InFlight) -> None:
+        if self._in_flight.get(key) is entry:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {provider: queue.stats() for provider, queue in self._queues.items()},
+            "in_flight": len(self._in_flight),
+            "coalesced": self.coalesced,
+        }
+
+
+_llm_scheduler: Optional[LLMScheduler] = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    # Solo se usa desde el event loop: no necesita lock
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = LLMScheduler()
+    return _llm_scheduler
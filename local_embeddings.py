@@ -0,0 +1,104 @@
+# local_embeddings.py
+# Modelos de embeddings locales, para indexar sin red ni API key de Google:
+#   - OllamaEmbedding: modelos de embeddings servidos por Ollama (p. ej. nomic-embed-text); envía
+#     cada lote en una sola petición a /api/embed.
+#   - SentenceTransformerEmbedding: un modelo de sentence-transformers ejecutado en el propio
+#     proceso (CPU por defecto), que codifica cada lote de forma vectorizada. Dependencia opcional.
+# Ambos implementan BaseEmbedding de LlamaIndex, así que el resto del indexado no cambia.
+
+import asyncio
+import threading
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import Field, PrivateAttr
+
+
+class OllamaEmbedding(BaseEmbedding):
+    """Embeddings de un modelo de Ollama; un lote de textos = una petición."""
+
+    base_url: str = Field(default="http://localhost:11434")
+    request_timeout: float = Field(default=360.0)
+
+    _client: Any = PrivateAttr()
+    _async_client: Any = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        from ollama import AsyncClient, Client  # Dependencia de llama-index-llms-ollama
+        self._client = Client(host=self.base_url, timeout=self.request_timeout)
+        self._async_client = AsyncClient(host=self.base_url, timeout=self.request_timeout)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OllamaEmbedding"
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [list(embedding) for embedding in self._client.embed(model=self.model_name, input=texts).embeddings]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        response = await self._async_client.embed(model=self.model_name, input=texts)
+        return [list(embedding) for embedding in response.embeddings]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._aget_text_embedding(query)
+
+
+class SentenceTransformerEmbedding(BaseEmbedding):
+    """
+    Modelo de sentence-transformers en el propio proceso. La inferencia es CPU-bound: las versiones
+    asíncronas la ejecutan en un hilo para no bloquear el servidor, y un lock evita que varios lotes
+    compitan por los mismos núcleos (el modelo ya paraleliza cada lote internamente).
+    """
+
+    device: str = Field(default="cpu")
+
+    _model: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDING_BACKEND=sentence-transformers requiere el paquete sentence-transformers "
+                "(pip install sentence-transformers)."
+            ) from e
+        self._model = SentenceTransformer(self.model_name, device=self.device)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SentenceTransformerEmbedding"
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            embeddings = self._model.encode(
+                texts, batch_size=self.embed_batch_size, normalize_embeddings=True, convert_to_numpy=True,
+            )
+        return embeddings.tolist()
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self._get_text_embeddings, texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._aget_text_embedding(query)
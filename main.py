@@ -1,15 +1,61 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import Any, Awaitable, Callable, List, Dict, Optional
+import asyncio
+import json
 import os
+import time
+from contextlib import asynccontextmanager
+from starlette.routing import Match
 
 # Importar las funciones de nuestro app.py
-from app import index_project, generate_prd_and_user_stories, get_next_chat_question, get_developer_chat_response, summarize_developer_chat, generate_code_agent_brief
-
-app = FastAPI()
+from app import is_index_stale, generate_prd_and_user_stories, get_next_chat_question, get_developer_chat_response, summarize_developer_chat, generate_code_agent_brief, regenerate_document_section
+from providers import init_registry, shutdown_registry
+from completion_cache import close_completion_cache, get_completion_cache
+from index_state import collection_name_for, load_ingest_snapshot, load_projects, project_id_for
+from project_registry import ProjectRegistry
+from indexing_jobs import IndexingJobManager
+from session_store import create_session_store, new_session_data
+from document_sections import DOCUMENTS, build_document_sections
+from template_registry import get_template_registry
+from llm_scheduler import get_llm_scheduler
+from metrics import METRICS_ENABLED, METRICS_RESPONSE_HEADER, finish_request, record_stage_error, render_prometheus, start_request
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clientes de LLM, embeddings y ChromaDB compartidos durante toda la vida de la app
+    init_registry()
+    # Plantillas cargadas y validadas al arrancar: un placeholder erróneo falla aquí, no en una petición
+    get_template_registry().load_all()
+    yield
+    await indexing_jobs.shutdown()
+    close_completion_cache()
+    session_store.close()
+    await shutdown_registry()
+
+app = FastAPI(lifespan=lifespan)
+
+if METRICS_ENABLED:
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        """Abre el contexto de métricas de la petición (ver metrics.py) y mide su duración total."""
+        # La plantilla de la ruta (/index_jobs/{job_id}) y no la URL, para no crear una serie por id
+        endpoint = next((route.path for route in app.routes if route.matches(request.scope)[0] == Match.FULL), "other")
+        started = time.perf_counter()
+        request_timings, token = start_request(endpoint)
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            if METRICS_RESPONSE_HEADER:
+                # En las respuestas en streaming solo incluye las etapas anteriores al primer byte
+                response.headers["Server-Timing"] = request_timings.server_timing(time.perf_counter() - started)
+            return response
+        finally:
+            finish_request(request_timings, token, request.method, status, time.perf_counter() - started)
 
 # Montar el directorio de archivos estáticos (CSS, JS, etc. si los hubiera más adelante)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -17,15 +63,78 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Configurar las plantillas Jinja2 para servir HTML
 templates = Jinja2Templates(directory="templates")
 
-# Almacenamiento temporal para el índice y el historial de conversación (en una app real se usaría una DB)
-project_index = None # Este será el índice global que se cargará/creará
-conversation_data: Dict[str, List[Dict[str, str]]] = {}
-developer_chat_history_data: Dict[str, List[Dict[str, str]]] = {} # Nuevo: Historial del chat de desarrolladores
-generated_documents_cache: Dict[str, Dict[str, str]] = {} # Nuevo: Cache para PRD, HU, Plan Técnico
-gitingest_tree_cache: Dict[str, Dict] = {} # Nuevo: Cache para el árbol de archivos de gitingest
+# Índices de los proyectos usados más recientemente en este proceso (una colección de ChromaDB por proyecto)
+project_registry = ProjectRegistry()
+# Trabajos de indexación en segundo plano (ver indexing_jobs.py)
+indexing_jobs = IndexingJobManager(project_registry)
+
+# Sesiones de usuario: conversación, chat de desarrolladores y documentos generados (ver session_store.py)
+session_store = create_session_store()
+
+Emit = Callable[[Dict[str, Any]], None]
+
+
+def _ndjson_stream(run: Callable[[Emit], Awaitable[Dict[str, Any]]]) -> StreamingResponse:
+    """
+    Ejecuta run(emit) y transmite su progreso como NDJSON (una línea JSON por evento): los eventos
+    {"type": "token", ...} que emite la generación y, al final, {"type": "done", ...} con el mismo
+    contenido que devolvería el endpoint sin streaming.
+    """
+    async def events():
+        queue: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(run(queue.put_nowait))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (event := await queue.get()) is not None:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            try:
+                result = task.result()
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+            yield json.dumps({"type": "done", **result}, ensure_ascii=False) + "\n"
+        finally:
+            if not task.done(): # El cliente cerró la conexión: no seguir generando
+                task.cancel()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+def _token_emitter(emit: Optional[Emit]) -> Optional[Callable[[str], None]]:
+    if emit is None:
+        return None
+    return lambda delta: emit({"type": "token", "delta": delta})
+
+
+def _document_token_emitter(emit: Optional[Emit]) -> Optional[Callable[[str, str], None]]:
+    if emit is None:
+        return None
+    return lambda document, delta: emit({"type": "token", "document": document, "delta": delta})
+
+
+async def _get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(session_store.get, session_id)
+
+
+async def _update_session(session_id: str, mutate: Callable[[Dict[str, Any]], None]) -> Optional[Dict[str, Any]]:
+    """
+    Aplica mutate sobre la versión actual de la sesión (ver SessionStore.update). Las peticiones que
+    esperan al LLM escriben así solo su cambio, sin pisar lo que otra petición guardó mientras tanto.
+    """
+    return await asyncio.to_thread(session_store.update, session_id, mutate)
+
+
+async def _ensure_project_index(project_path: Optional[str] = None):
+    """
+    Devuelve el índice del proyecto de la sesión. Si este proceso aún no lo tiene cargado (p. ej.
+    tras un reinicio, en otro worker o porque se descartó del LRU), lo carga tal cual desde ChromaDB,
+    sin escanear ni re-indexar el proyecto. Devuelve None si no hay proyecto o aún no está indexado.
+    """
+    project_path = project_path or project_registry.default_project_path()
+    if not project_path:
+        return None
+    project = await project_registry.get(project_path)
+    return project.index if project is not None else None
 
-# Variable global para almacenar la ruta del proyecto indexado
-indexed_project_path: str = ""
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -35,52 +144,77 @@ async def read_root(request: Request):
 class ProjectPathInput(BaseModel):
     project_path: str
     force_index: bool = False
+    wait: bool = False # Si es True, responde al terminar la indexación en lugar de devolver el id del trabajo
 
 @app.post("/index_project")
 async def index_project_endpoint(input_data: ProjectPathInput):
-    global project_index, indexed_project_path, gitingest_tree_cache
-    project_path = input_data.project_path
-    force_index = input_data.force_index
-    session_id = "default_user_session" # Assuming a default session ID for now
-
-    try:
-        # Intentar cargar o crear el índice
-        project_index, gitingest_tree = await index_project(project_path, force_index)
-        indexed_project_path = project_path # Guardar la ruta del proyecto indexado
-        gitingest_tree_cache[session_id] = gitingest_tree # Store the tree
-        return JSONResponse(content={"message": "Proyecto indexado con éxito."})
-    except Exception as e:
-        return JSONResponse(content={"detail": f"Error durante la indexación: {str(e)}"}, status_code=500)
+    """
+    Lanza la indexación del proyecto en segundo plano y devuelve el id del trabajo; el progreso se
+    consulta en /index_jobs/{job_id}. Si ya hay un trabajo en curso para el proyecto, se devuelve ese.
+    """
+    job = indexing_jobs.start(input_data.project_path, input_data.force_index)
+    if not input_data.wait:
+        return JSONResponse(content={"message": "Indexación iniciada.", **job.to_dict()}, status_code=202)
+
+    await indexing_jobs.wait(job)
+    if job.status == "completed":
+        return JSONResponse(content={"message": "Proyecto indexado con éxito.", **job.to_dict()})
+    return JSONResponse(content={"detail": job.message, **job.to_dict()}, status_code=500)
+
+@app.get("/index_jobs/{job_id}")
+async def index_job_status_endpoint(job_id: str):
+    job = indexing_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(content={"status": "error", "message": "Trabajo de indexación no encontrado."}, status_code=404)
+    return job.to_dict()
+
+@app.post("/index_jobs/{job_id}/cancel")
+async def cancel_index_job_endpoint(job_id: str):
+    job = indexing_jobs.cancel(job_id)
+    if job is None:
+        return JSONResponse(content={"status": "error", "message": "Trabajo de indexación no encontrado."}, status_code=404)
+    return job.to_dict()
 
 class StartConversationInput(BaseModel):
     initial_description: Optional[str] = None
     template_type: str
     existing_prd_content: Optional[str] = None
     llm_provider: str = "google"
+    project_path: Optional[str] = None # Proyecto sobre el que trabaja la sesión (por defecto, el último indexado)
 
 @app.post("/start_conversation")
 async def start_conversation_endpoint(input_data: StartConversationInput):
-    global project_index, conversation_data, indexed_project_path
     initial_description = input_data.initial_description
     template_type = input_data.template_type
     existing_prd_content = input_data.existing_prd_content
     llm_provider = input_data.llm_provider
+    project_path = input_data.project_path or project_registry.default_project_path()
 
 
     # Asegurarse de que el proyecto esté indexado antes de iniciar la conversación
-    if project_index is None and indexed_project_path:
-        try:
-            # Intentar cargar el índice si la aplicación se reinició
-            project_index = await index_project(indexed_project_path)
-        except Exception as e:
-            return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
-    elif project_index is None:
-        return {"status": "error", "message": "Por favor, indexa un proyecto primero."}
-
-    session_id = "default_user_session"
-    conversation_data[session_id] = []
+    try:
+        # Intentar cargar el índice si la aplicación se reinició
+        session_project_index = await _ensure_project_index(project_path)
+    except Exception as e:
+        return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
+    if session_project_index is None:
+        if not project_path:
+            return {"status": "error", "message": "Por favor, indexa un proyecto primero."}
+        # Sin índice guardado: se indexa en segundo plano en lugar de bloquear esta petición
+        indexing_job = indexing_jobs.active_job(project_path) or indexing_jobs.start(project_path)
+        return {"status": "error",
+                "message": "El proyecto aún no está indexado; se está indexando en segundo plano. Inicia la conversación cuando termine.",
+                "indexing_job": indexing_job.to_dict()}
+
+    # Si el proyecto ha cambiado desde la última indexación (commits nuevos o cambios sin confirmar),
+    # actualizar en segundo plano solo lo que cambió; la sesión empieza con el índice actual.
+    indexing_job = indexing_jobs.active_job(project_path)
+    if indexing_job is None and await asyncio.to_thread(is_index_stale, project_path):
+        indexing_job = indexing_jobs.start(project_path)
+
+    session = new_session_data(project_path)
     # El primer mensaje ahora incluirá el tipo de template y el PRD existente
-    conversation_data[session_id].append({
+    session["conversation"].append({
         "role": "pm", 
         "content": initial_description,
         "template_type": template_type,
@@ -91,14 +225,20 @@ async def start_conversation_endpoint(input_data: StartConversationInput):
     # Generar la primera pregunta dinámicamente
     try:
         first_question = await get_next_chat_question(
-            conversation_data[session_id], 
-            project_index,
+            session["conversation"],
+            session_project_index,
             template_type,
             existing_prd_content,
             llm_provider # Pass llm_provider
         )
-        conversation_data[session_id].append({"role": "ia", "content": first_question})
-        return {"status": "success", "message": first_question, "session_id": session_id}
+        session["conversation"].append({"role": "ia", "content": first_question})
+        session_id = await asyncio.to_thread(session_store.create, session)
+        return {
+            "status": "success",
+            "message": first_question,
+            "session_id": session_id,
+            "indexing_job": indexing_job.to_dict() if indexing_job is not None else None,
+        }
     except Exception as e:
         return {"status": "error", "message": f"Error al generar la primera pregunta: {str(e)}"}
 
@@ -106,67 +246,81 @@ class ChatMessageInput(BaseModel):
     session_id: str
     user_message: str
     llm_provider: str = "google" # Add llm_provider to ChatMessageInput
+    stream: bool = False # Si es True, la respuesta se transmite como NDJSON a medida que se genera
 
 @app.post("/send_message")
 async def send_message_endpoint(message_data: ChatMessageInput):
-    global project_index, conversation_data, indexed_project_path
     session_id = message_data.session_id
     user_message = message_data.user_message
     llm_provider = message_data.llm_provider # Get llm_provider
 
-    if session_id not in conversation_data:
+    session = await _get_session(session_id)
+    if session is None:
         return {"status": "error", "message": "Sesión no encontrada."}
 
     # Asegurarse de que el proyecto esté indexado
-    if project_index is None and indexed_project_path:
-        try:
-            project_index = await index_project(indexed_project_path)
-        except Exception as e:
-            return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
-    elif project_index is None:
+    try:
+        session_project_index = await _ensure_project_index(session.get("project_path"))
+    except Exception as e:
+        return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
+    if session_project_index is None:
         return {"status": "error", "message": "El proyecto no ha sido indexado aún."}
 
     # Añadir mensaje del usuario al historial
-    conversation_data[session_id].append({"role": "pm", "content": user_message})
-    current_conversation = conversation_data[session_id]
+    session = await _update_session(session_id, lambda current: current["conversation"].append({"role": "pm", "content": user_message}))
+    if session is None:
+        return {"status": "error", "message": "Sesión no encontrada."}
+    current_conversation = session["conversation"]
 
     # Generar la siguiente respuesta de la IA dinámicamente
-    try:
-        # Recuperar el template_type y existing_prd_content del primer mensaje en conversation_data
-        # Esto asume que el primer mensaje siempre contiene esta información
-        first_message = current_conversation[0]
-        template_type = first_message.get("template_type", "feature.md") # Valor por defecto
-        existing_prd_content = first_message.get("existing_prd_content") # Puede ser None
-        # llm_provider is passed directly from the client for send_message
-
-        ai_response = await get_next_chat_question(
-            current_conversation, 
-            project_index,
-            template_type,
-            existing_prd_content,
-            llm_provider # Pass llm_provider
-        )
-        conversation_data[session_id].append({"role": "ia", "content": ai_response})
-        return {"status": "success", "ai_response": ai_response}
-    except Exception as e:
-        return {"status": "error", "message": f"Error al generar la respuesta de la IA: {str(e)}"}
+    async def run(emit: Optional[Emit] = None):
+        try:
+            # Recuperar el template_type y existing_prd_content del primer mensaje de la conversación
+            # Esto asume que el primer mensaje siempre contiene esta información
+            first_message = current_conversation[0]
+            template_type = first_message.get("template_type", "feature.md") # Valor por defecto
+            existing_prd_content = first_message.get("existing_prd_content") # Puede ser None
+            # llm_provider is passed directly from the client for send_message
+
+            ai_response = await get_next_chat_question(
+                current_conversation,
+                session_project_index,
+                template_type,
+                existing_prd_content,
+                llm_provider, # Pass llm_provider
+                on_token=_token_emitter(emit),
+                conversation_id=f"{session_id}:pm"
+            )
+            await _update_session(session_id, lambda current: current["conversation"].append({"role": "ia", "content": ai_response}))
+            return {"status": "success", "ai_response": ai_response}
+        except Exception as e:
+            return {"status": "error", "message": f"Error al generar la respuesta de la IA: {str(e)}"}
+
+    if message_data.stream:
+        return _ndjson_stream(run)
+    return await run()
 
 class GenerateDocumentsInput(BaseModel):
     session_id: str
     template_type: str
     existing_prd_content: Optional[str] = None
     llm_provider: str = "google" # Add llm_provider to GenerateDocumentsInput
+    stream: bool = False # Si es True, los documentos se transmiten como NDJSON a medida que se generan
 
 @app.post("/generate_documents")
 async def generate_documents_endpoint(data: GenerateDocumentsInput):
-    global project_index, conversation_data, generated_documents_cache # Add generated_documents_cache
     session_id = data.session_id
     template_type = data.template_type
     existing_prd_content = data.existing_prd_content
     llm_provider = data.llm_provider # Get llm_provider
 
-    current_conversation = conversation_data.get(session_id)
-    if not current_conversation or not project_index:
+    session = await _get_session(session_id)
+    current_conversation = session["conversation"] if session else None
+    try:
+        session_project_index = await _ensure_project_index(session.get("project_path")) if session else None
+    except Exception as e:
+        return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
+    if not current_conversation or not session_project_index:
         return {"status": "error", "message": "Sesión no encontrada o proyecto no indexado."}
 
     # Debugging: Imprimir el contenido de conversation_history
@@ -178,80 +332,103 @@ async def generate_documents_endpoint(data: GenerateDocumentsInput):
 
 
     # Generar PRD e Historias de Usuario (usando la función de app.py)
-    try:
-        prd_content, user_stories_content, technical_plan_content = await generate_prd_and_user_stories(
-            current_conversation, 
-            project_index, 
-            template_type,
-            existing_prd_content,
-            llm_provider # Pass llm_provider
-        )
-        
-        # Store generated documents in cache for developer chat
-        generated_documents_cache[session_id] = {
-            "prd": prd_content,
-            "user_stories": user_stories_content,
-            "technical_plan": technical_plan_content
-        }
-        # Initialize developer chat history for this session
-        developer_chat_history_data[session_id] = []
+    async def run(emit: Optional[Emit] = None):
+        try:
+            prd_content, user_stories_content, technical_plan_content, timings = await generate_prd_and_user_stories(
+                current_conversation,
+                session_project_index,
+                template_type,
+                existing_prd_content,
+                llm_provider, # Pass llm_provider
+                on_token=_document_token_emitter(emit)
+            )
+            
+            # Store generated documents in the session for developer chat
+            documents = {
+                "prd": prd_content,
+                "user_stories": user_stories_content,
+                "technical_plan": technical_plan_content
+            }
+            # Se dividen por secciones una sola vez, para servirlas y regenerarlas por separado
+            document_sections = build_document_sections(documents)
+
+            def store(current: Dict[str, Any]) -> None:
+                current["documents"] = documents
+                current["document_sections"] = document_sections
+                # Initialize developer chat history for this session
+                current["developer_chat"] = []
+
+            await _update_session(session_id, store)
+
+            return {"status": "success", "prd": prd_content, "user_stories": user_stories_content, "technical_plan": technical_plan_content, "timings": timings}
+        except Exception as e:
+            print(f"DEBUG: Exception caught in generate_documents_endpoint: {type(e)} - {e}")
+            return {"status": "error", "message": f"Error al generar documentos: {str(e)}"}
 
-        return {"status": "success", "prd": prd_content, "user_stories": user_stories_content, "technical_plan": technical_plan_content}
-    except Exception as e:
-        print(f"DEBUG: Exception caught in generate_documents_endpoint: {type(e)} - {e}")
-        return {"status": "error", "message": f"Error al generar documentos: {str(e)}"}
+    if data.stream:
+        return _ndjson_stream(run)
+    return await run()
 
 class DeveloperChatMessageInput(BaseModel):
     session_id: str
     developer_message: str
     llm_provider: str = "google"
+    stream: bool = False
 
 @app.post("/developer_chat")
 async def developer_chat_endpoint(message_data: DeveloperChatMessageInput):
-    global project_index, developer_chat_history_data, generated_documents_cache, indexed_project_path
     session_id = message_data.session_id
     developer_message = message_data.developer_message
     llm_provider = message_data.llm_provider
 
-    if session_id not in developer_chat_history_data:
+    session = await _get_session(session_id)
+    if session is None or session.get("developer_chat") is None:
         return {"status": "error", "message": "Sesión de chat de desarrollador no encontrada. Por favor, genera los documentos primero."}
     
-    if session_id not in generated_documents_cache:
+    if not session.get("documents"):
         return {"status": "error", "message": "Documentos generados no encontrados para esta sesión. Por favor, genera los documentos primero."}
 
     # Ensure project is indexed
-    if project_index is None and indexed_project_path:
-        try:
-            project_index = await index_project(indexed_project_path)
-        except Exception as e:
-            return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
-    elif project_index is None:
+    try:
+        session_project_index = await _ensure_project_index(session.get("project_path"))
+    except Exception as e:
+        return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
+    if session_project_index is None:
         return {"status": "error", "message": "El proyecto no ha sido indexado aún."}
 
     # Add developer message to history
-    developer_chat_history_data[session_id].append({"role": "developer", "content": developer_message})
-    current_dev_chat = developer_chat_history_data[session_id]
+    session = await _update_session(session_id, lambda current: current["developer_chat"].append({"role": "developer", "content": developer_message}))
+    if session is None:
+        return {"status": "error", "message": "Sesión no encontrada."}
+    current_dev_chat = session["developer_chat"]
     
     # Get generated documents
-    documents = generated_documents_cache[session_id]
+    documents = session["documents"]
     prd_content = documents.get("prd", "")
     user_stories_content = documents.get("user_stories", "")
     technical_plan_content = documents.get("technical_plan", "")
 
-    try:
-        ai_response = await get_developer_chat_response(
-            current_dev_chat,
-            project_index,
-            prd_content,
-            user_stories_content,
-            technical_plan_content,
-            llm_provider
-        )
-        developer_chat_history_data[session_id].append({"role": "ia", "content": ai_response})
-        return {"status": "success", "ai_response": ai_response}
-    except Exception as e:
-        print(f"DEBUG: Error in developer_chat_endpoint: {type(e)} - {e}")
-        return {"status": "error", "message": f"Error al generar respuesta del chat de desarrollador: {str(e)}"}
+    async def run(emit: Optional[Emit] = None):
+        try:
+            ai_response = await get_developer_chat_response(
+                current_dev_chat,
+                session_project_index,
+                prd_content,
+                user_stories_content,
+                technical_plan_content,
+                llm_provider,
+                on_token=_token_emitter(emit),
+                conversation_id=f"{session_id}:developer"
+            )
+            await _update_session(session_id, lambda current: current["developer_chat"].append({"role": "ia", "content": ai_response}))
+            return {"status": "success", "ai_response": ai_response}
+        except Exception as e:
+            print(f"DEBUG: Error in developer_chat_endpoint: {type(e)} - {e}")
+            return {"status": "error", "message": f"Error al generar respuesta del chat de desarrollador: {str(e)}"}
+
+    if message_data.stream:
+        return _ndjson_stream(run)
+    return await run()
 
 class SummarizeDeveloperChatInput(BaseModel):
     session_id: str
@@ -259,11 +436,11 @@ class SummarizeDeveloperChatInput(BaseModel):
 
 @app.post("/summarize_developer_chat")
 async def summarize_developer_chat_endpoint(data: SummarizeDeveloperChatInput):
-    global developer_chat_history_data
     session_id = data.session_id
     llm_provider = data.llm_provider
 
-    developer_chat = developer_chat_history_data.get(session_id)
+    session = await _get_session(session_id)
+    developer_chat = session.get("developer_chat") if session else None
     if not developer_chat:
         return {"status": "error", "message": "No hay historial de chat de desarrollador para resumir."}
     
@@ -277,74 +454,194 @@ async def summarize_developer_chat_endpoint(data: SummarizeDeveloperChatInput):
 class GenerateCodeAgentBriefInput(BaseModel):
     session_id: str
     llm_provider: str = "google"
+    stream: bool = False
 
 @app.post("/generate_code_agent_brief")
 async def generate_code_agent_brief_endpoint(data: GenerateCodeAgentBriefInput):
-    global project_index, developer_chat_history_data, generated_documents_cache, indexed_project_path
     session_id = data.session_id
     llm_provider = data.llm_provider
 
-    developer_chat = developer_chat_history_data.get(session_id)
+    session = await _get_session(session_id)
+    developer_chat = session.get("developer_chat") if session else None
     if not developer_chat:
         return {"status": "error", "message": "No hay historial de chat de desarrollador para generar el brief."}
     
-    documents = generated_documents_cache.get(session_id)
+    documents = session.get("documents")
     if not documents:
         return {"status": "error", "message": "Documentos generados no encontrados para esta sesión."}
 
     # Ensure project is indexed
-    if project_index is None and indexed_project_path:
+    try:
+        session_project_index = await _ensure_project_index(session.get("project_path"))
+    except Exception as e:
+        return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
+    if session_project_index is None:
+        return {"status": "error", "message": "El proyecto no ha sido indexado aún."}
+
+
+    async def run(emit: Optional[Emit] = None):
         try:
-            project_index = await index_project(indexed_project_path)
+            brief = await generate_code_agent_brief(
+                developer_chat,
+                session_project_index,
+                documents.get("prd", ""),
+                documents.get("user_stories", ""),
+                documents.get("technical_plan", ""),
+                llm_provider,
+                on_token=_token_emitter(emit),
+                conversation_id=f"{session_id}:developer"
+            )
+            return {"status": "success", "brief": brief}
         except Exception as e:
-            return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
-    elif project_index is None:
-        return {"status": "error", "message": "El proyecto no ha sido indexado aún."}
+            print(f"DEBUG: Error in generate_code_agent_brief_endpoint: {type(e)} - {e}")
+            return {"status": "error", "message": f"Error al generar brief para el agente de código: {str(e)}"}
 
+    if data.stream:
+        return _ndjson_stream(run)
+    return await run()
+
+async def _document_sections(session_id: str, session: Dict[str, Any]) -> Dict[str, Any]:
+    """Árbol de secciones de la sesión; las sesiones anteriores a él lo construyen una vez y lo guardan."""
+    if not session.get("document_sections"):
+        session["document_sections"] = build_document_sections(session["documents"])
+        documents, document_sections = session["documents"], session["document_sections"]
+
+        def store(current: Dict[str, Any]) -> None:
+            if current.get("documents") == documents:  # Si cambiaron entretanto, su árbol ya es el correcto
+                current["document_sections"] = document_sections
+
+        await _update_session(session_id, store)
+    return session["document_sections"]
 
-    try:
-        brief = await generate_code_agent_brief(
-            developer_chat,
-            project_index,
-            documents.get("prd", ""),
-            documents.get("user_stories", ""),
-            documents.get("technical_plan", ""),
-            llm_provider
-        )
-        return {"status": "success", "brief": brief}
-    except Exception as e:
-        print(f"DEBUG: Error in generate_code_agent_brief_endpoint: {type(e)} - {e}")
-        return {"status": "error", "message": f"Error al generar brief para el agente de código: {str(e)}"}
 
 @app.get("/get_structured_documents")
 async def get_structured_documents_endpoint(session_id: str):
-    global generated_documents_cache
-    documents = generated_documents_cache.get(session_id)
+    session = await _get_session(session_id)
+    documents = session.get("documents") if session else None
 
     if not documents:
         return JSONResponse(content={"status": "error", "message": "Documentos no encontrados para la sesión."},
                             status_code=404)
 
-    # Simple splitting by lines for now. Can be enhanced later to parse markdown headings.
-    structured_prd = [line for line in documents.get("prd", "").splitlines() if line.strip()]
-    structured_user_stories = [line for line in documents.get("user_stories", "").splitlines() if line.strip()]
-    structured_technical_plan = [line for line in documents.get("technical_plan", "").splitlines() if line.strip()]
+    tree = await _document_sections(session_id, session)
+
+    def lines(name: str) -> List[str]:
+        return [line for section in tree["documents"][name] for line in section["content"].splitlines() if line.strip()]
 
     return {
         "status": "success",
-        "prd_lines": structured_prd,
-        "user_stories_lines": structured_user_stories,
-        "technical_plan_lines": structured_technical_plan
+        "sections": tree["documents"],
+        "prd_lines": lines("prd"),
+        "user_stories_lines": lines("user_stories"),
+        "technical_plan_lines": lines("technical_plan")
     }
 
+class RegenerateSectionInput(BaseModel):
+    session_id: str
+    document: str # "prd", "user_stories" o "technical_plan"
+    section_id: str # id de la sección en /get_structured_documents
+    instructions: Optional[str] = None # Qué cambiar en la sección
+    llm_provider: str = "google"
+    update_dependents: bool = True # Si la sección es del PRD, actualizar las secciones que dependen de ella
+
+@app.post("/regenerate_section")
+async def regenerate_section_endpoint(data: RegenerateSectionInput):
+    session = await _get_session(data.session_id)
+    if not session or not session.get("documents"):
+        return JSONResponse(content={"status": "error", "message": "Documentos no encontrados para la sesión."},
+                            status_code=404)
+    if data.document not in DOCUMENTS:
+        return JSONResponse(content={"status": "error", "message": f"Documento desconocido: {data.document}."},
+                            status_code=400)
+    tree = await _document_sections(data.session_id, session)
+    if not any(section["id"] == data.section_id for section in tree["documents"][data.document]):
+        return JSONResponse(content={"status": "error", "message": f"Sección no encontrada: {data.section_id}."},
+                            status_code=404)
+
+    try:
+        session_project_index = await _ensure_project_index(session.get("project_path"))
+    except Exception as e:
+        return {"status": "error", "message": f"Error al recargar el índice del proyecto: {str(e)}. Por favor, re-indexa el proyecto."}
+
+    try:
+        tree, documents, updated_sections, failed_sections, timings = await regenerate_document_section(
+            tree,
+            session["conversation"],
+            session_project_index,
+            data.document,
+            data.section_id,
+            data.instructions,
+            data.llm_provider,
+            data.update_dependents
+        )
+    except Exception as e:
+        record_stage_error("section")
+        return {"status": "error", "message": f"Error al regenerar la sección: {str(e)}"}
+
+    # Solo se guarda si nadie cambió los documentos mientras se regeneraba (si no, se perdería su cambio)
+    base_documents, conflict = session["documents"], False
+
+    def store(current: Dict[str, Any]) -> None:
+        nonlocal conflict
+        if current.get("documents") != base_documents:
+            conflict = True
+            return
+        current["documents"] = documents
+        current["document_sections"] = tree
+
+    if await _update_session(data.session_id, store) is None:
+        return JSONResponse(content={"status": "error", "message": "Sesión no encontrada."}, status_code=404)
+    if conflict:
+        return JSONResponse(content={"status": "error", "message": "Los documentos han cambiado mientras se regeneraba la sección. Vuelve a intentarlo."},
+                            status_code=409)
+    return {"status": "success", **documents, "updated_sections": updated_sections, "failed_sections": failed_sections,
+            "timings": timings}
+
 @app.get("/get_gitingest_tree")
 async def get_gitingest_tree_endpoint(session_id: str):
-    global gitingest_tree_cache
-    tree_data = gitingest_tree_cache.get(session_id)
+    session = await _get_session(session_id)
+    project_path = session.get("project_path") if session else None
+    # El árbol se guarda junto al índice del proyecto (index_state), no en cada sesión
+    snapshot = None
+    if project_path:
+        collection_name = collection_name_for(project_id_for(project_path))
+        snapshot = await asyncio.to_thread(load_ingest_snapshot, collection_name, project_path)
+    tree_data = snapshot[0] if snapshot else None
     if not tree_data:
         return JSONResponse(content={"status": "error", "message": "Árbol de gitingest no encontrado para la sesión."},
                             status_code=404)
     return JSONResponse(content={"status": "success", "tree": tree_data})
 
+@app.get("/projects")
+async def list_projects_endpoint():
+    """Proyectos indexados, indicando cuáles están cargados en memoria en este proceso."""
+    loaded = {project.project_id for project in project_registry.loaded_projects()}
+    known = await asyncio.to_thread(load_projects)
+    projects = [
+        {"project_id": project_id, **info, "loaded": project_id in loaded}
+        for project_id, info in sorted(known.items(), key=lambda item: item[1].get("indexed_at", 0), reverse=True)
+    ]
+    return {"status": "success", "projects": projects}
+
+@app.get("/completion_cache_stats")
+async def completion_cache_stats_endpoint():
+    cache = get_completion_cache()
+    if cache is None:
+        return {"status": "success", "enabled": False}
+    return {"status": "success", "enabled": True, **cache.stats()}
+
+@app.get("/llm_scheduler_stats")
+async def llm_scheduler_stats_endpoint():
+    """Peticiones activas y en cola por proveedor de LLM, esperas y prompts unificados en vuelo."""
+    return {"status": "success", **get_llm_scheduler().stats()}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Latencias por endpoint y etapa, tokens del LLM y aciertos de caché, en formato de Prometheus."""
+    if not METRICS_ENABLED:
+        return JSONResponse(content={"status": "error", "message": "Métricas desactivadas (METRICS_ENABLED=false)."},
+                            status_code=404)
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 # Para ejecutar esta aplicación, guarda este archivo como main.py y ejecuta:
 # uvicorn main:app --reload 
\ No newline at end of file
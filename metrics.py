@@ -0,0 +1,253 @@
+# metrics.py
+# Instrumentación de latencias y tokens. Cada etapa (escaneo, ingesta, chunking, embeddings,
+# recuperación, montaje del prompt, llamadas al LLM) se mide con span(etapa) y se acumula en
+# histogramas por endpoint y etapa; las llamadas al LLM registran además los tokens del prompt y de
+# la respuesta, y las cachés sus aciertos y fallos. Todo se expone en formato de texto de Prometheus
+# en /metrics y, opcionalmente, los tiempos de cada petición en su cabecera Server-Timing.
+# Con METRICS_ENABLED=false span() devuelve un contexto vacío y el resto de funciones no hacen nada.
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Añade a cada respuesta una cabecera Server-Timing con el tiempo de cada etapa de la petición
+METRICS_RESPONSE_HEADER = os.getenv("METRICS_RESPONSE_HEADER", "false").lower() in ("1", "true", "yes")
+
+# Límites (segundos) de los buckets: desde consultas cacheadas hasta generaciones largas del LLM
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Etiqueta de endpoint de lo que no se ejecuta dentro de una petición (p. ej. trabajos de indexación)
+BACKGROUND_ENDPOINT = "background"
+
+_PREFIX = "prd_assistant"
+
+
+class RequestTimings:
+    """Tiempos de las etapas de una petición, para la cabecera Server-Timing."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: List[Tuple[str, float]] = []
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        totals: Dict[str, float] = {}
+        for stage, seconds in self.stages:
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        if total is not None:
+            totals["total"] = total
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+_current_request: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("metrics_request", default=None)
+
+
+class _Histogram:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # etiquetas -> [cuentas por bucket..., suma, total]
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            label_text = _format_labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {int(count)}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {int(series[-1])}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {int(series[-1])}")
+        return lines
+
+
+class _Counter:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_format_labels(self.label_names, labels)}}} {int(value)}")
+        return lines
+
+
+class _Gauge:
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_format_labels(self.label_names, labels)}}} {value:g}")
+        return lines
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+# Las métricas se actualizan desde el event loop y desde hilos (consultas al índice, indexación)
+_lock = threading.Lock()
+_request_duration = _Histogram(f"{_PREFIX}_request_duration_seconds", "Duración de las peticiones HTTP por endpoint.",
+                               ("endpoint", "method", "status"), LATENCY_BUCKETS)
+_stage_duration = _Histogram(f"{_PREFIX}_stage_duration_seconds", "Duración de cada etapa por endpoint.",
+                             ("endpoint", "stage"), LATENCY_BUCKETS)
+_llm_tokens = _Counter(f"{_PREFIX}_llm_tokens_total", "Tokens de prompt y de respuesta de las llamadas al LLM.",
+                       ("endpoint", "model", "kind"))
+_cache_lookups = _Counter(f"{_PREFIX}_cache_lookups_total", "Consultas a las cachés, por resultado (hit o miss).",
+                          ("cache", "result"))
+_stage_errors = _Counter(f"{_PREFIX}_stage_errors_total", "Etapas que han fallado, por endpoint.",
+                         ("endpoint", "stage"))
+_llm_queue_wait = _Histogram(f"{_PREFIX}_llm_queue_wait_seconds", "Espera en la cola del planificador de LLM.",
+                             ("provider", "priority"), LATENCY_BUCKETS)
+_llm_queue_depth = _Gauge(f"{_PREFIX}_llm_queue_depth", "Peticiones al LLM en cola, por proveedor.", ("provider",))
+
+
+def _endpoint() -> str:
+    request = _current_request.get()
+    return request.endpoint if request is not None else BACKGROUND_ENDPOINT
+
+
+@contextmanager
+def _timed_span(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def _noop_span() -> Iterator[None]:
+    yield
+
+
+def span(stage: str):
+    """Mide el bloque como una etapa: `with span("retrieval"): ...` (también alrededor de un await)."""
+    if not METRICS_ENABLED:
+        return _noop_span()
+    return _timed_span(stage)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    if not METRICS_ENABLED:
+        return
+    request = _current_request.get()
+    endpoint = request.endpoint if request is not None else BACKGROUND_ENDPOINT
+    if request is not None:
+        request.stages.append((stage, seconds))
+    with _lock:
+        _stage_duration.observe((endpoint, stage), seconds)
+
+
+def record_stage_error(stage: str) -> None:
+    if not METRICS_ENABLED:
+        return
+    endpoint = _endpoint()
+    with _lock:
+        _stage_errors.inc((endpoint, stage))
+
+
+def record_llm_tokens(model: str, prompt_tokens: int, completion_tokens: int) -> None:
+    if not METRICS_ENABLED:
+        return
+    endpoint = _endpoint()
+    with _lock:
+        _llm_tokens.inc((endpoint, model, "prompt"), prompt_tokens)
+        _llm_tokens.inc((endpoint, model, "completion"), completion_tokens)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _cache_lookups.inc((cache, "hit" if hit else "miss"))
+
+
+def record_llm_queue_wait(provider: str, priority: str, seconds: float) -> None:
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _llm_queue_wait.observe((provider, priority), seconds)
+
+
+def set_llm_queue_depth(provider: str, depth: int) -> None:
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _llm_queue_depth.set((provider,), depth)
+
+
+def start_request(endpoint: str) -> Tuple[Optional[RequestTimings], Optional[contextvars.Token]]:
+    """Abre el contexto de métricas de una petición; las etapas que se midan dentro se le atribuyen."""
+    if not METRICS_ENABLED:
+        return None, None
+    request = RequestTimings(endpoint)
+    return request, _current_request.set(request)
+
+
+def finish_request(request: Optional[RequestTimings], token: Optional[contextvars.Token],
+                   method: str, status: int, seconds: float) -> None:
+    if request is None:
+        return
+    _current_request.reset(token)
+    with _lock:
+        _request_duration.observe((request.endpoint, method, str(status)), seconds)
+
+
+def usage_tokens(raw: Any) -> Optional[Tuple[int, int]]:
+    """
+    (tokens del prompt, tokens de la respuesta) que informa el proveedor en la respuesta cruda del
+    LLM (usage_metadata de Gemini; prompt_eval_count/eval_count de Ollama), o None si no los informa.
+    """
+    def field(source: Any, name: str) -> Any:
+        return source.get(name) if isinstance(source, dict) else getattr(source, name, None)
+
+    if raw is None:
+        return None
+    usage = field(raw, "usage_metadata")
+    if usage is not None:
+        prompt_tokens = field(usage, "prompt_token_count")
+        completion_tokens = field(usage, "candidates_token_count")
+    else:
+        prompt_tokens = field(raw, "prompt_eval_count")
+        completion_tokens = field(raw, "eval_count")
+    if prompt_tokens is None and completion_tokens is None:
+        return None
+    return int(prompt_tokens or 0), int(completion_tokens or 0)
+
+
+def render_prometheus() -> str:
+    """Todas las métricas en el formato de texto de exposición de Prometheus."""
+    with _lock:
+        lines: List[str] = []
+        for metric in (_request_duration, _stage_duration, _stage_errors, _llm_tokens, _cache_lookups, _llm_queue_wait, _llm_queue_depth):
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,205 @@
+# project_files.py
+# Recorrido de los archivos del proyecto local: aplica las mismas reglas de exclusión
+# que gitingest (patrones por defecto + .gitignore/.gitingestignore) para que el índice
+# contenga exactamente los archivos que gitingest habría procesado.
+# También es la etapa de ingesta nativa: escanea y lee los archivos en paralelo (pool de hilos)
+# y por lotes, y construye el árbol de archivos sin pasar por gitingest.
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from gitingest.utils.ignore_patterns import DEFAULT_IGNORE_PATTERNS, load_ignore_patterns
+from pathspec import PathSpec
+
+# Mismo límite por defecto que gitingest.ingest_async
+MAX_FILE_SIZE = int(os.getenv("INGEST_MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+# "native": árbol de archivos construido a partir del escaneo; "gitingest": se ejecuta gitingest para obtenerlo
+INGEST_BACKEND = os.getenv("INGEST_BACKEND", "native")
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+INGEST_BATCH_FILES = int(os.getenv("INGEST_BATCH_FILES", "200"))
+_BINARY_SNIFF_BYTES = 1024
+
+
+def _load_ignore_spec(root: Path) -> PathSpec:
+    patterns: Set[str] = set(DEFAULT_IGNORE_PATTERNS)
+    patterns.update(load_ignore_patterns(root, ".gitignore"))
+    patterns.update(load_ignore_patterns(root, ".gitingestignore"))
+    return PathSpec.from_lines("gitwildmatch", patterns)
+
+
+def _is_binary(path: Path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return b"\0" in f.read(_BINARY_SNIFF_BYTES)
+    except OSError:
+        return True
+
+
+def iter_project_files(project_path: str, max_file_size: int = MAX_FILE_SIZE,
+                       check_binary: bool = True) -> Iterator[Path]:
+    """
+    Recorre project_path y devuelve las rutas (absolutas) de los archivos de texto indexables,
+    omitiendo directorios ignorados sin descender en ellos. Con check_binary=False no se abren
+    los archivos para descartar binarios (lo hace quien los procese).
+    """
+    root = Path(project_path).resolve()
+    spec = _load_ignore_spec(root)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        current = Path(dirpath)
+        rel_dir = current.relative_to(root)
+        # Podar directorios ignorados in-place para no recorrerlos
+        dirnames[:] = sorted(
+            d for d in dirnames
+            if not spec.match_file(f"{(rel_dir / d).as_posix()}/")
+        )
+        for filename in sorted(filenames):
+            file_path = current / filename
+            if spec.match_file((rel_dir / filename).as_posix()):
+                continue
+            if not _is_small_file(file_path, max_file_size):
+                continue
+            if check_binary and _is_binary(file_path):
+                continue
+            yield file_path
+
+
+def _is_small_file(file_path: Path, max_file_size: int) -> bool:
+    try:
+        return file_path.is_file() and file_path.stat().st_size <= max_file_size
+    except OSError:
+        return False
+
+
+def _is_ignored(spec: PathSpec, rel_path: str) -> bool:
+    """Equivalente a la poda de iter_project_files para una sola ruta: el archivo o alguno de sus directorios."""
+    parts = rel_path.split("/")
+    for depth in range(1, len(parts)):
+        if spec.match_file("/".join(parts[:depth]) + "/"):
+            return True
+    return spec.match_file(rel_path)
+
+
+def relative_path(project_path: str, file_path: Path) -> str:
+    """Ruta relativa (formato POSIX) usada como identificador estable de un archivo en el índice."""
+    return file_path.resolve().relative_to(Path(project_path).resolve()).as_posix()
+
+
+def hash_file(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_text_file(file_path: Path) -> Optional[str]:
+    """Lee un archivo como texto UTF-8 (reemplazando bytes inválidos). Devuelve None si no se puede leer."""
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError as e:
+        print(f"Error leyendo el archivo '{file_path}': {e}")
+        return None
+
+
+def _scan_file(file_path: Path, previous: Optional[Dict]) -> Optional[Dict]:
+    try:
+        stat = file_path.stat()
+    except OSError:
+        return None
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if previous and previous.get("size") == entry["size"] and previous.get("mtime") == entry["mtime"]:
+        entry["sha256"] = previous["sha256"]
+        return entry
+    if _is_binary(file_path):
+        return None
+    try:
+        entry["sha256"] = hash_file(file_path)
+    except OSError:
+        return None
+    return entry
+
+
+def scan_project(project_path: str, previous_files: Optional[Dict[str, Dict]] = None,
+                 max_workers: int = INGEST_MAX_WORKERS) -> Dict[str, Dict]:
+    """
+    Construye el manifiesto actual del proyecto: {ruta_relativa: {size, mtime, sha256}}.
+    Si un archivo conserva tamaño y mtime respecto a previous_files se reutiliza su hash
+    sin volver a leerlo, de modo que un escaneo sin cambios solo cuesta un stat() por archivo.
+    Los archivos nuevos o modificados se comprueban y se hashean en paralelo.
+    """
+    previous_files = previous_files or {}
+    paths = [(relative_path(project_path, file_path), file_path)
+             for file_path in iter_project_files(project_path, check_binary=False)]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="scan") as executor:
+        entries = executor.map(lambda item: _scan_file(item[1], previous_files.get(item[0])), paths)
+        return {rel: entry for (rel, _), entry in zip(paths, entries) if entry is not None}
+
+
+def scan_paths(project_path: str, previous_files: Dict[str, Dict], rel_paths: Iterable[str],
+               max_workers: int = INGEST_MAX_WORKERS, max_file_size: int = MAX_FILE_SIZE) -> Dict[str, Dict]:
+    """
+    Como scan_project, pero revisando solo rel_paths (p. ej. las rutas que git da por cambiadas):
+    el resto de entradas de previous_files se conservan tal cual. Las rutas que ya no existen o
+    que ya no son indexables salen del manifiesto.
+    """
+    root = Path(project_path).resolve()
+    spec = _load_ignore_spec(root)
+    files = dict(previous_files)
+    candidates = []
+    for rel in set(rel_paths):
+        files.pop(rel, None)
+        if not _is_ignored(spec, rel) and _is_small_file(root / rel, max_file_size):
+            candidates.append(rel)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="scan") as executor:
+        entries = executor.map(lambda rel: _scan_file(root / rel, previous_files.get(rel)), candidates)
+        files.update((rel, entry) for rel, entry in zip(candidates, entries) if entry is not None)
+    return files
+
+
+def read_files(project_path: str, rel_paths: Sequence[str], executor: ThreadPoolExecutor) -> List[Tuple[str, Optional[str]]]:
+    """Lee en paralelo un lote de archivos del proyecto; devuelve [(ruta_relativa, texto o None)]."""
+    root = Path(project_path)
+    return list(zip(rel_paths, executor.map(lambda rel: read_text_file(root / rel), rel_paths)))
+
+
+def iter_file_batches(rel_paths: Sequence[str], batch_size: int = INGEST_BATCH_FILES) -> Iterator[List[str]]:
+    """Divide las rutas en lotes: solo un lote (o dos, con lectura anticipada) se tiene en memoria a la vez."""
+    batch_size = max(1, batch_size)
+    for start in range(0, len(rel_paths), batch_size):
+        yield list(rel_paths[start:start + batch_size])
+
+
+def build_file_tree(project_path: str, rel_paths: Sequence[str]) -> Dict[str, Any]:
+    """
+    Árbol de archivos del proyecto con el formato que pinta la interfaz:
+    {"name", "type": "dir"|"file", "path", "children"} con directorios antes que archivos.
+    """
+    root: Dict[str, Any] = {"name": Path(project_path).resolve().name, "type": "dir", "path": "", "children": []}
+    directories: Dict[str, Dict[str, Any]] = {"": root}
+    for rel in sorted(rel_paths):
+        parts = rel.split("/")
+        parent = root
+        for depth in range(1, len(parts)):
+            dir_path = "/".join(parts[:depth])
+            if dir_path not in directories:
+                directory = {"name": parts[depth - 1], "type": "dir", "path": dir_path, "children": []}
+                directories[dir_path] = directory
+                parent["children"].append(directory)
+            parent = directories[dir_path]
+        parent["children"].append({"name": parts[-1], "type": "file", "path": rel})
+    for directory in directories.values():
+        directory["children"].sort(key=lambda node: (node["type"] != "dir", node["name"]))
+    return root
+
+
+def summarize_files(project_path: str, files: Dict[str, Dict]) -> str:
+    """Resumen del proyecto equivalente al de gitingest, calculado a partir del manifiesto."""
+    total_bytes = sum(entry.get("size", 0) for entry in files.values())
+    return (f"Directory: {Path(project_path).resolve().name}\n"
+            f"Files analyzed: {len(files)}\n"
+            f"Estimated tokens: {total_bytes // 4}")
@@ -0,0 +1,117 @@
+# project_registry.py
+# Registro de proyectos indexados. Cada proyecto tiene un id estable (derivado de su ruta) y su
+# propia colección de ChromaDB; el registro mantiene cargados en memoria los N índices usados más
+# recientemente (LRU) para que varias sesiones trabajen sobre proyectos distintos a la vez sin
+# re-indexar al cambiar de uno a otro.
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from app import IndexProgressCallback, index_project, load_existing_index
+from index_state import collection_name_for, load_projects, project_id_for, record_project
+
+PROJECT_INDEX_CACHE_SIZE = int(os.getenv("PROJECT_INDEX_CACHE_SIZE", "4"))
+
+
+@dataclass
+class LoadedProject:
+    project_id: str
+    project_path: str
+    collection_name: str
+    index: Any
+    loaded_at: float
+
+
+class ProjectRegistry:
+    """
+    LRU de índices cargados por project_id. Las indexaciones y las cargas concurrentes del mismo
+    proyecto se unifican por separado: cargar un índice guardado no espera a una indexación en curso.
+    """
+
+    def __init__(self, max_loaded: int = PROJECT_INDEX_CACHE_SIZE):
+        self.max_loaded = max(1, max_loaded)
+        self._loaded: "OrderedDict[str, LoadedProject]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self.last_project_id: Optional[str] = None  # Último proyecto indexado en este proceso
+
+    def _lock_for(self, project_id: str, locks: Optional[Dict[str, asyncio.Lock]] = None) -> asyncio.Lock:
+        locks = self._locks if locks is None else locks
+        if project_id not in locks:
+            locks[project_id] = asyncio.Lock()
+        return locks[project_id]
+
+    async def index(self, project_path: str, force_index: bool = False,
+                    progress_callback: Optional[IndexProgressCallback] = None) -> LoadedProject:
+        """Indexa (o actualiza de forma incremental) el proyecto y lo deja cargado."""
+        project_id = project_id_for(project_path)
+        async with self._lock_for(project_id):
+            project = await self._index(project_id, project_path, force_index, progress_callback)
+            record_project(project_id, project_path, project.collection_name, time.time())
+        self.last_project_id = project_id
+        return project
+
+    async def get(self, project_path: str) -> Optional[LoadedProject]:
+        """
+        Devuelve el índice del proyecto, cargándolo tal cual desde ChromaDB si no está en memoria.
+        Nunca escanea ni indexa (eso lo hacen los trabajos de indexing_jobs.py): devuelve None si el
+        proyecto no tiene un índice completo guardado.
+        """
+        project_id = project_id_for(project_path)
+        project = self._touch(project_id)
+        if project is not None:
+            return project
+        async with self._lock_for(project_id, self._load_locks):
+            project = self._touch(project_id)  # Otra petición (o una indexación) pudo cargarlo mientras esperábamos
+            if project is not None:
+                return project
+            collection_name = collection_name_for(project_id)
+            loaded = await load_existing_index(project_path, collection_name)
+            if loaded is None:
+                return None
+            # Una indexación que terminó durante la carga deja un índice más reciente: se conserva ese
+            project = self._touch(project_id) or self._store(
+                LoadedProject(project_id, os.path.realpath(project_path), collection_name, loaded[0], time.time()))
+        return project
+
+    def default_project_path(self) -> Optional[str]:
+        """Proyecto por defecto para sesiones que no indican uno: el último indexado o usado."""
+        if self.last_project_id in self._loaded:
+            return self._loaded[self.last_project_id].project_path
+        known = load_projects()
+        if self.last_project_id in known:
+            return known[self.last_project_id]["project_path"]
+        # Tras un reinicio: el proyecto indexado más recientemente
+        latest = max(known.values(), key=lambda p: p.get("indexed_at", 0), default=None)
+        return latest["project_path"] if latest else None
+
+    def loaded_projects(self) -> List[LoadedProject]:
+        return list(reversed(self._loaded.values()))
+
+    def evict(self, project_id: str) -> None:
+        self._loaded.pop(project_id, None)
+
+    def _touch(self, project_id: str) -> Optional[LoadedProject]:
+        project = self._loaded.get(project_id)
+        if project is not None:
+            self._loaded.move_to_end(project_id)
+        return project
+
+    async def _index(self, project_id: str, project_path: str, force_index: bool,
+                     progress_callback: Optional[IndexProgressCallback] = None) -> LoadedProject:
+        collection_name = collection_name_for(project_id)
+        index, _ = await index_project(project_path, force_index, collection_name=collection_name,
+                                       progress_callback=progress_callback)
+        return self._store(LoadedProject(project_id, os.path.realpath(project_path), collection_name, index, time.time()))
+
+    def _store(self, project: LoadedProject) -> LoadedProject:
+        self._loaded[project.project_id] = project
+        self._loaded.move_to_end(project.project_id)
+        while len(self._loaded) > self.max_loaded:
+            evicted_id, evicted = self._loaded.popitem(last=False)
+            print(f"Descargando de memoria el índice del proyecto {evicted.project_path} ({evicted_id}).")
+        return project
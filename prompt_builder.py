@@ -0,0 +1,207 @@
+# prompt_builder.py
+# Ensamblado de prompts con presupuesto de tokens. El presupuesto total se reparte entre las
+# secciones del prompt (historial, PRD, historias, plan técnico, contexto del proyecto): las que
+# caben enteras se incluyen tal cual y el resto se recorta. Del historial se conservan literalmente
+# los últimos turnos; los anteriores se sustituyen por un resumen que se actualiza en segundo plano,
+# de modo que el tamaño del prompt por turno no crece con la longitud de la sesión.
+
+import asyncio
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from utils import LRUCache, estimate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "24000"))
+PROMPT_RECENT_TURNS = int(os.getenv("PROMPT_RECENT_TURNS", "6"))
+# Turnos antiguos sin resumir que se acumulan antes de lanzar una actualización del resumen
+PROMPT_SUMMARY_BATCH = int(os.getenv("PROMPT_SUMMARY_BATCH", "4"))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "800"))
+CONVERSATION_SUMMARY_CACHE_SIZE = int(os.getenv("CONVERSATION_SUMMARY_CACHE_SIZE", "1024"))
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+_TRUNCATION_MARKER = "[... contenido recortado para ajustarse al tamaño máximo del prompt ...]"
+
+Turn = Dict[str, str]
+# (resumen_anterior, turnos_nuevos_formateados, llm_provider) -> resumen actualizado
+SummarizeFn = Callable[[str, str, str], Awaitable[str]]
+
+
+def format_turns(turns: Iterable[Turn]) -> str:
+    return "\n".join(f"{turn['role'].upper()}: {turn['content']}" for turn in turns)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    """Recorta text a max_tokens (aprox.), conservando el principio o, con keep_tail, el final."""
+    max_chars = max(0, max_tokens) * 4
+    if len(text) <= max_chars:
+        return text
+    max_chars = max(0, max_chars - len(_TRUNCATION_MARKER) - 1)  # El aviso también cuenta
+    if keep_tail:
+        return f"{_TRUNCATION_MARKER}\n{text[len(text) - max_chars:]}"
+    return f"{text[:max_chars]}\n{_TRUNCATION_MARKER}"
+
+
+def allocate_budget(sizes: Dict[str, int], total_tokens: int) -> Dict[str, int]:
+    """
+    Reparte total_tokens entre secciones de tamaño `sizes`: las secciones más pequeñas que su parte
+    equitativa reciben lo que necesitan y el sobrante se redistribuye entre las demás.
+    """
+    allocation: Dict[str, int] = {}
+    remaining = max(0, total_tokens)
+    pending = sorted(sizes, key=sizes.get)
+    while pending:
+        share = remaining // len(pending)
+        smallest = pending[0]
+        if sizes[smallest] > share:
+            for name in pending:
+                allocation[name] = share
+            break
+        allocation[smallest] = sizes[smallest]
+        remaining -= sizes[smallest]
+        pending.pop(0)
+    return allocation
+
+
+@dataclass
+class ConversationContext:
+    """Historial preparado para un prompt: resumen de los turnos antiguos + turnos literales."""
+    summary: str = ""
+    older_turns: List[Turn] = field(default_factory=list)  # Antiguos que el resumen aún no cubre
+    recent_turns: List[Turn] = field(default_factory=list)
+
+    def render(self, max_tokens: Optional[int] = None) -> str:
+        """
+        Texto del historial. Si no cabe en max_tokens, se prioriza: los turnos recientes, después
+        el resumen y por último los turnos antiguos sin resumir más cercanos a los recientes.
+        """
+        recent = format_turns(self.recent_turns)
+        summary = f"RESUMEN DE LA CONVERSACIÓN ANTERIOR: {self.summary}" if self.summary else ""
+        if max_tokens is None:
+            return "\n".join(part for part in (summary, format_turns(self.older_turns), recent) if part)
+        remaining = max_tokens - estimate_tokens(recent)
+        if remaining <= 0:
+            return truncate_to_tokens(recent, max_tokens, keep_tail=True)
+        summary = truncate_to_tokens(summary, remaining)
+        remaining -= estimate_tokens(summary)
+        older: List[str] = []
+        for turn in reversed(self.older_turns):
+            line = format_turns([turn])
+            if estimate_tokens(line) + 1 > remaining:
+                break
+            older.insert(0, line)
+            remaining -= estimate_tokens(line) + 1
+        if len(older) < len(self.older_turns):
+            older.insert(0, _TRUNCATION_MARKER)
+        return "\n".join(part for part in (summary, *older, recent) if part)
+
+    def __str__(self) -> str:
+        return self.render()
+
+
+Section = Union[str, ConversationContext]
+
+
+def fit_sections(template: str, sections: Dict[str, Section], total_tokens: int = PROMPT_TOKEN_BUDGET,
+                 keep_tail: Iterable[str] = ()) -> Dict[str, str]:
+    """
+    Ajusta las secciones que se van a insertar en `template` para que el prompt completo no supere
+    total_tokens. Los historiales (ConversationContext) se recortan según sus prioridades y las
+    secciones de texto de keep_tail por el principio; el resto, por el final.
+    """
+    overhead = estimate_tokens(_PLACEHOLDER.sub("", template))
+    if overhead >= total_tokens:
+        print(f"Advertencia: la parte fija de la plantilla ({overhead} tokens) ya supera el presupuesto del prompt "
+              f"({total_tokens} tokens); las secciones se recortan por completo.")
+    sizes = {name: estimate_tokens(str(section)) for name, section in sections.items()}
+    allocation = allocate_budget(sizes, max(0, total_tokens - overhead))
+    keep_tail = set(keep_tail)
+    fitted: Dict[str, str] = {}
+    for name, section in sections.items():
+        if isinstance(section, ConversationContext):
+            fitted[name] = section.render(allocation[name]) if sizes[name] > allocation[name] else section.render()
+        else:
+            fitted[name] = truncate_to_tokens(section, allocation[name], keep_tail=name in keep_tail)
+    return fitted
+
+
+def _turns_hash(turns: List[Turn]) -> str:
+    digest = hashlib.sha1()
+    for turn in turns:
+        digest.update(f"{turn.get('role')}\0{turn.get('content')}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ConversationSummarizer:
+    """
+    Mantiene, por conversación, un resumen de los turnos antiguos que se actualiza de forma
+    incremental (resumen anterior + turnos nuevos) en tareas en segundo plano, sin bloquear el turno.
+    Cada conversación se identifica por un id propio (p. ej. el de la sesión); el resumen solo se usa
+    si los turnos que cubre siguen siendo un prefijo del historial actual.
+    """
+
+    def __init__(self, summarize_fn: SummarizeFn, cache_size: int = CONVERSATION_SUMMARY_CACHE_SIZE):
+        self._summarize_fn = summarize_fn
+        self._summaries = LRUCache(cache_size)  # clave -> (turnos_cubiertos, hash_del_prefijo, resumen)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def current(self, conversation_id: str, turns: List[Turn]) -> Tuple[str, int]:
+        """Devuelve (resumen, número de turnos iniciales que cubre) para este historial."""
+        if not turns:
+            return "", 0
+        state = self._summaries.get(conversation_id)
+        if state is not None:
+            covered, prefix_hash, summary = state
+            if covered <= len(turns) and _turns_hash(turns[:covered]) == prefix_hash:
+                return summary, covered
+        return "", 0
+
+    def schedule_update(self, conversation_id: str, turns: List[Turn], upto: int, llm_provider: str) -> None:
+        """Lanza en segundo plano la actualización del resumen hasta el turno `upto` (exclusivo)."""
+        key = conversation_id
+        if key in self._tasks:
+            return
+        summary, covered = self.current(key, turns)
+        if upto <= covered:
+            return
+        task = asyncio.create_task(self._update(key, list(turns[:upto]), summary, covered, llm_provider))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    async def wait(self) -> None:
+        """Espera a que terminen las actualizaciones en curso."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _update(self, key: str, turns: List[Turn], summary: str, covered: int, llm_provider: str) -> None:
+        try:
+            new_summary = (await self._summarize_fn(summary, format_turns(turns[covered:]), llm_provider)).strip()
+        except Exception as e:
+            print(f"No se pudo actualizar el resumen de la conversación: {e}")
+            return
+        if new_summary:
+            new_summary = truncate_to_tokens(new_summary, CONVERSATION_SUMMARY_TOKENS)
+            self._summaries.put(key, (len(turns), _turns_hash(turns), new_summary))
+
+
+def build_conversation_context(turns: List[Turn], summarizer: Optional[ConversationSummarizer],
+                               llm_provider: str, conversation_id: Optional[str] = None,
+                               recent_turns: int = PROMPT_RECENT_TURNS) -> ConversationContext:
+    """
+    Historial para el prompt: el resumen de los turnos antiguos, los turnos antiguos que aún no
+    cubre el resumen y los últimos recent_turns turnos literales. Si se han acumulado suficientes
+    turnos sin resumir, programa la actualización del resumen para los siguientes turnos.
+    Sin conversation_id no se resume: los turnos antiguos solo se recortan al presupuesto.
+    """
+    if len(turns) <= recent_turns:
+        return ConversationContext(recent_turns=list(turns))
+    older_count = len(turns) - recent_turns
+    if summarizer is None or conversation_id is None:
+        return ConversationContext(older_turns=list(turns[:older_count]), recent_turns=list(turns[older_count:]))
+    summary, covered = summarizer.current(conversation_id, turns)
+    covered = min(covered, older_count)
+    if older_count - covered >= PROMPT_SUMMARY_BATCH:
+        summarizer.schedule_update(conversation_id, turns, older_count, llm_provider)
+    return ConversationContext(summary, list(turns[covered:older_count]), list(turns[older_count:]))
@@ -0,0 +1,184 @@
+# providers.py
+# Registro de clientes de larga duración (LLMs, modelo de embeddings y cliente de ChromaDB).
+# Se crea al arrancar la app (lifespan de FastAPI) y se reutiliza en todas las peticiones, en lugar
+# de construir un cliente nuevo (y pagar su inicialización y conexiones) en cada llamada.
+# El modelo de embeddings se elige con EMBEDDING_BACKEND: "google" (Gemini), "ollama" o
+# "sentence-transformers" (locales, sin red ni API key; ver local_embeddings.py).
+
+import inspect
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import chromadb
+from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+from llama_index.llms.google_genai import GoogleGenAI
+from llama_index.llms.ollama import Ollama
+
+from embedding_pipeline import EMBEDDING_BATCH_SIZE
+from index_state import CHROMA_DB_PATH
+from local_embeddings import OllamaEmbedding, SentenceTransformerEmbedding
+
+GOOGLE_LLM_MODEL = os.getenv("GOOGLE_LLM_MODEL", "models/gemini-2.5-flash")
+GOOGLE_MAX_OUTPUT_TOKENS = int(os.getenv("GOOGLE_MAX_OUTPUT_TOKENS", "8000"))
+GOOGLE_REQUEST_TIMEOUT = float(os.getenv("GOOGLE_REQUEST_TIMEOUT", "300"))
+GOOGLE_EMBEDDING_MODEL = os.getenv("GOOGLE_EMBEDDING_MODEL", "text-embedding-004")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3n:e2b")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_REQUEST_TIMEOUT = float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "360"))
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
+OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+SENTENCE_TRANSFORMERS_MODEL = os.getenv("SENTENCE_TRANSFORMERS_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SENTENCE_TRANSFORMERS_DEVICE = os.getenv("SENTENCE_TRANSFORMERS_DEVICE", "cpu")
+
+
+def embedding_model_id(embed_model) -> str:
+    """
+    Identifica el modelo de embeddings (clase + nombre del modelo). Se guarda en los metadatos de cada
+    colección: vectores de modelos distintos no son comparables aunque tengan la misma dimensión.
+    """
+    return f"{type(embed_model).__name__}:{getattr(embed_model, 'model_name', '')}"
+
+
+class ProviderRegistry:
+    """
+    Mantiene un cliente por (proveedor, modelo), creado la primera vez que se pide y reutilizado
+    después, junto con el modelo de embeddings y el cliente persistente de ChromaDB.
+    """
+
+    def __init__(self, chroma_path: str = CHROMA_DB_PATH):
+        self.chroma_path = chroma_path
+        self._llms: Dict[Tuple[str, str], Any] = {}
+        self._embed_model = None
+        self._chroma_client = None
+        self._lock = threading.Lock()
+
+    def get_llm(self, llm_provider: str, model: Optional[str] = None):
+        if llm_provider == "google":
+            model = model or GOOGLE_LLM_MODEL
+        elif llm_provider == "ollama":
+            model = model or OLLAMA_MODEL
+        else:
+            raise ValueError("Invalid LLM provider specified.")
+        key = (llm_provider, model)
+        with self._lock:
+            if key not in self._llms:
+                self._llms[key] = self._create_llm(llm_provider, model)
+            return self._llms[key]
+
+    def _create_llm(self, llm_provider: str, model: str):
+        if llm_provider == "google":
+            return GoogleGenAI(
+                model=model,
+                max_output_tokens=GOOGLE_MAX_OUTPUT_TOKENS,
+                http_options={"timeout": int(GOOGLE_REQUEST_TIMEOUT * 1000)},
+            )
+        return Ollama(model=model, base_url=OLLAMA_BASE_URL, request_timeout=OLLAMA_REQUEST_TIMEOUT)
+
+    def set_llm(self, llm_provider: str, llm, model: Optional[str] = None) -> None:
+        """Sustituye el cliente de un proveedor (p. ej. por un LLM falso en los benchmarks, ver benchmarks/fake_models.py)."""
+        model = model or (GOOGLE_LLM_MODEL if llm_provider == "google" else OLLAMA_MODEL)
+        with self._lock:
+            self._llms[(llm_provider, model)] = llm
+
+    def llm_provider_of(self, llm) -> str:
+        """Proveedor ("google", "ollama") con el que se creó o registró un cliente de LLM."""
+        with self._lock:
+            for (llm_provider, _), client in self._llms.items():
+                if client is llm:
+                    return llm_provider
+        return type(llm).__name__.lower()
+
+    def set_embed_model(self, embed_model) -> None:
+        """Sustituye el modelo de embeddings configurado con EMBEDDING_BACKEND."""
+        with self._lock:
+            self._embed_model = embed_model
+
+    def get_embed_model(self):
+        with self._lock:
+            if self._embed_model is None:
+                self._embed_model = self._create_embed_model(EMBEDDING_BACKEND)
+            return self._embed_model
+
+    def _create_embed_model(self, backend: str):
+        if backend == "google":
+            return GoogleGenAIEmbedding(model_name=GOOGLE_EMBEDDING_MODEL, embed_batch_size=EMBEDDING_BATCH_SIZE)
+        if backend == "ollama":
+            return OllamaEmbedding(
+                model_name=OLLAMA_EMBEDDING_MODEL,
+                base_url=OLLAMA_BASE_URL,
+                request_timeout=OLLAMA_REQUEST_TIMEOUT,
+                embed_batch_size=EMBEDDING_BATCH_SIZE,
+            )
+        if backend == "sentence-transformers":
+            return SentenceTransformerEmbedding(
+                model_name=SENTENCE_TRANSFORMERS_MODEL,
+                device=SENTENCE_TRANSFORMERS_DEVICE,
+                embed_batch_size=EMBEDDING_BATCH_SIZE,
+            )
+        raise ValueError(f"Backend de embeddings no válido: {backend}")
+
+    def get_chroma_client(self):
+        with self._lock:
+            if self._chroma_client is None:
+                self._chroma_client = chromadb.PersistentClient(path=self.chroma_path)
+            return self._chroma_client
+
+    async def aclose(self) -> None:
+        """Cierra las conexiones HTTP de los clientes creados."""
+        with self._lock:
+            clients = list(self._llms.values())
+            if self._embed_model is not None:
+                clients.append(self._embed_model)
+            self._llms.clear()
+            self._embed_model = None
+            self._chroma_client = None
+        for client in clients:
+            try:
+                await _close_client(client)
+            except Exception as e:
+                print(f"Error al cerrar el cliente {type(client).__name__}: {e}")
+
+
+async def _close_client(client) -> None:
+    # Los wrappers de LlamaIndex guardan el cliente HTTP real en atributos privados
+    for attribute in ("_client", "_async_client"):
+        inner = getattr(client, attribute, None)
+        if inner is None:
+            continue
+        http_client = getattr(inner, "_client", inner)
+        for method_name in ("aclose", "close"):
+            method = getattr(http_client, method_name, None)
+            if callable(method):
+                result = method()
+                if inspect.isawaitable(result):
+                    await result
+                break
+        aio = getattr(inner, "aio", None) # google-genai: cliente asíncrono separado
+        if aio is not None and callable(getattr(aio, "aclose", None)):
+            await aio.aclose()
+
+
+_registry: Optional[ProviderRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def init_registry() -> ProviderRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ProviderRegistry()
+        return _registry
+
+
+def get_registry() -> ProviderRegistry:
+    """Registro global; si la app no lo inicializó (p. ej. uso fuera de FastAPI), se crea al vuelo."""
+    return _registry or init_registry()
+
+
+async def shutdown_registry() -> None:
+    global _registry
+    with _registry_lock:
+        registry, _registry = _registry, None
+    if registry is not None:
+        await registry.aclose()
@@ -0,0 +1,204 @@
+# retrieval.py
+# Recuperación de contexto del proyecto para los prompts. Por defecto devuelve directamente los
+# top-k chunks del índice (con ruta y puntuación) en lugar de sintetizar una respuesta con un LLM,
+# ya que ese texto se pega después en otro prompt que sí llama al LLM.
+# La consulta se construye a partir de los últimos turnos de la conversación, y tanto los embeddings
+# de las consultas como sus resultados se cachean (LRU) por consulta normalizada + versión del índice.
+# La búsqueda es híbrida: los candidatos de la búsqueda vectorial y los del índice léxico BM25 (que
+# encuentra identificadores exactos) se fusionan por reciprocal rank fusion y, opcionalmente, se
+# reordenan con un cross-encoder local antes de quedarse con los top-k.
+
+import os
+import re
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from metrics import record_cache_lookup
+from utils import LRUCache, estimate_tokens
+
+# "retrieve": solo recuperación (sin LLM). "synthesize": query engine con síntesis de respuesta (comportamiento anterior).
+PROJECT_CONTEXT_MODE = os.getenv("PROJECT_CONTEXT_MODE", "retrieve")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "3000"))
+RETRIEVAL_QUERY_TURNS = int(os.getenv("RETRIEVAL_QUERY_TURNS", "3"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+RETRIEVAL_HYBRID = os.getenv("RETRIEVAL_HYBRID", "true").lower() in ("1", "true", "yes")
+# Candidatos que aporta cada búsqueda (vectorial y BM25) antes de fusionarlos y reordenarlos
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+# "cross-encoder" reordena los candidatos con un cross-encoder local (requiere sentence-transformers)
+RETRIEVAL_RERANKER = os.getenv("RETRIEVAL_RERANKER", "none")
+RETRIEVAL_RERANKER_MODEL = os.getenv("RETRIEVAL_RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+_MAX_QUERY_CHARS = 2000
+# Candidatos BM25 con una puntuación muy inferior a la del mejor (solo comparten términos comunes
+# como "def" o "return") no aportan a la fusión: se descartan
+_LEXICAL_MIN_SCORE_RATIO = 0.1
+_WHITESPACE = re.compile(r"\s+")
+
+
+_query_embedding_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+_retrieval_result_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+
+# Versión (huella del contenido indexado), modelo de embeddings e índice léxico de cada índice cargado
+_index_registry: "weakref.WeakKeyDictionary[Any, Tuple[str, Any, Optional[LexicalIndex]]]" = weakref.WeakKeyDictionary()
+
+_reranker = None
+_reranker_lock = threading.Lock()
+_reranker_unavailable = False
+
+
+def register_index(project_index, index_version: str, embed_model,
+                   lexical_index: Optional[LexicalIndex] = None) -> None:
+    """
+    Asocia al índice su versión (las entradas de caché de versiones anteriores dejan de usarse) y,
+    si se indica, el índice léxico de sus chunks para la búsqueda híbrida.
+    """
+    _index_registry[project_index] = (index_version, embed_model, lexical_index)
+
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+def build_retrieval_query(conversation_history: List[Dict[str, str]], purpose: str,
+                          max_turns: int = RETRIEVAL_QUERY_TURNS) -> str:
+    """
+    Construye la consulta al índice a partir de la conversación: en el chat de desarrolladores,
+    el último mensaje del desarrollador; en el chat con el PM, sus últimos max_turns mensajes.
+    """
+    developer_messages = [m["content"] for m in conversation_history if m.get("role") == "developer" and m.get("content")]
+    if developer_messages:
+        recent = developer_messages[-1:]
+    else:
+        recent = [m["content"] for m in conversation_history if m.get("role") == "pm" and m.get("content")][-max_turns:]
+    query = f"Información técnica del proyecto relevante para {purpose}."
+    if recent:
+        query += "\n" + "\n".join(recent)
+    return query[:_MAX_QUERY_CHARS]
+
+
+def _query_embedding(embed_model, query: str) -> List[float]:
+    key = (getattr(embed_model, "model_name", type(embed_model).__name__), normalize_query(query))
+    embedding = _query_embedding_cache.get(key)
+    record_cache_lookup("query_embedding", embedding is not None)
+    if embedding is None:
+        embedding = embed_model.get_query_embedding(query)
+        _query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+def _get_reranker():
+    """Cross-encoder local para reordenar candidatos, o None si no está activado o disponible."""
+    global _reranker, _reranker_unavailable
+    if RETRIEVAL_RERANKER != "cross-encoder" or _reranker_unavailable:
+        return None
+    with _reranker_lock:
+        if _reranker is None and not _reranker_unavailable:
+            try:
+                from llama_index.core.postprocessor import SentenceTransformerRerank
+                _reranker = SentenceTransformerRerank(model=RETRIEVAL_RERANKER_MODEL, top_n=max(1, RETRIEVAL_CANDIDATES))
+            except Exception as e:
+                # El reranker es opcional: sin él se usa directamente el orden de la fusión
+                print(f"No se pudo cargar el reranker '{RETRIEVAL_RERANKER_MODEL}' (¿falta sentence-transformers?): {e}")
+                _reranker_unavailable = True
+        return _reranker
+
+
+def _hybrid_retrieve(project_index, lexical_index: LexicalIndex, bundle: QueryBundle, top_k: int) -> List[NodeWithScore]:
+    """Fusiona por RRF los candidatos de la búsqueda vectorial y de BM25; la puntuación es la de la fusión."""
+    candidates = max(top_k, RETRIEVAL_CANDIDATES)
+    vector_results = project_index.as_retriever(similarity_top_k=candidates).retrieve(bundle)
+    lexical_results = lexical_index.search(bundle.query_str, candidates)
+    if lexical_results:
+        min_score = lexical_results[0][1] * _LEXICAL_MIN_SCORE_RATIO
+        lexical_results = [(node_id, score) for node_id, score in lexical_results if score >= min_score]
+    fused = reciprocal_rank_fusion(
+        [[result.node.node_id for result in vector_results], [node_id for node_id, _ in lexical_results]],
+        k=RETRIEVAL_RRF_K,
+    )[:candidates]
+
+    nodes = {result.node.node_id: result.node for result in vector_results}
+    missing = [node_id for node_id, _ in fused if node_id not in nodes]
+    if missing:
+        # Chunks que solo ha encontrado BM25: se leen de la colección
+        nodes.update((node.node_id, node) for node in project_index.vector_store.get_nodes(node_ids=missing))
+    return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in fused if node_id in nodes]
+
+
+def _rerank(query: str, results: List[NodeWithScore], top_k: int) -> List[NodeWithScore]:
+    reranker = _get_reranker()
+    if reranker is not None and len(results) > 1:
+        try:
+            results = reranker.postprocess_nodes(results, query_str=query)
+        except Exception as e:
+            print(f"Error al reordenar los chunks recuperados: {e}")
+    return results[:top_k]
+
+
+def retrieve_chunks(project_index, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[NodeWithScore]:
+    """
+    Recupera los top_k chunks más relevantes para la consulta. Para índices registrados con índice
+    léxico, la búsqueda es híbrida (vectorial + BM25 fusionadas y, si está activado, reordenadas);
+    si no, solo vectorial. En índices registrados las consultas repetidas se sirven desde caché.
+    """
+    registered = _index_registry.get(project_index)
+    if registered is None:
+        return project_index.as_retriever(similarity_top_k=top_k).retrieve(query)
+
+    index_version, embed_model, lexical_index = registered
+    normalized = normalize_query(query)
+    key = (index_version, normalized, top_k)
+    results = _retrieval_result_cache.get(key)
+    record_cache_lookup("retrieval", results is not None)
+    if results is None:
+        query = _WHITESPACE.sub(" ", query).strip()
+        bundle = QueryBundle(query_str=query, embedding=_query_embedding(embed_model, query))
+        if RETRIEVAL_HYBRID and lexical_index is not None:
+            results = _rerank(query, _hybrid_retrieve(project_index, lexical_index, bundle, top_k), top_k)
+        else:
+            results = project_index.as_retriever(similarity_top_k=top_k).retrieve(bundle)
+        _retrieval_result_cache.put(key, results)
+    return results
+
+
+def _chunk_header(result: NodeWithScore) -> str:
+    metadata = result.node.metadata
+    header = metadata.get("file_path", "archivo desconocido")
+    if metadata.get("start_line"):
+        header += f" (líneas {metadata['start_line']}-{metadata.get('end_line', '?')})"
+    if metadata.get("symbol"):
+        header += f" — {metadata['symbol']}"
+    if result.score is not None:
+        header += f" [score {result.score:.3f}]"
+    return f"--- {header} ---"
+
+
+def format_chunks(results: List[NodeWithScore], token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> str:
+    """
+    Formatea los chunks (de mayor a menor puntuación) sin superar token_budget. Los chunks que no
+    caben se omiten; si ni el primero cabe, se incluye truncado.
+    """
+    sections: List[str] = []
+    used_tokens = 0
+    for result in sorted(results, key=lambda r: r.score or 0.0, reverse=True):
+        section = f"{_chunk_header(result)}\n{result.node.get_content(metadata_mode=MetadataMode.NONE).strip()}"
+        section_tokens = estimate_tokens(section)
+        if used_tokens + section_tokens > token_budget:
+            if not sections:
+                sections.append(section[:token_budget * 4])
+                break
+            continue
+        sections.append(section)
+        used_tokens += section_tokens
+    return "\n\n".join(sections)
+
+
+def retrieve_project_context(project_index, query: str, top_k: int = RETRIEVAL_TOP_K,
+                             token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> str:
+    """Devuelve los chunks relevantes para la consulta formateados para pegarse en un prompt."""
+    return format_chunks(retrieve_chunks(project_index, query, top_k), token_budget)
@@ -0,0 +1,229 @@
+# session_store.py
+# Almacén de sesiones (conversación con el PM, chat de desarrolladores, documentos generados y
+# proyecto asociado). Sustituye a los diccionarios globales de main.py: cada sesión tiene un id
+# propio y el backend se elige con SESSION_STORE_BACKEND:
+#   - "memory": LRU en memoria acotado por número de sesiones, inactividad y bytes.
+#   - "sqlite": persistente y compartido entre varios workers de uvicorn.
+
+import json
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "86400"))  # segundos sin uso; 0 = sin caducidad
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./sessions.db")
+
+
+def new_session_data(project_path: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        # Ruta real (sin enlaces simbólicos), la misma que usan el registro de proyectos y el estado del índice
+        "project_path": os.path.realpath(project_path) if project_path else None,
+        "conversation": [],
+        "developer_chat": None,  # Se inicializa al generar los documentos
+        "documents": None,
+        "document_sections": None,  # Árbol de secciones de los documentos (ver document_sections.py)
+    }
+
+
+class SessionStore(ABC):
+    """
+    Interfaz común de los backends. Las sesiones se guardan serializadas como JSON: `get` siempre
+    devuelve una copia. `save` sustituye la sesión entera (la última escritura gana), así que los
+    cambios sobre una sesión existente se aplican con `update`, que relee y modifica la sesión de
+    forma atómica: dos peticiones concurrentes sobre la misma sesión no pierden sus cambios.
+    """
+
+    def create(self, data: Dict[str, Any]) -> str:
+        session_id = uuid.uuid4().hex
+        self.save(session_id, data)
+        return session_id
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, session_id: str, mutate: Callable[[Dict[str, Any]], None]) -> Optional[Dict[str, Any]]:
+        """Aplica mutate sobre la versión actual de la sesión y la guarda; devuelve la sesión resultante (None si no existe)."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """LRU en memoria: descarta las sesiones inactivas y, si hace falta, las usadas hace más tiempo."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_bytes: int = SESSION_MAX_BYTES):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # id -> (json, último uso)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get(session_id)
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        serialized = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._store(session_id, serialized)
+
+    def update(self, session_id: str, mutate: Callable[[Dict[str, Any]], None]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._get(session_id)
+            if data is None:
+                return None
+            mutate(data)
+            self._store(session_id, json.dumps(data, ensure_ascii=False))
+            return data
+
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        self._expire_idle()
+        stored = self._sessions.get(session_id)
+        if stored is None:
+            return None
+        self._sessions[session_id] = (stored[0], time.monotonic())
+        self._sessions.move_to_end(session_id)
+        return json.loads(stored[0])
+
+    def _store(self, session_id: str, serialized: str) -> None:
+        if session_id in self._sessions:
+            self._remove(session_id)
+        self._sessions[session_id] = (serialized, time.monotonic())
+        self._bytes += len(serialized)
+        self._expire_idle()
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _expire_idle(self) -> None:
+        if not self.idle_ttl:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        # El OrderedDict está ordenado por último uso: las inactivas están al principio
+        while self._sessions:
+            oldest_id, (_, last_used) = next(iter(self._sessions.items()))
+            if last_used >= cutoff:
+                break
+            self._remove(oldest_id)
+            self.evictions += 1
+
+    def _remove(self, session_id: str) -> None:
+        serialized, _ = self._sessions.pop(session_id)
+        self._bytes -= len(serialized)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones en un archivo SQLite (modo WAL), de modo que sobreviven a reinicios y las comparten
+    todos los workers. Cada operación abre su propia conexión, por lo que es segura entre hilos y procesos.
+    """
+
+    _CLEANUP_EVERY = 100
+
+    def __init__(self, path: str = SESSION_DB_PATH, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_sessions: int = SESSION_MAX_SESSIONS):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:  # commit/rollback de la transacción
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as connection:
+            row = connection.execute("SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            if self.idle_ttl and time.time() - row[1] > self.idle_ttl:
+                connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                return None
+            connection.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (time.time(), session_id))
+            return json.loads(row[0])
+
+    def save(self, session_id: str, data: Dict[str, Any]) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            self._writes += 1
+            if self._writes % self._CLEANUP_EVERY == 0:
+                self._cleanup(connection)
+
+    def update(self, session_id: str, mutate: Callable[[Dict[str, Any]], None]) -> Optional[Dict[str, Any]]:
+        with self._connect() as connection:
+            # Bloquea la escritura desde la lectura, también frente a otros workers
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT data, updated_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or (self.idle_ttl and time.time() - row[1] > self.idle_ttl):
+                return None
+            data = json.loads(row[0])
+            mutate(data)
+            connection.execute("UPDATE sessions SET data = ?, updated_at = ? WHERE id = ?",
+                               (json.dumps(data, ensure_ascii=False), time.time(), session_id))
+            return data
+
+    def delete(self, session_id: str) -> None:
+        with self._connect() as connection:
+            connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _cleanup(self, connection: sqlite3.Connection) -> None:
+        if self.idle_ttl:
+            connection.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.idle_ttl,))
+        connection.execute(
+            "DELETE FROM sessions WHERE id NOT IN (SELECT id FROM sessions ORDER BY updated_at DESC LIMIT ?)",
+            (self.max_sessions,),
+        )
+
+
+def create_session_store(backend: str = SESSION_STORE_BACKEND) -> SessionStore:
+    if backend == "memory":
+        return InMemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Backend de sesiones no válido: {backend}")
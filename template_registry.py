@@ -0,0 +1,162 @@
+# template_registry.py
+# Registro de plantillas: los prompts (templates/prompts/*.txt) y las plantillas de documentos
+# (templates/*.md) se cargan y se parsean una sola vez al arrancar, validando que cada prompt usa
+# exactamente los placeholders que le pasa su función en app.py. Después se sirven desde memoria;
+# solo se vuelven a leer si cambia el mtime del archivo (como mucho una comprobación cada
+# TEMPLATE_RELOAD_INTERVAL segundos por plantilla), para poder editarlas sin reiniciar.
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from llama_index.core.prompts import PromptTemplate
+
+TEMPLATES_DIR = os.getenv("TEMPLATES_DIR", "templates")
+# Segundos entre comprobaciones del mtime de cada plantilla; 0 = sin recarga en caliente
+TEMPLATE_RELOAD_INTERVAL = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "2"))
+
+# Prompt -> (archivo relativo a TEMPLATES_DIR, placeholders que le pasa app.py en .format)
+PROMPT_TEMPLATES: Dict[str, Tuple[str, Set[str]]] = {
+    "base_chat": ("prompts/base_chat_prompt.txt", {"conversation_context", "project_info"}),
+    "conversation_summary": ("prompts/conversation_summary_prompt.txt", {"previous_summary", "new_turns"}),
+    "prd": ("prompts/prd_prompt.txt", {"template_content", "conversation_context", "project_info"}),
+    "user_stories": ("prompts/user_stories_prompt.txt", {"prd_content_for_us", "conversation_context", "project_info"}),
+    "technical_plan": ("prompts/technical_plan_prompt.txt", {"prd_content_for_tp", "conversation_context", "project_info"}),
+    "developer_chat": ("prompts/developer_chat_prompt.txt", {
+        "developer_chat_context", "prd_content", "user_stories_content", "technical_plan_content", "project_info",
+    }),
+    "section": ("prompts/section_prompt.txt", {
+        "document_name", "instructions", "outline", "section_content", "source_context", "project_info",
+    }),
+    "jira_summary": ("prompts/jira_summary_prompt.txt", {"developer_chat_context"}),
+    "code_agent_brief": ("prompts/code_agent_brief_prompt.txt", {
+        "developer_chat_context", "prd_content", "user_stories_content", "technical_plan_content", "project_info",
+    }),
+}
+
+_DOCUMENT_SUFFIX = ".md"
+
+
+class TemplateError(ValueError):
+    """Plantilla inexistente o con placeholders que no corresponden a los que recibe."""
+
+
+@dataclass
+class _LoadedTemplate:
+    path: str
+    mtime_ns: int
+    content: str
+    prompt: Optional[PromptTemplate]
+    checked_at: float
+
+
+class TemplateRegistry:
+    """Plantillas de prompts y de documentos en memoria, con recarga por mtime."""
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR, reload_interval: float = TEMPLATE_RELOAD_INTERVAL):
+        self.templates_dir = templates_dir
+        self.reload_interval = reload_interval
+        self._prompts: Dict[str, _LoadedTemplate] = {}
+        self._documents: Dict[str, _LoadedTemplate] = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def load_all(self) -> None:
+        """Carga y valida todas las plantillas; lanza TemplateError si alguna falta o no es válida."""
+        errors: List[str] = []
+        for name in PROMPT_TEMPLATES:
+            try:
+                self._prompts[name] = self._load_prompt(name)
+            except (OSError, TemplateError) as e:
+                errors.append(str(e))
+        for filename in sorted(os.listdir(self.templates_dir)):
+            if filename.endswith(_DOCUMENT_SUFFIX):
+                self._documents[filename] = self._load_document(filename)
+        if errors:
+            raise TemplateError("Plantillas de prompts no válidas:\n" + "\n".join(errors))
+        print(f"Plantillas cargadas: {len(self._prompts)} prompts y {len(self._documents)} documentos.")
+
+    def prompt(self, name: str) -> PromptTemplate:
+        """PromptTemplate ya parseado del prompt `name` (ver PROMPT_TEMPLATES)."""
+        if name not in PROMPT_TEMPLATES:
+            raise TemplateError(f"Prompt desconocido: {name}")
+        with self._lock:
+            loaded = self._prompts.get(name)
+            if loaded is None:
+                loaded = self._prompts[name] = self._load_prompt(name)
+            elif self._modified(loaded):
+                try:
+                    loaded = self._prompts[name] = self._load_prompt(name)
+                    self.reloads += 1
+                    print(f"Plantilla '{loaded.path}' recargada.")
+                except (OSError, TemplateError) as e:
+                    # Una edición a medias no debe romper las peticiones: se sigue usando la versión anterior
+                    print(f"No se pudo recargar la plantilla '{loaded.path}'; se mantiene la anterior: {e}")
+            return loaded.prompt
+
+    def document(self, template_type: str) -> str:
+        """Contenido de la plantilla de documento templates/<template_type> (p. ej. "prd.md"), o "" si no existe."""
+        if os.path.basename(template_type) != template_type or not template_type.endswith(_DOCUMENT_SUFFIX):
+            print(f"Error: plantilla de documento no válida '{template_type}'.")
+            return ""
+        with self._lock:
+            loaded = self._documents.get(template_type)
+            try:
+                if loaded is None or self._modified(loaded):
+                    loaded = self._documents[template_type] = self._load_document(template_type)
+            except OSError as e:
+                print(f"Error: no se pudo leer la plantilla '{template_type}': {e}")
+                if loaded is None:
+                    return ""
+            return loaded.content
+
+    def _modified(self, loaded: _LoadedTemplate) -> bool:
+        if self.reload_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now - loaded.checked_at < self.reload_interval:
+            return False
+        loaded.checked_at = now
+        try:
+            return os.stat(loaded.path).st_mtime_ns != loaded.mtime_ns
+        except OSError:
+            return False  # Se conserva la versión cargada si el archivo desaparece
+
+    def _read(self, path: str):
+        mtime_ns = os.stat(path).st_mtime_ns
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read(), mtime_ns
+
+    def _load_prompt(self, name: str) -> _LoadedTemplate:
+        filename, expected = PROMPT_TEMPLATES[name]
+        path = os.path.join(self.templates_dir, filename)
+        content, mtime_ns = self._read(path)
+        prompt = PromptTemplate(content)
+        found: FrozenSet[str] = frozenset(prompt.template_vars)
+        unknown = found - set(expected)
+        if unknown:
+            # Al formatear faltarían estos valores: fallaría a mitad de una petición
+            raise TemplateError(f"'{path}' usa placeholders que no se le pasan: {', '.join(sorted(unknown))}")
+        missing = set(expected) - found
+        if missing:
+            print(f"Aviso: '{path}' no usa los placeholders {', '.join(sorted(missing))}; ese contexto no llegará al LLM.")
+        return _LoadedTemplate(path, mtime_ns, content, prompt, time.monotonic())
+
+    def _load_document(self, filename: str) -> _LoadedTemplate:
+        path = os.path.join(self.templates_dir, filename)
+        content, mtime_ns = self._read(path)
+        return _LoadedTemplate(path, mtime_ns, content, None, time.monotonic())
+
+
+_template_registry: Optional[TemplateRegistry] = None
+_template_registry_lock = threading.Lock()
+
+
+def get_template_registry() -> TemplateRegistry:
+    global _template_registry
+    with _template_registry_lock:
+        if _template_registry is None:
+            _template_registry = TemplateRegistry()
+        return _template_registry
@@ -0,0 +1,8 @@
+# Los módulos de la aplicación están en la raíz del repositorio (no es un paquete), y los modelos
+# falsos de los benchmarks en benchmarks/
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
@@ -0,0 +1,73 @@
+from document_sections import find_section, normalize_section, parse_sections, render_sections, replace_section, replace_sections
+
+PRD = """Texto previo.
+
+# PRD
+Introducción.
+
+## Requisitos
+Viejos requisitos.
+
+### Seguridad
+Cifrado.
+
+```python
+# no es un encabezado
+```
+
+## Alcance
+Todo.
+
+## Alcance
+Repetido.
+"""
+
+
+def ids(sections):
+    return [section.id for section in sections]
+
+
+def test_parse_render_round_trip():
+    sections = parse_sections(PRD)
+    assert render_sections(sections) == PRD
+    assert ids(sections) == ["_preamble", "prd", "prd/requisitos", "prd/requisitos/seguridad", "prd/alcance", "prd/alcance-2"]
+    assert find_section(sections, "prd/requisitos/seguridad").parent == "prd/requisitos"
+
+
+def test_replace_section_with_children_keeps_other_ids():
+    sections = parse_sections(PRD)
+    updated = replace_section(sections, "prd/requisitos", "## Requisitos\nNuevos requisitos.\n")
+    assert ids(updated) == ["_preamble", "prd", "prd/requisitos", "prd/alcance", "prd/alcance-2"]
+    assert find_section(updated, "prd/requisitos").content == "## Requisitos\nNuevos requisitos.\n"
+    assert find_section(updated, "prd/alcance-2").content == find_section(sections, "prd/alcance-2").content
+
+
+def test_replace_sections_applies_all_replacements_by_position():
+    sections = parse_sections(PRD)
+    updated = replace_sections(sections, {
+        "prd/requisitos": "## Requisitos\nA.\n\n## Alcance\nNuevo hermano.\n",
+        "prd/alcance": "## Alcance\nB.\n",
+    })
+    assert "A." in render_sections(updated) and "B." in render_sections(updated)
+
+
+def test_normalize_replaces_heading_returned_at_another_level():
+    target = find_section(parse_sections(PRD), "prd/requisitos")
+    normalized = normalize_section("### Requisitos\nnuevo\n\n## Otra\nx", target)
+    assert normalized.startswith("## Requisitos\nnuevo\n")
+    assert "### Requisitos" not in normalized
+    assert "**Otra**" in normalized
+
+
+def test_normalized_rewrite_keeps_structure_outside_the_span():
+    sections = parse_sections(PRD)
+    target = find_section(sections, "prd/requisitos")
+    rewrite = "### Requisitos\nnuevo\n\n### Rendimiento\nrápido\n\n# Otro documento\ny\n\n## Alcance\nz"
+    updated = replace_section(sections, target.id, normalize_section(rewrite, target))
+    assert ids(updated) == ["_preamble", "prd", "prd/requisitos", "prd/requisitos/rendimiento", "prd/alcance", "prd/alcance-2"]
+
+
+def test_normalize_without_subsections_flattens_every_other_heading():
+    target = find_section(parse_sections(PRD), "prd/requisitos/seguridad")
+    normalized = normalize_section("```markdown\n### Otro título\ntexto\n#### Detalle\n```", target, keep_title=True, allow_subsections=False)
+    assert normalized == "### Seguridad\ntexto\n**Detalle**\n"
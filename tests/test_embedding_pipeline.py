@@ -0,0 +1,68 @@
+import asyncio
+import uuid
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+pytest.importorskip("llama_index.vector_stores.chroma")
+
+from llama_index.core.schema import TextNode
+from llama_index.vector_stores.chroma import ChromaVectorStore
+from pydantic import PrivateAttr
+
+from embedding_pipeline import EmbeddingPipeline, existing_node_ids
+from fake_models import FakeEmbedding
+
+
+class FailingEmbedding(FakeEmbedding):
+    """Falla en el lote número fail_on (desde 1), como si el proceso se interrumpiera ahí."""
+
+    fail_on: int = 1
+    error: str = "conexión perdida"
+    _calls: int = PrivateAttr(default=0)
+
+    async def _aget_text_embeddings(self, texts):
+        self._calls += 1
+        if self._calls == self.fail_on:
+            raise RuntimeError(self.error)
+        return await super()._aget_text_embeddings(texts)
+
+
+def vector_store():
+    collection = chromadb.EphemeralClient().get_or_create_collection(f"test_{uuid.uuid4().hex}")
+    return ChromaVectorStore(chroma_collection=collection)
+
+
+def nodes(count):
+    return [TextNode(id_=f"doc:{i}", text=f"contenido del chunk {i}") for i in range(count)]
+
+
+def pipeline(embed_model, store, **kwargs):
+    return EmbeddingPipeline(embed_model, store, batch_size=2, max_concurrency=1, initial_backoff=0.0, **kwargs)
+
+
+def test_embeds_every_chunk_in_batches():
+    store = vector_store()
+    stats = asyncio.run(pipeline(FakeEmbedding(embed_dim=8, batch_latency=0.0), store).run(nodes(5)))
+    assert (stats.total_chunks, stats.embedded_chunks, stats.skipped_chunks, stats.batches) == (5, 5, 0, 3)
+    assert existing_node_ids(store) == {f"doc:{i}" for i in range(5)}
+
+
+def test_resumes_after_an_interrupted_run_without_re_embedding_stored_chunks():
+    store = vector_store()
+    failing = pipeline(FailingEmbedding(embed_dim=8, batch_latency=0.0, fail_on=2), store, max_retries=0)
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing.run(nodes(6)))
+    stored = existing_node_ids(store)
+    assert stored == {"doc:0", "doc:1"}  # El primer lote quedó guardado antes del fallo
+
+    stats = asyncio.run(pipeline(FakeEmbedding(embed_dim=8, batch_latency=0.0), store).run(nodes(6)))
+    assert (stats.skipped_chunks, stats.embedded_chunks, stats.batches) == (2, 4, 2)
+    assert existing_node_ids(store) == {f"doc:{i}" for i in range(6)}
+
+
+def test_retries_rate_limited_batches():
+    store = vector_store()
+    flaky = FailingEmbedding(embed_dim=8, batch_latency=0.0, fail_on=1, error="429 RESOURCE_EXHAUSTED")
+    stats = asyncio.run(pipeline(flaky, store).run(nodes(2)))
+    assert (stats.retries, stats.rate_limited, stats.embedded_chunks) == (1, 1, 2)
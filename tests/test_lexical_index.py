@@ -0,0 +1,25 @@
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+
+
+def test_rrf_favours_ids_ranked_well_in_several_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]])
+    assert [node_id for node_id, _ in fused] == ["b", "c", "a", "d"]
+    scores = dict(fused)
+    assert scores["b"] == 1 / 62 + 1 / 61 and scores["a"] == 1 / 61
+
+
+def test_rrf_ties_keep_first_seen_order():
+    assert [node_id for node_id, _ in reciprocal_rank_fusion([["x"], ["y"]])] == ["x", "y"]
+
+
+def test_bm25_search_and_round_trip():
+    index = LexicalIndex()
+    index.add("n1", "d1", "def export_csv(rows): escribe las filas en un CSV")
+    index.add("n2", "d2", "class SessionStore: guarda las sesiones")
+    index.add("n3", "d2", "export de sesiones a JSON")
+    assert index.search("export csv", top_k=2)[0][0] == "n1"
+
+    restored = LexicalIndex.from_dict(index.to_dict())
+    assert restored.search("export csv", top_k=2) == index.search("export csv", top_k=2)
+    restored.remove_documents(["d1"])
+    assert "n1" not in {node_id for node_id, _ in restored.search("export csv", top_k=3)}
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import PRIORITY_BACKGROUND, PRIORITY_BULK, PRIORITY_INTERACTIVE, LLMScheduler
+
+
+class Upstream:
+    """Llamada al proveedor controlada por el test: cada prompt termina cuando se libera."""
+
+    def __init__(self):
+        self.started = []
+        self.calls = 0
+        self._release = {}
+
+    def call(self, name):
+        async def run(on_token):
+            self.calls += 1
+            self.started.append(name)
+            await self._gate(name).wait()
+            return f"respuesta {name}", 10
+        return run
+
+    def _gate(self, name):
+        return self._release.setdefault(name, asyncio.Event())
+
+    def release(self, name):
+        self._gate(name).set()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def run_with_one_slot(scenario):
+    async def main():
+        scheduler = LLMScheduler(limits={"fake": (1, 0)})
+        return await scenario(scheduler, Upstream())
+    return asyncio.run(main())
+
+
+def submit(scheduler, upstream, name, priority, key=None):
+    return asyncio.ensure_future(scheduler.run("fake", key or name, 10, upstream.call(name), priority=priority))
+
+
+def test_queued_calls_run_by_priority_then_arrival():
+    async def scenario(scheduler, upstream):
+        tasks = [submit(scheduler, upstream, "busy", PRIORITY_BULK)]
+        await settle()
+        for name, priority in [("background", PRIORITY_BACKGROUND), ("bulk", PRIORITY_BULK),
+                               ("chat-1", PRIORITY_INTERACTIVE), ("chat-2", PRIORITY_INTERACTIVE)]:
+            tasks.append(submit(scheduler, upstream, name, priority))
+        await settle()
+        for name in ["busy", "chat-1", "chat-2", "bulk", "background"]:
+            upstream.release(name)
+            await settle()
+        await asyncio.gather(*tasks)
+        return upstream.started
+
+    assert run_with_one_slot(scenario) == ["busy", "chat-1", "chat-2", "bulk", "background"]
+
+
+def test_identical_prompts_share_one_call():
+    async def scenario(scheduler, upstream):
+        first = submit(scheduler, upstream, "prd", PRIORITY_BULK)
+        second = submit(scheduler, upstream, "prd", PRIORITY_BULK)
+        await settle()
+        upstream.release("prd")
+        return await asyncio.gather(first, second), upstream.calls, scheduler.coalesced
+
+    results, calls, coalesced = run_with_one_slot(scenario)
+    assert results == ["respuesta prd", "respuesta prd"]
+    assert (calls, coalesced) == (1, 1)
+
+
+def test_interactive_caller_promotes_a_queued_bulk_call():
+    async def scenario(scheduler, upstream):
+        tasks = [submit(scheduler, upstream, "busy", PRIORITY_BULK)]
+        await settle()
+        tasks.append(submit(scheduler, upstream, "other-bulk", PRIORITY_BULK))
+        tasks.append(submit(scheduler, upstream, "shared", PRIORITY_BULK))
+        await settle()
+        tasks.append(submit(scheduler, upstream, "shared", PRIORITY_INTERACTIVE))
+        await settle()
+        for name in ["busy", "shared", "other-bulk"]:
+            upstream.release(name)
+            await settle()
+        await asyncio.gather(*tasks)
+        return upstream.started
+
+    assert run_with_one_slot(scenario) == ["busy", "shared", "other-bulk"]
+
+
+def test_cancelling_every_waiter_cancels_the_call_and_frees_the_slot():
+    async def scenario(scheduler, upstream):
+        busy = submit(scheduler, upstream, "busy", PRIORITY_BULK)
+        await settle()
+        waiting = submit(scheduler, upstream, "abandoned", PRIORITY_BULK)
+        await settle()
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        upstream.release("busy")
+        await busy
+        after = submit(scheduler, upstream, "after", PRIORITY_BULK)
+        await settle()
+        upstream.release("after")
+        await after
+        return upstream.started, scheduler.stats()
+
+    started, stats = run_with_one_slot(scenario)
+    assert started == ["busy", "after"]
+    assert stats["in_flight"] == 0
+    assert stats["providers"]["fake"]["active"] == 0
+    assert stats["providers"]["fake"]["queued"] == 0
@@ -0,0 +1,45 @@
+# utils.py
+# Utilidades sin dependencias compartidas por varios módulos (indexado, recuperación, prompts y
+# benchmarks), para que ninguno tenga que importar a otro más pesado solo por ellas.
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Aproximación de los tokens de un texto (~4 caracteres por token), sin tokenizador."""
+    return len(text) // 4
+
+
+class LRUCache:
+    """Caché LRU acotada y segura entre hilos (p. ej. las consultas al índice corren en un pool de hilos)."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()